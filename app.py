@@ -4,12 +4,11 @@
 支持多模型融合智能分析
 """
 
-from flask import Flask, request, jsonify, send_from_directory, render_template, send_file
+from flask import Flask, request, jsonify, send_from_directory, render_template, send_file, Response, stream_with_context, g
 from flask_cors import CORS
 import os
 import base64
 import json
-import requests
 from datetime import datetime
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
@@ -17,16 +16,38 @@ import io
 import logging
 import cv2
 import uuid
+import time
+import atexit
+import mimetypes
+import queue
+import threading
+import hmac
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from werkzeug.utils import secure_filename
 
 # 尝试导入本地模型推理模块
 LOCAL_MODEL_AVAILABLE = False
 try:
-    from model_inference import get_model_instance, predict_image
+    from model_inference import LocalModelInference
     LOCAL_MODEL_AVAILABLE = True
 except ImportError:
     pass
 
+from batch_scheduler import MicroBatchScheduler
+from preprocessing import ImagePreprocessor, PreparedImage, map_boxes_to_original, mask_index_maps
+import mask_codec
+import visualization
+from result_writer import WriteBehindWriter
+from result_store import ResultIndex
+from inference_cache import InferenceCache, RawOutputStore, hash_bytes, hash_file, new_content_hash
+from inference_pool import InferencePool
+from remote_client import RemoteInferenceClient, RemoteInferenceError
+from inference_router import InferenceBackend, InferenceRouter
+from model_registry import ModelRegistry, ModelVersionError
+from image_decode import ImageDecoder, ImageDecodeError, original_size
+import metrics
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -43,12 +64,34 @@ CORS(app, resources={r"/api/*": {"origins": "*"}})
 USE_LOCAL_MODEL = os.environ.get('USE_LOCAL_MODEL', 'true').lower() == 'true'  # 优先使用本地模型
 MODEL_PATH = os.environ.get('MODEL_PATH', 'models/oral_health_model')  # 本地模型路径
 MODEL_CONFIG = os.environ.get('MODEL_CONFIG', 'models/model_config.json')  # 模型配置文件
+MODEL_WARMUP = os.environ.get('MODEL_WARMUP', 'true').lower() == 'true'  # 启动后在后台预热模型
+
+# 模型版本管理（热更新 / 灰度 / 影子对比）
+MODEL_VERSION = os.environ.get('MODEL_VERSION', '') or os.path.basename(MODEL_PATH)  # 启动时加载的模型版本名
+MODEL_ROOT = os.environ.get('MODEL_ROOT', os.path.dirname(MODEL_PATH) or 'models')  # 允许热加载的模型所在目录
+MODEL_ADMIN_TOKEN = os.environ.get('MODEL_ADMIN_TOKEN', '')  # 模型管理接口的令牌（X-Admin-Token），留空时禁用管理接口
+MODEL_DRAIN_TIMEOUT_S = float(os.environ.get('MODEL_DRAIN_TIMEOUT_S', 60))  # 旧版本排空超过该时间（秒）记录警告，模型保留到在途请求全部完成
+MODEL_KEEP_PREVIOUS = os.environ.get('MODEL_KEEP_PREVIOUS', 'false').lower() == 'true'  # 旧版本排空后是否保留以便立即回滚
 
 # API配置（作为备用）
 BML_API_KEY = os.environ.get('BML_API_KEY', '')  # 从环境变量获取
 BML_MODEL_ENDPOINT = os.environ.get('BML_MODEL_ENDPOINT', '')  # 模型API端点
-USE_LOCAL_MODEL = os.environ.get('USE_LOCAL_MODEL', 'true').lower() == 'true'  # 是否使用本地模型
-MODEL_PATH = os.environ.get('MODEL_PATH', 'models')  # 本地模型路径
+BML_INPUT_SIZE = int(os.environ.get('BML_INPUT_SIZE', 512))  # BML模型输入边长
+BML_CONNECT_TIMEOUT = float(os.environ.get('BML_CONNECT_TIMEOUT', 3))  # 建立连接超时（秒）
+BML_READ_TIMEOUT = float(os.environ.get('BML_READ_TIMEOUT', 30))  # 等待响应超时（秒）
+BML_MAX_CONCURRENCY = int(os.environ.get('BML_MAX_CONCURRENCY', 8))  # 同时在途请求数（连接池大小）
+BML_MAX_RETRIES = int(os.environ.get('BML_MAX_RETRIES', 2))  # 连接失败/5xx/429 的重试次数
+BML_BREAKER_FAILURES = int(os.environ.get('BML_BREAKER_FAILURES', 5))  # 连续失败多少次后熔断
+BML_BREAKER_RESET_S = float(os.environ.get('BML_BREAKER_RESET_S', 30))  # 熔断后多久放行探测请求（秒）
+BML_HEDGE_MS = os.environ.get('BML_HEDGE_MS', '0').strip().lower()  # 对冲请求等待时间（毫秒），auto取近期p95，0不对冲
+BML_PAYLOAD_FORMAT = os.environ.get('BML_PAYLOAD_FORMAT', 'auto').strip().lower()  # 图像载荷：auto / jpeg / png / raw
+BML_RAW_MAX_KB = int(os.environ.get('BML_RAW_MAX_KB', 256))  # auto模式下直接发送原始像素的最大体积（KB）
+
+# 推理路由配置（本地模型与BML端点同时可用时）
+INFERENCE_ROUTING = os.environ.get('INFERENCE_ROUTING', 'true').lower() == 'true'  # 本地饱和时是否溢出到BML端点
+ROUTER_EXPLORE_RATE = float(os.environ.get('ROUTER_EXPLORE_RATE', 0.02))  # 随机探测非最优后端的比例
+ROUTER_LOCAL_PRIOR_MS = float(os.environ.get('ROUTER_LOCAL_PRIOR_MS', 200))  # 本地模型无样本时的延迟估计（毫秒）
+ROUTER_REMOTE_PRIOR_MS = float(os.environ.get('ROUTER_REMOTE_PRIOR_MS', 500))  # BML端点无样本时的延迟估计（毫秒）
 
 # 上传文件配置
 UPLOAD_FOLDER = 'uploads'
@@ -56,20 +99,327 @@ RESULTS_FOLDER = 'results'
 SEGMENTATION_FOLDER = 'segmentation_results'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp'}
 MAX_FILE_SIZE = 20 * 1024 * 1024  # 20MB
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 上传内容分块写盘的块大小
+FAST_DECODE = os.environ.get('FAST_DECODE', 'true').lower() == 'true'  # 按模型输入尺寸降分辨率解码上传图像
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', 50_000_000))  # 允许解码的最大像素数（防解压炸弹）
+# 以原始字节直接上传图像时的Content-Type
+BINARY_UPLOAD_TYPES = {'image/jpeg', 'image/png', 'image/bmp', 'image/gif', 'application/octet-stream'}
+
+# 默认掩码编码格式：png（整幅PNG，兼容现有客户端和前端页面）；rle（游程编码）/ bitpack（位压缩）由请求的 mask_format 选择
+MASK_FORMAT = mask_codec.normalize_format(os.environ.get('MASK_FORMAT', mask_codec.DEFAULT_MASK_FORMAT))
+SAVE_MASK_FILES = os.environ.get('SAVE_MASK_FILES', 'true').lower() == 'true'  # 是否额外输出每个实例的掩码PNG
+
+# 动态批处理配置
+ENABLE_BATCHING = os.environ.get('ENABLE_BATCHING', 'true').lower() == 'true'  # 是否聚合并发请求
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 8))  # 单批最大图像数
+BATCH_MAX_WAIT_MS = float(os.environ.get('BATCH_MAX_WAIT_MS', 5))  # 凑批最长等待时间（毫秒）
+
+# 批量检测流水线配置
+BATCH_PIPELINE_WORKERS = int(os.environ.get('BATCH_PIPELINE_WORKERS', 4))  # 解码/可视化线程数
+MAX_BATCH_IMAGES = int(os.environ.get('MAX_BATCH_IMAGES', 200))  # 单次批量检测最大图像数
+
+# 异步持久化配置
+WRITE_BEHIND = os.environ.get('WRITE_BEHIND', 'true').lower() == 'true'  # 结果和图像是否后台写盘
+WRITE_QUEUE_SIZE = int(os.environ.get('WRITE_QUEUE_SIZE', 256))  # 待写队列容量，满时形成背压
+WRITE_WORKERS = int(os.environ.get('WRITE_WORKERS', 2))  # 后台写线程数
+
+# 历史结果索引（SQLite WAL）
+RESULT_INDEX_DB = os.environ.get('RESULT_INDEX_DB', os.path.join(RESULTS_FOLDER, 'index.sqlite3'))
+
+# 推理结果缓存配置（按图像内容哈希 + 模型标识 + 阈值缓存模型输出）
+INFERENCE_CACHE = os.environ.get('INFERENCE_CACHE', 'true').lower() == 'true'  # 是否启用推理缓存
+INFERENCE_CACHE_SIZE = int(os.environ.get('INFERENCE_CACHE_SIZE', 256))  # 内存层最大条目数
+INFERENCE_CACHE_DIR = os.environ.get('INFERENCE_CACHE_DIR', '')  # 磁盘层目录，留空不启用
+INFERENCE_CACHE_DISK_MB = int(os.environ.get('INFERENCE_CACHE_DISK_MB', 512))  # 磁盘层容量上限（MB）
+RAW_OUTPUT_CACHE_MB = int(os.environ.get('RAW_OUTPUT_CACHE_MB', 256))  # 保留原始输出供调整阈值的容量（MB），0为不保留
+
+# 多进程推理池配置（每个进程独立加载模型，按CPU核数分配线程并绑核）
+INFERENCE_WORKERS = os.environ.get('INFERENCE_WORKERS', '0').strip().lower()  # 推理进程数：0为进程内推理，auto按核数
+INFERENCE_THREADS_PER_WORKER = int(os.environ.get('INFERENCE_THREADS_PER_WORKER', 0))  # 每进程推理线程数，0为自动
 
 # 确保必要目录存在
-for folder in [UPLOAD_FOLDER, RESULTS_FOLDER, SEGMENTATION_FOLDER, MODEL_PATH]:
+for folder in [UPLOAD_FOLDER, RESULTS_FOLDER, SEGMENTATION_FOLDER, os.path.dirname(MODEL_PATH) or '.']:
     os.makedirs(folder, exist_ok=True)
 
+def current_rss_mb():
+    """当前进程常驻内存（MB），无法获取时返回None"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+# 模型就绪状态：disabled / unavailable / warming / ready，预热结束前 /api/ready 返回503
+model_status = {'state': 'disabled', 'load_ms': None, 'warmup_ms': None, 'rss_mb': None}
+
+def create_local_model(model_path, config_path):
+    """按部署配置创建本地模型推理器（启动时和热加载新版本时共用）"""
+    if INFERENCE_WORKERS not in ('', '0'):
+        # 推理在独立进程中执行，Web进程只做解码/预处理，不被模型计算阻塞
+        return InferencePool(
+            model_path,
+            config_path,
+            workers=0 if INFERENCE_WORKERS == 'auto' else int(INFERENCE_WORKERS),
+            threads_per_worker=INFERENCE_THREADS_PER_WORKER,
+            fallback_on_error=False
+        )
+    # 只导入模型配置中指定的框架；推理失败时抛出异常，由推理路由器记录错误并转发给其他后端
+    return LocalModelInference(model_path, config_path, fallback_on_error=False)
+
 # 初始化本地模型推理器（如果使用本地模型）
+# 启动时同步加载的模型作为注册表的第一个版本；之后的版本经 /api/models 接口在后台加载、预热后切换
 local_inference = None
-if USE_LOCAL_MODEL:
+if USE_LOCAL_MODEL and LOCAL_MODEL_AVAILABLE:
+    load_started = time.perf_counter()
     try:
-        local_inference = get_model_inference()
-        logger.info("本地模型推理器初始化成功")
+        local_inference = create_local_model(MODEL_PATH, MODEL_CONFIG)
+        model_status.update(
+            state='ready',
+            load_ms=round((time.perf_counter() - load_started) * 1000, 1),
+            rss_mb=current_rss_mb()
+        )
+        logger.info(f"本地模型推理器初始化成功: {local_inference.model_type}, "
+                    f"耗时{model_status['load_ms']}ms, 内存{model_status['rss_mb']}MB")
     except Exception as e:
         logger.error(f"本地模型推理器初始化失败: {str(e)}")
         local_inference = None
+        model_status['state'] = 'unavailable'
+
+def predict_versioned_batch(payloads):
+    """批次内的请求可能属于不同模型版本（灰度/切换期间），按版本分组后分别推理
+
+    某个版本推理失败时只有该组请求得到异常（由调度器设置到对应的Future），
+    同批其他版本的请求不受影响
+    """
+    results = [None] * len(payloads)
+    groups = {}
+    for index, (_, _, version) in enumerate(payloads):
+        groups.setdefault(id(version), []).append(index)
+    for indices in groups.values():
+        version = payloads[indices[0]][2]
+        trace = metrics.Trace()
+        try:
+            with metrics.activate(trace):
+                outputs = version.model.predict_batch(
+                    [payloads[i][0] for i in indices],
+                    [payloads[i][1] for i in indices]
+                )
+            if len(outputs) != len(indices):
+                raise ValueError(f"模型版本 {version.name} 返回{len(outputs)}个结果，期望{len(indices)}个")
+        except Exception as e:
+            logger.error(f"模型版本 {version.name} 批处理推理失败: {e}")
+            for i in indices:
+                results[i] = e
+            continue
+        for i, output in zip(indices, outputs):
+            # 批次级的预处理/前向/后处理耗时随结果返回，由请求线程并入各自的请求追踪
+            output['stage_timings'] = trace.stages
+            results[i] = output
+    return results
+
+# 在本地模型前放置微批调度器，聚合并发请求做批量推理
+batch_scheduler = None
+if local_inference is not None and ENABLE_BATCHING:
+    batch_scheduler = MicroBatchScheduler(
+        predict_versioned_batch,
+        max_batch_size=BATCH_MAX_SIZE,
+        max_wait_ms=BATCH_MAX_WAIT_MS,
+        # 推理池的每个进程都可以同时处理一个批次
+        concurrency=local_inference.num_workers if isinstance(local_inference, InferencePool) else 1
+    )
+    logger.info(f"动态批处理已启用: 最大批次{BATCH_MAX_SIZE}, 最长等待{BATCH_MAX_WAIT_MS}ms")
+
+def warmup_local_model(batch_sizes):
+    """后台预热本地模型；预热失败不影响服务，只记录错误"""
+    started = time.perf_counter()
+    try:
+        local_inference.warmup(batch_sizes)
+    except Exception as e:
+        logger.error(f"模型预热失败: {str(e)}")
+        model_status['warmup_error'] = str(e)
+    model_status.update(
+        state='ready',
+        warmup_ms=round((time.perf_counter() - started) * 1000, 1),
+        rss_mb=current_rss_mb()
+    )
+
+# 模型注册表：请求按版本分配模型并计入在途数，切换版本时旧版本排空后释放
+model_registry = ModelRegistry(
+    create_local_model,
+    # 新版本切换前按与启动时相同的批大小预热
+    warmup_batch_sizes=sorted({1, BATCH_MAX_SIZE if batch_scheduler is not None else 1}) if MODEL_WARMUP else (),
+    drain_timeout=MODEL_DRAIN_TIMEOUT_S,
+    keep_previous=MODEL_KEEP_PREVIOUS
+)
+atexit.register(model_registry.shutdown)
+if local_inference is not None:
+    model_registry.register(MODEL_VERSION, local_inference, MODEL_PATH, MODEL_CONFIG, activate=True)
+
+# 预热单张和满批两种批大小，首个真实请求不再承担算子初始化和内存分配开销
+if local_inference is not None and MODEL_WARMUP and local_inference.model_type != 'mock':
+    model_status['state'] = 'warming'
+    threading.Thread(
+        target=warmup_local_model,
+        args=(sorted({1, BATCH_MAX_SIZE if batch_scheduler is not None else 1}),),
+        name='model-warmup',
+        daemon=True
+    ).start()
+
+# 推理结果缓存：重复上传、前端重试和示例图像不再重复推理；
+# 切换模型版本后缓存自动失效。模拟模式结果随机，不做缓存
+inference_cache = None
+if local_inference is not None and INFERENCE_CACHE and local_inference.model_type != 'mock':
+    inference_cache = InferenceCache(
+        model_registry.active_fingerprint,
+        max_entries=INFERENCE_CACHE_SIZE,
+        disk_dir=INFERENCE_CACHE_DIR or None,
+        disk_max_bytes=INFERENCE_CACHE_DISK_MB * 1024 * 1024
+    )
+    logger.info(f"推理缓存已启用: 内存{INFERENCE_CACHE_SIZE}条, 磁盘{INFERENCE_CACHE_DIR or '未启用'}")
+
+# 按结果ID保留未过滤的模型输出，调整阈值时只需重新过滤
+raw_output_store = None
+if local_inference is not None and RAW_OUTPUT_CACHE_MB > 0:
+    raw_output_store = RawOutputStore(RAW_OUTPUT_CACHE_MB * 1024 * 1024)
+
+# 后写式持久化：响应先返回，文件由后台线程写盘，写完前从内存待写表提供访问
+result_writer = WriteBehindWriter(
+    max_pending=WRITE_QUEUE_SIZE,
+    workers=WRITE_WORKERS,
+    enabled=WRITE_BEHIND
+)
+atexit.register(result_writer.shutdown)
+
+# 历史结果索引；首次启动时在后台导入已有的结果文件
+result_index = ResultIndex(RESULT_INDEX_DB)
+if not result_index.is_migrated():
+    threading.Thread(
+        target=result_index.migrate_from_folder,
+        args=(RESULTS_FOLDER,),
+        name='result-index-migration',
+        daemon=True
+    ).start()
+
+# 批量检测流水线线程池：解码与可视化/持久化走CPU线程池，
+# 推理线程数与最大批次一致，使并发请求能在调度器中凑满一批
+pipeline_executor = ThreadPoolExecutor(max_workers=BATCH_PIPELINE_WORKERS, thread_name_prefix='batch-pipeline')
+inference_executor = ThreadPoolExecutor(max_workers=max(1, BATCH_MAX_SIZE), thread_name_prefix='batch-inference')
+
+# BML模型输入预处理：保持长宽比缩放后居中填充黑边
+# PaddleDetection模型常用尺寸：yolo 640x640，mask_rcnn 短边800/长边1333，默认512x512
+bml_preprocessor = ImagePreprocessor((BML_INPUT_SIZE, BML_INPUT_SIZE), letterbox=True)
+
+# BML模型API客户端：复用keep-alive连接，限制并发，远端故障时熔断快速回退
+bml_client = None
+if BML_MODEL_ENDPOINT:
+    bml_client = RemoteInferenceClient(
+        BML_MODEL_ENDPOINT,
+        BML_API_KEY,
+        timeout=(BML_CONNECT_TIMEOUT, BML_READ_TIMEOUT),
+        max_concurrency=BML_MAX_CONCURRENCY,
+        max_retries=BML_MAX_RETRIES,
+        breaker_failures=BML_BREAKER_FAILURES,
+        breaker_reset=BML_BREAKER_RESET_S,
+        hedge_after_ms=BML_HEDGE_MS if BML_HEDGE_MS == 'auto' else float(BML_HEDGE_MS or 0),
+        payload_format=BML_PAYLOAD_FORMAT,
+        raw_max_bytes=BML_RAW_MAX_KB * 1024
+    )
+    atexit.register(bml_client.close)
+
+# 上传图像解码：JPEG在DCT域直接解出接近模型输入尺寸的小图，解码前按文件头尺寸拒绝超大图像
+image_decoder = ImageDecoder(max_pixels=MAX_IMAGE_PIXELS, reduce=FAST_DECODE)
+
+# 推理路由：本地模型与BML端点都可用时，按在途请求数和近期延迟选择预计最快完成的后端，
+# 本地模型饱和时请求溢出到远程端点
+inference_backends = []
+if USE_LOCAL_MODEL and local_inference is not None:
+    inference_backends.append(InferenceBackend(
+        'local',
+        lambda image, options: _run_local_backend(image, options),
+        # 批处理时一批图像一起完成，推理池的每个进程各处理一批
+        capacity=(BATCH_MAX_SIZE if batch_scheduler is not None else 1) * getattr(local_inference, 'num_workers', 1),
+        initial_latency_ms=ROUTER_LOCAL_PRIOR_MS,
+        # 预热期间优先使用其他后端
+        is_available=lambda: is_ready() or len(inference_backends) == 1
+    ))
+if bml_client is not None and (INFERENCE_ROUTING or not inference_backends):
+    inference_backends.append(InferenceBackend(
+        'remote',
+        lambda image, options: _run_remote_backend(image, options),
+        capacity=BML_MAX_CONCURRENCY,
+        initial_latency_ms=ROUTER_REMOTE_PRIOR_MS,
+        # 熔断器打开期间不参与路由
+        is_available=lambda: bml_client.breaker.state != 'open'
+    ))
+inference_router = InferenceRouter(
+    inference_backends,
+    fallback=lambda image, options: simulate_segmentation_detection(image, options),
+    explore_rate=ROUTER_EXPLORE_RATE
+)
+
+# 监控指标：HTTP请求计数和耗时在请求钩子中更新，队列/在途等仪表值在导出时从各组件读取
+HTTP_REQUESTS = metrics.registry.counter('http_requests_total', 'HTTP请求数', ('method', 'endpoint', 'status'))
+HTTP_DURATION = metrics.registry.histogram('http_request_duration_seconds', 'HTTP请求耗时', ('method', 'endpoint'))
+
+def observe_http_request(method, endpoint, status, seconds):
+    """记录一次HTTP请求（WSGI与ASGI服务共用），endpoint为路由规则而不是实际路径"""
+    HTTP_DURATION.observe(seconds, (method, endpoint))
+    HTTP_REQUESTS.inc((method, endpoint, str(status)))
+
+def collect_service_metrics():
+    """各组件当前状态的仪表值和累计计数（Prometheus collector）"""
+    yield 'model_ready', 'gauge', '本地模型是否已完成加载和预热', [({}, is_ready())]
+    if batch_scheduler is not None:
+        stats = batch_scheduler.get_stats()
+        yield 'batch_queue_depth', 'gauge', '微批调度器排队中的请求数', [({}, stats['queue_depth'])]
+        yield 'batch_requests_total', 'counter', '经微批调度器推理的请求数', [({}, stats['total_requests'])]
+        yield 'batch_batches_total', 'counter', '微批调度器执行的批次数', [({}, stats['total_batches'])]
+    stats = result_writer.get_stats()
+    yield 'result_writer_queue_depth', 'gauge', '后台写盘队列长度', [({}, stats['queue_depth'])]
+    yield 'result_writer_pending', 'gauge', '尚未落盘的文件数', [({}, stats['pending'])]
+    yield 'result_writer_writes_total', 'counter', '后台写盘次数', [
+        ({'outcome': 'written'}, stats['written']), ({'outcome': 'failed'}, stats['failed'])]
+    if inference_cache is not None:
+        stats = inference_cache.get_stats()
+        yield 'inference_cache_lookups_total', 'counter', '推理缓存查询次数', [
+            ({'result': 'hit'}, stats['hits']), ({'result': 'miss'}, stats['misses'])]
+    backends = inference_router.get_stats()['backends']
+    yield 'inference_backend_inflight', 'gauge', '各推理后端的在途请求数', [
+        ({'backend': name}, backend['inflight']) for name, backend in backends.items()]
+    yield 'inference_backend_available', 'gauge', '推理后端是否可用', [
+        ({'backend': name}, backend['available']) for name, backend in backends.items()]
+    yield 'inference_backend_requests_total', 'counter', '各推理后端处理的请求数', [
+        ({'backend': name}, backend['requests']) for name, backend in backends.items()]
+    yield 'inference_backend_errors_total', 'counter', '各推理后端失败的请求数', [
+        ({'backend': name}, backend['errors']) for name, backend in backends.items()]
+    versions = model_registry.get_stats()['versions']
+    yield 'model_version_inflight', 'gauge', '各模型版本的在途请求数', [
+        ({'version': name, 'state': version['state']}, version['inflight']) for name, version in versions.items()]
+    yield 'model_version_requests_total', 'counter', '各模型版本处理的请求数', [
+        ({'version': name}, version['requests']) for name, version in versions.items()]
+    active = model_registry.active
+    if active is not None and isinstance(active.model, InferencePool):
+        workers = active.model.get_stats()['workers']
+        yield 'inference_pool_inflight', 'gauge', '推理池各工作进程的在途批次数', [
+            ({'worker': worker['index']}, worker['inflight']) for worker in workers]
+
+metrics.registry.register_collector(collect_service_metrics)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """按路由规则记录HTTP请求计数和耗时"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        observe_http_request(request.method, endpoint, response.status_code, time.perf_counter() - started)
+    return response
 
 def allowed_file(filename):
     """检查文件扩展名是否允许"""
@@ -92,31 +442,166 @@ def serve_static(path):
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """健康检查接口"""
-    return jsonify({
+    return jsonify(build_health_status())
+
+def build_health_status():
+    """健康检查内容（WSGI与ASGI服务共用）"""
+    active_model = model_registry.active.model if model_registry.active is not None else None
+    return {
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
-        'model_connected': bool(BML_MODEL_ENDPOINT) or (USE_LOCAL_MODEL and local_inference is not None),
+        'model_connected': bool(BML_MODEL_ENDPOINT) or (USE_LOCAL_MODEL and active_model is not None),
         'model_type': 'instance_segmentation',
         'supported_classes': ['观察', '手术'],
         'use_local_model': USE_LOCAL_MODEL,
-        'local_model_available': local_inference is not None if USE_LOCAL_MODEL else False,
-        'model_path': MODEL_PATH if USE_LOCAL_MODEL else None
-    })
+        'local_model_available': active_model is not None if USE_LOCAL_MODEL else False,
+        'model_path': model_registry.active.model_path if USE_LOCAL_MODEL and active_model is not None else None,
+        'model_version': model_registry.active.name if active_model is not None else None,
+        'ready': is_ready(),
+        'model_status': model_status,
+        'batching': batch_scheduler.get_stats() if batch_scheduler is not None else None,
+        'persistence': result_writer.get_stats(),
+        'inference_cache': inference_cache.get_stats() if inference_cache is not None else None,
+        'raw_outputs': raw_output_store.get_stats() if raw_output_store is not None else None,
+        'inference_pool': active_model.get_stats() if isinstance(active_model, InferencePool) else None,
+        'models': model_registry.get_stats(),
+        'remote_client': bml_client.get_stats() if bml_client is not None else None,
+        'routing': inference_router.get_stats()
+    }
+
+def is_ready():
+    """本地模型加载和预热完成（或未启用本地模型）后视为就绪"""
+    return model_status['state'] != 'warming'
+
+@app.route('/api/ready', methods=['GET'])
+def readiness_check():
+    """就绪检查：模型预热完成前返回503，供负载均衡器/编排系统判断何时开始转发流量"""
+    return jsonify({'ready': is_ready(), 'model_status': model_status}), 200 if is_ready() else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus指标：各阶段耗时与HTTP请求直方图、计数器，以及队列深度/在途请求等仪表值"""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/routing', methods=['GET'])
+def routing_status():
+    """推理路由状态：各后端的在途请求、延迟直方图和最近的路由决策"""
+    recent = request.args.get('recent', 50, type=int)
+    return jsonify(inference_router.get_stats(recent=max(0, min(recent, 100))))
+
+def check_model_admin():
+    """模型管理接口的令牌校验；未配置令牌时拒绝所有管理请求（接口允许任意来源跨域访问）"""
+    if not MODEL_ADMIN_TOKEN:
+        return jsonify({'error': '模型管理接口未启用（未配置MODEL_ADMIN_TOKEN）'}), 403
+    token = request.headers.get('X-Admin-Token', '')
+    if not hmac.compare_digest(token.encode(), MODEL_ADMIN_TOKEN.encode()):
+        return jsonify({'error': '无权限'}), 403
+    if not (USE_LOCAL_MODEL and LOCAL_MODEL_AVAILABLE):
+        return jsonify({'error': '未启用本地模型'}), 400
+    return None
+
+@app.route('/api/models', methods=['GET'])
+def list_models():
+    """模型版本列表：当前/灰度/影子版本，各版本的状态、在途请求数和延迟统计"""
+    return jsonify(model_registry.get_stats())
+
+@app.route('/api/models', methods=['POST'])
+def load_model_version():
+    """在后台加载新模型版本，预热完成后（activate为true时）切换流量，不中断服务
+    
+    请求JSON: {"name": "v2", "model_path": "models/v2/model", "config_path": "models/v2/model_config.json",
+               "activate": true}
+    """
+    denied = check_model_admin()
+    if denied:
+        return denied
+    data = request.get_json(silent=True) or {}
+    name = str(data.get('name') or '').strip()
+    model_path = data.get('model_path') or ''
+    config_path = data.get('config_path') or MODEL_CONFIG
+    if not name or not model_path:
+        return jsonify({'error': '缺少 name 或 model_path'}), 400
+    # 只允许加载模型目录下的文件
+    root = os.path.realpath(MODEL_ROOT)
+    for path in (model_path, config_path):
+        if os.path.commonpath([root, os.path.realpath(path)]) != root:
+            return jsonify({'error': f'路径不在模型目录 {MODEL_ROOT} 下: {path}'}), 400
+    try:
+        model_registry.load(name, model_path, config_path, activate=bool(data.get('activate', True)))
+    except ModelVersionError as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify(model_registry.get_stats()), 202
+
+@app.route('/api/models/<name>/activate', methods=['POST'])
+def activate_model_version(name):
+    """把已加载的版本切换为当前版本（也用于回滚到standby版本）"""
+    denied = check_model_admin()
+    if denied:
+        return denied
+    try:
+        model_registry.activate(name)
+    except ModelVersionError as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify(model_registry.get_stats())
+
+@app.route('/api/models/<name>', methods=['DELETE'])
+def unload_model_version(name):
+    """卸载非当前版本，在途请求完成后释放内存"""
+    denied = check_model_admin()
+    if denied:
+        return denied
+    try:
+        model_registry.unload(name)
+    except ModelVersionError as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify(model_registry.get_stats())
+
+@app.route('/api/models/traffic', methods=['POST'])
+def set_model_traffic():
+    """设置灰度/影子版本
+    
+    请求JSON: {"canary": "v2", "canary_weight": 0.1, "shadow": "v3", "shadow_rate": 1.0}，
+    版本名为null时取消对应设置，未出现的字段保持不变
+    """
+    denied = check_model_admin()
+    if denied:
+        return denied
+    data = request.get_json(silent=True) or {}
+    try:
+        if 'canary' in data:
+            model_registry.set_canary(data['canary'], float(data.get('canary_weight', 0.1)))
+        if 'shadow' in data:
+            model_registry.set_shadow(data['shadow'], float(data.get('shadow_rate', 1.0)))
+    except ValueError as e:
+        return jsonify({'error': f'参数错误：{str(e)}'}), 400
+    except ModelVersionError as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify(model_registry.get_stats())
 
 @app.route('/api/upload', methods=['POST'])
 def upload_image():
     """上传图像接口"""
+    payload, status = handle_upload(request.files.get('image'))
+    return jsonify(payload), status
+
+def handle_upload(file):
+    """保存上传的图像文件（WSGI与ASGI服务共用）
+    
+    Args:
+        file: werkzeug FileStorage，没有文件时为None
+    
+    Returns:
+        (响应内容, HTTP状态码)
+    """
     try:
-        if 'image' not in request.files:
-            return jsonify({'error': '没有找到图像文件'}), 400
-        
-        file = request.files['image']
+        if file is None:
+            return {'error': '没有找到图像文件'}, 400
         
         if file.filename == '':
-            return jsonify({'error': '未选择文件'}), 400
+            return {'error': '未选择文件'}, 400
         
         if not allowed_file(file.filename):
-            return jsonify({'error': '不支持的文件格式'}), 400
+            return {'error': '不支持的文件格式'}, 400
         
         # 检查文件大小
         file.seek(0, os.SEEK_END)
@@ -124,7 +609,7 @@ def upload_image():
         file.seek(0)
         
         if file_size > MAX_FILE_SIZE:
-            return jsonify({'error': f'文件大小超过限制（最大{MAX_FILE_SIZE//1024//1024}MB）'}), 400
+            return {'error': f'文件大小超过限制（最大{MAX_FILE_SIZE//1024//1024}MB）'}, 400
         
         # 生成唯一文件名
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -132,468 +617,869 @@ def upload_image():
         filename = f"{timestamp}_{uuid.uuid4().hex[:8]}.{file_ext}"
         filepath = os.path.join(UPLOAD_FOLDER, filename)
         
-        # 保存文件
-        file.save(filepath)
+        # 读取上传内容交给后台写盘（兼容Flask与Quart的FileStorage，后者的save是协程）
+        result_writer.submit(filepath, file.read())
         
         # 生成预览URL
         preview_url = f"/uploads/{filename}"
         
-        return jsonify({
+        return {
             'success': True,
             'filename': filename,
             'path': filepath,
             'preview_url': preview_url,
             'upload_time': datetime.now().isoformat()
-        })
+        }, 200
     
     except Exception as e:
         logger.error(f"上传错误: {str(e)}")
-        return jsonify({'error': '文件上传失败'}), 500
+        return {'error': '文件上传失败'}, 500
+
+def send_pending_or_file(folder, filename):
+    """文件尚在后台写入队列中时直接从内存返回，否则从磁盘提供"""
+    pending = result_writer.get_pending_bytes(os.path.join(folder, secure_filename(filename)))
+    if pending is not None:
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        return Response(pending, mimetype=mimetype)
+    return send_from_directory(folder, filename)
+
+def check_upload_size(size):
+    """上传内容超过大小限制时抛出ValueError"""
+    if size > MAX_FILE_SIZE:
+        raise ValueError(f'文件大小超过限制（最大{MAX_FILE_SIZE//1024//1024}MB）')
+
+def new_upload_part_path():
+    """接收中的上传文件路径，格式确认后由 finalize_upload 改名"""
+    return os.path.join(UPLOAD_FOLDER, f"upload_{uuid.uuid4().hex}.part")
+
+def save_upload_stream(stream):
+    """把上传内容分块写入上传目录，同时计算内容哈希，整个文件不在内存中停留
+    
+    Args:
+        stream: 可read的文件对象（werkzeug请求体或multipart文件流）
+    
+    Returns:
+        (文件名, 文件路径, 内容哈希)
+    
+    Raises:
+        ValueError: 超过大小限制、内容为空或不是支持的图像格式
+    """
+    part_path = new_upload_part_path()
+    digest = new_content_hash()
+    size = 0
+    try:
+        with open(part_path, 'wb') as f:
+            for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b''):
+                size += len(chunk)
+                check_upload_size(size)
+                digest.update(chunk)
+                f.write(chunk)
+        return finalize_upload(part_path, digest.hexdigest(), size)
+    except Exception:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+def image_file_extension(source):
+    """按文件头识别图像格式，返回对应扩展名（只读取文件头）"""
+    with image_decoder.open(source) as probe:
+        return {'JPEG': 'jpg'}.get(probe.format, (probe.format or '').lower())
+
+def finalize_upload(part_path, content_hash, size):
+    """按图像实际格式（而不是客户端声明的类型）为接收完的上传文件命名"""
+    if size == 0:
+        raise ValueError('缺少图像数据')
+    file_ext = image_file_extension(part_path)
+    if file_ext not in ALLOWED_EXTENSIONS:
+        raise ValueError('不支持的文件格式')
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    filename = f"temp_{timestamp}_{uuid.uuid4().hex[:8]}.{file_ext}"
+    filepath = os.path.join(UPLOAD_FOLDER, filename)
+    os.replace(part_path, filepath)
+    return filename, filepath, content_hash
+
+def decode_min_size():
+    """解码上传图像时至少保留的尺寸：各推理后端模型输入尺寸的最大值，
+    任一后端需要原分辨率（如分块推理）时返回None"""
+    sizes = []
+    for backend in inference_backends:
+        if backend.name == 'remote':
+            sizes.append(bml_preprocessor.input_size)
+            continue
+        for version in model_registry.servable_versions():
+            size = version.model.decode_size()
+            if size is None:
+                return None
+            sizes.append(size)
+    if not sizes:
+        return None
+    return max(width for width, _ in sizes), max(height for _, height in sizes)
+
+def decode_image(source):
+    """解码上传图像（路径或文件对象），之后的推理和可视化都使用返回的内存图像
+    
+    Raises:
+        ImageDecodeError: 无法识别或尺寸超过 MAX_IMAGE_PIXELS
+    """
+    return image_decoder.decode(source, decode_min_size())
+
+def open_uploaded_image(filepath):
+    """解码已上传的图像，文件仍在待写队列时从内存读取；不存在返回None"""
+    pending = result_writer.get_pending_bytes(filepath)
+    if pending is not None:
+        return decode_image(io.BytesIO(pending))
+    if not os.path.exists(filepath):
+        return None
+    return decode_image(filepath)
+
+def compute_image_hash(filepath=None, content=None):
+    """计算图像内容哈希作为推理缓存键；未启用缓存时返回None"""
+    if inference_cache is None:
+        return None
+    if content is None:
+        content = result_writer.get_pending_bytes(filepath)
+    if content is not None:
+        return hash_bytes(content)
+    if filepath and os.path.exists(filepath):
+        return hash_file(filepath)
+    return None
 
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
     """提供上传文件的访问"""
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    return send_pending_or_file(UPLOAD_FOLDER, filename)
 
 @app.route('/segmentation_results/<filename>')
 def segmentation_file(filename):
     """提供分割结果文件的访问"""
-    return send_from_directory(SEGMENTATION_FOLDER, filename)
+    return send_pending_or_file(SEGMENTATION_FOLDER, filename)
 
 @app.route('/api/detect', methods=['POST'])
 def detect_disease():
-    """AI检测接口 - 支持实例分割"""
+    """AI检测接口 - 支持实例分割
+    
+    支持三种请求体：
+    - multipart/form-data，image字段为图像文件，检测参数为表单字段
+    - 原始图像字节（Content-Type为image/*或application/octet-stream），检测参数放在查询串中
+    - JSON，image为base64图像或filename为已上传的文件名（兼容旧客户端）
+    """
+    upload = None
+    trace = metrics.Trace()
     try:
-        data = request.json
-        
-        if 'image' not in data and 'filename' not in data:
-            return jsonify({'error': '缺少图像数据'}), 400
+        with metrics.activate(trace):
+            if request.mimetype == 'multipart/form-data':
+                data = request.form.to_dict()
+                file = request.files.get('image')
+                if file is not None and file.filename:
+                    with metrics.span('upload'):
+                        upload = save_upload_stream(file.stream)
+            elif request.mimetype in BINARY_UPLOAD_TYPES:
+                data = request.args.to_dict()
+                with metrics.span('upload'):
+                    upload = save_upload_stream(request.stream)
+            else:
+                data = request.get_json(silent=True)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    payload, status = handle_detect(data, upload, trace)
+    return jsonify(payload), status
+
+def handle_detect(data, upload=None, trace=None):
+    """执行一次检测请求（WSGI与ASGI服务共用）
+    
+    Args:
+        data: 请求参数（JSON、表单字段或查询参数），包含 image（base64）或 filename 以及检测参数
+        upload: 已由 save_upload_stream / finalize_upload 写盘的上传 (文件名, 文件路径, 内容哈希)
+        trace: 请求追踪（已记录接收上传的耗时），缺省新建；各阶段耗时写入 details.stages_ms
+    
+    Returns:
+        (响应内容, HTTP状态码)
+    """
+    with metrics.activate(trace or metrics.Trace()) as trace:
+        return _run_detect(data, upload, trace)
+
+def _run_detect(data, upload, trace):
+    """handle_detect 的主体，在请求追踪激活的线程上执行"""
+    try:
+        data = data or {}
+        if upload is None and 'image' not in data and 'filename' not in data:
+            return {'error': '缺少图像数据'}, 400
         
-        # 获取检测参数
+        # 获取检测参数（表单和查询参数的值都是字符串）
         options = {
-            'confidence_threshold': data.get('confidence_threshold', 0.5),
-            'nms_threshold': data.get('nms_threshold', 0.5),
+            'confidence_threshold': float(data.get('confidence_threshold', 0.5)),
+            'nms_threshold': float(data.get('nms_threshold', 0.5)),
             'include_segmentation': True,  # 实例分割总是返回分割掩码
-            'include_visualization': data.get('include_visualization', True)
+            'include_visualization': str(data.get('include_visualization', True)).lower() != 'false',
+            'mask_format': mask_codec.normalize_format(data.get('mask_format', MASK_FORMAT)),
+            'full_masks': str(data.get('full_masks', False)).lower() == 'true',  # 仅在客户端明确要求时输出整幅掩码
+            'model_version': data.get('model_version')  # 指定模型版本（对比/灰度验证），缺省由注册表分配
         }
+        if options['model_version'] and model_registry.get(options['model_version']) is None:
+            return {'error': f"模型版本不存在: {options['model_version']}"}, 400
         
         # 处理图像
-        if 'image' in data:
+        if upload is not None:
+            # 上传字节已原样写盘并在接收时算好哈希；这里只打开文件，
+            # 解码后的图像在内存中交给推理和可视化，不再读回或重新编码
+            temp_filename, temp_filepath, content_hash = upload
+            with metrics.span('decode'):
+                image = decode_image(temp_filepath)
+            options['image_hash'] = content_hash if inference_cache is not None else None
+            
+        elif 'image' in data:
             # Base64图像
             image_data = data['image']
             if 'base64,' in image_data:
                 image_data = image_data.split('base64,')[1]
             
             # 解码图像
-            image_bytes = base64.b64decode(image_data)
-            image = Image.open(io.BytesIO(image_bytes))
+            with metrics.span('decode'):
+                image_bytes = base64.b64decode(image_data)
+                image = decode_image(io.BytesIO(image_bytes))
             
-            # 保存临时文件用于处理
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            temp_filename = f"temp_{timestamp}_{uuid.uuid4().hex[:8]}.jpg"
-            temp_filepath = os.path.join(UPLOAD_FOLDER, temp_filename)
-            image.save(temp_filepath)
+            # 原始字节交给后台写盘，不再同步重新编码
+            with metrics.span('save_upload'):
+                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+                file_ext = image_file_extension(io.BytesIO(image_bytes)) or 'jpg'
+                temp_filename = f"temp_{timestamp}_{uuid.uuid4().hex[:8]}.{file_ext}"
+                temp_filepath = os.path.join(UPLOAD_FOLDER, temp_filename)
+                result_writer.submit(temp_filepath, image_bytes)
+            with metrics.span('hash'):
+                options['image_hash'] = compute_image_hash(content=image_bytes)
             
         elif 'filename' in data:
             # 从文件路径读取
             temp_filename = data['filename']
             temp_filepath = os.path.join(UPLOAD_FOLDER, temp_filename)
-            if not os.path.exists(temp_filepath):
-                return jsonify({'error': '文件不存在'}), 404
-            image = Image.open(temp_filepath)
-        
-        # 预处理图像
-        processed_image = preprocess_image_for_segmentation(image)
-        
-        # 选择推理方式：优先使用本地模型
-        if USE_LOCAL_MODEL and local_inference is not None:
-            # 使用本地模型进行推理
-            detection_result = call_local_segmentation_model(image, options)
-        elif BML_MODEL_ENDPOINT:
-            # 使用BML API进行推理
-            detection_result = call_bml_segmentation_model(processed_image, image, options)
-        else:
-            # 模拟检测结果（用于测试）
-            detection_result = simulate_segmentation_detection(image)
+            with metrics.span('decode'):
+                image = open_uploaded_image(temp_filepath)
+            if image is None:
+                return {'error': '文件不存在'}, 404
+            with metrics.span('hash'):
+                options['image_hash'] = compute_image_hash(temp_filepath)
+        
+        # 执行推理
+        detection_result = run_segmentation_inference(image, options)
         
         # 如果有分割结果，生成可视化图像
         if detection_result.get('segmentation_masks'):
-            visualization_result = create_segmentation_visualization(
-                temp_filepath,
-                detection_result['segmentation_masks'],
-                detection_result.get('class_labels', [])
-            )
+            with metrics.span('visualization'):
+                visualization_result = create_segmentation_visualization(
+                    image,
+                    detection_result['segmentation_masks'],
+                    detection_result.get('class_labels', [])
+                )
             detection_result['visualization_url'] = visualization_result['url']
             detection_result['mask_urls'] = visualization_result['mask_urls']
         
+        # 实际处理耗时和各阶段耗时（结果随后交给后台写盘，之后不再修改）
+        detection_result.setdefault('details', {}).update(trace.details())
+        
         # 保存检测结果
-        result_id = save_detection_result(detection_result, temp_filename)
+        with metrics.span('save_result'):
+            result_id = save_detection_result(detection_result, temp_filename)
         
-        return jsonify({
+        return {
             'success': True,
             'result_id': result_id,
             'detection': detection_result,
             'timestamp': datetime.now().isoformat()
-        })
+        }, 200
     
+    except ImageDecodeError as e:
+        return {'error': str(e)}, 400
     except Exception as e:
         logger.error(f"检测错误: {str(e)}")
-        return jsonify({'error': f'检测失败：{str(e)}'}), 500
+        return {'error': f'检测失败：{str(e)}'}, 500
+
+def run_segmentation_inference(image, options=None):
+    """经推理路由器执行实例分割
+    
+    请求发往预计完成时间最短的后端（本地模型 / BML API），失败时转发给其余后端，
+    都不可用时返回模拟结果。预处理只为选中的后端惰性执行一次
+    """
+    return inference_router.run(image, options)
+
+def _run_local_backend(image, options):
+    """本地模型后端：从注册表取得本次请求的模型版本，按该版本的输入配置预处理"""
+    with model_registry.lease((options or {}).get('model_version')) as version:
+        return call_local_segmentation_model(version.model.prepare(image), options, fallback=False, version=version)
+
+def _run_remote_backend(image, options):
+    """BML API后端：保持长宽比缩放到BML模型输入尺寸"""
+    with metrics.span('remote_inference'):
+        return call_bml_segmentation_model(PreparedImage(image, bml_preprocessor), options, fallback=False)
+
+@app.route('/api/batch', methods=['POST'])
+def batch_detect():
+    """批量检测接口
+    
+    支持两种输入：
+    - multipart/form-data，字段images携带多个图像文件
+    - JSON，filenames为已通过/api/upload上传的文件名列表
+    
+    请求头Accept包含application/x-ndjson或查询参数stream=1时，
+    每张图像处理完成即以NDJSON逐行返回；否则汇总后返回JSON
+    """
+    try:
+        items = []
+        if request.files:
+            for file in request.files.getlist('images'):
+                if not file or file.filename == '':
+                    continue
+                # 在请求上下文内读出文件内容，流式响应阶段请求体已不可用
+                items.append((file.filename, file.read()))
+            options = request.form.to_dict()
+        else:
+            data = request.get_json(silent=True) or {}
+            for name in data.get('filenames', []):
+                items.append((name, None))
+            options = data
+        
+        if not items:
+            return jsonify({'error': '缺少图像数据'}), 400
+        if len(items) > MAX_BATCH_IMAGES:
+            return jsonify({'error': f'单次最多检测{MAX_BATCH_IMAGES}张图像'}), 400
+        
+        options = {
+            'confidence_threshold': float(options.get('confidence_threshold', 0.5)),
+            'nms_threshold': float(options.get('nms_threshold', 0.5)),
+            'include_segmentation': True,
+            'include_visualization': str(options.get('include_visualization', True)).lower() != 'false',
+            'mask_format': mask_codec.normalize_format(options.get('mask_format', MASK_FORMAT)),
+            'full_masks': str(options.get('full_masks', False)).lower() == 'true'
+        }
+        
+        stream = 'application/x-ndjson' in request.headers.get('Accept', '') or \
+            request.args.get('stream', '').lower() in ('1', 'true')
+        
+        if stream:
+            def generate():
+                for line in run_batch_pipeline(items, options):
+                    yield json.dumps(line, ensure_ascii=False, default=_json_default) + '\n'
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        
+        results = sorted(run_batch_pipeline(items, options), key=lambda r: r['index'])
+        return jsonify({
+            'success': True,
+            'total': len(results),
+            'results': results,
+            'timestamp': datetime.now().isoformat()
+        })
+    
+    except Exception as e:
+        logger.error(f"批量检测错误: {str(e)}")
+        return jsonify({'error': f'批量检测失败：{str(e)}'}), 500
+
+def _json_default(value):
+    """JSON序列化numpy标量"""
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"无法序列化类型: {type(value)}")
+
+def run_batch_pipeline(items, options):
+    """批量检测流水线
+    
+    解码、推理、可视化与持久化三个阶段相互重叠：解码和可视化在
+    pipeline_executor线程池执行，推理在inference_executor中并发提交，
+    由微批调度器合并为批量模型调用。按完成顺序逐个产出结果。
+    
+    Args:
+        items: (文件名, 图像字节或None) 列表，None表示从上传目录读取
+        options: 检测参数
+    """
+    completed = queue.Queue()
+    started = time.perf_counter()
+    
+    def emit_error(index, filename, error):
+        logger.error(f"批量检测第{index}张图像({filename})失败: {error}")
+        completed.put({'index': index, 'filename': filename, 'success': False, 'error': str(error)})
+    
+    def on_finished(future, index, filename):
+        try:
+            completed.put(future.result())
+        except Exception as e:
+            emit_error(index, filename, e)
+    
+    def on_inferred(future, ctx):
+        try:
+            ctx['detection'] = future.result()
+        except Exception as e:
+            return emit_error(ctx['index'], ctx['filename'], e)
+        pipeline_executor.submit(_batch_finish_stage, ctx, options).add_done_callback(
+            partial(on_finished, index=ctx['index'], filename=ctx['filename']))
+    
+    def on_decoded(future, index, filename):
+        try:
+            ctx = future.result()
+        except Exception as e:
+            return emit_error(index, filename, e)
+        item_options = dict(options, image_hash=ctx['image_hash'])
+        inference_executor.submit(metrics.run_traced, ctx['trace'], run_segmentation_inference,
+                                  ctx['image'], item_options).add_done_callback(partial(on_inferred, ctx=ctx))
+    
+    for index, (filename, content) in enumerate(items):
+        pipeline_executor.submit(_batch_decode_stage, index, filename, content).add_done_callback(
+            partial(on_decoded, index=index, filename=filename))
+    
+    for _ in range(len(items)):
+        result = completed.get()
+        result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        yield result
+
+def _batch_decode_stage(index, filename, content):
+    """流水线解码阶段：保存原始字节并解码图像；每张图像的请求追踪从这里开始，随ctx传给后续阶段"""
+    trace = metrics.Trace()
+    with metrics.activate(trace):
+        if content is None:
+            # 已上传文件
+            stored_filename = secure_filename(filename)
+            filepath = os.path.join(UPLOAD_FOLDER, stored_filename)
+            with metrics.span('decode'):
+                image = open_uploaded_image(filepath) if stored_filename else None
+            if image is None:
+                raise FileNotFoundError('文件不存在')
+            with metrics.span('hash'):
+                image_hash = compute_image_hash(filepath)
+        else:
+            if not allowed_file(filename):
+                raise ValueError('不支持的文件格式')
+            if len(content) > MAX_FILE_SIZE:
+                raise ValueError(f'文件大小超过限制（最大{MAX_FILE_SIZE//1024//1024}MB）')
+            
+            # 原样保存上传字节，避免重新编码；写盘交给后台写入器
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            file_ext = filename.rsplit('.', 1)[1].lower()
+            stored_filename = f"{timestamp}_{uuid.uuid4().hex[:8]}.{file_ext}"
+            filepath = os.path.join(UPLOAD_FOLDER, stored_filename)
+            with metrics.span('save_upload'):
+                result_writer.submit(filepath, content)
+            with metrics.span('decode'):
+                image = decode_image(io.BytesIO(content))
+            with metrics.span('hash'):
+                image_hash = compute_image_hash(content=content)
+    
+    return {
+        'trace': trace,
+        'index': index,
+        'filename': filename,
+        'stored_filename': stored_filename,
+        'filepath': filepath,
+        'image': image,
+        'image_hash': image_hash
+    }
+
+def _batch_finish_stage(ctx, options):
+    """流水线收尾阶段：生成可视化并保存检测结果"""
+    detection_result = ctx['detection']
+    trace = ctx['trace']
+    
+    with metrics.activate(trace):
+        if options.get('include_visualization', True) and detection_result.get('segmentation_masks'):
+            with metrics.span('visualization'):
+                visualization_result = create_segmentation_visualization(
+                    ctx['image'],
+                    detection_result['segmentation_masks'],
+                    detection_result.get('class_labels', [])
+                )
+            detection_result['visualization_url'] = visualization_result['url']
+            detection_result['mask_urls'] = visualization_result['mask_urls']
+        
+        # 从解码开始的处理耗时（不含在流水线中排队等待解码的时间）和各阶段耗时
+        detection_result.setdefault('details', {}).update(trace.details())
+        with metrics.span('save_result'):
+            result_id = save_detection_result(detection_result, ctx['stored_filename'])
+    
+    return {
+        'index': ctx['index'],
+        'filename': ctx['filename'],
+        'success': True,
+        'result_id': result_id,
+        'detection': detection_result
+    }
 
-def call_local_segmentation_model(image, options=None):
+def call_local_segmentation_model(image, options=None, fallback=True, version=None):
     """调用本地实例分割模型
     
     直接在BML-CodeLab环境中加载和运行本地模型文件
+    image可以是PIL图像或由模型版本的 prepare 创建的PreparedImage；
+    version为已从注册表取得的模型版本，缺省时按请求参数选择；
+    fallback为False时推理失败直接抛出异常（由推理路由器转发给其他后端）
     """
     try:
-        if local_inference is None:
+        if model_registry.active is None and version is None:
+            if not fallback:
+                raise RuntimeError("本地模型未初始化")
             logger.warning("本地模型未初始化，使用模拟数据")
-            return simulate_segmentation_detection(image)
+            return simulate_segmentation_detection(image, options)
         
-        # 获取推理参数
-        confidence_threshold = options.get('confidence_threshold', 0.5) if options else 0.5
-        nms_threshold = options.get('nms_threshold', 0.5) if options else 0.5
-        
-        logger.info(f"使用本地模型进行推理，置信度阈值: {confidence_threshold}")
+        logger.info("使用本地模型进行推理")
         
         # 调用本地模型推理
-        result = local_inference.predict(
-            image,
-            confidence_threshold=confidence_threshold,
-            nms_threshold=nms_threshold
-        )
+        result = call_local_model(image, options, version)
         
         logger.info("本地模型推理完成")
         return result
         
     except Exception as e:
         logger.error(f"本地模型推理失败: {str(e)}")
+        if not fallback:
+            raise
         # 出错时使用模拟数据
-        return simulate_segmentation_detection(image)
+        return simulate_segmentation_detection(image, options)
 
-def call_local_model(image, options=None):
-    """调用本地模型进行推理"""
-    try:
-        # 获取模型实例
-        model = get_model_instance(MODEL_PATH, MODEL_CONFIG)
-        
-        # 更新模型参数
-        if options:
-            model.confidence_threshold = options.get('confidence_threshold', 0.5)
-            model.nms_threshold = options.get('nms_threshold', 0.5)
-        
-        # 执行推理
-        result = model.predict(image)
-        
-        # 转换结果格式
-        instances = result.get('results', [])
-        
-        # 统计各类别数量
-        observation_count = sum(1 for inst in instances if inst['category'] == '观察')
-        surgery_count = sum(1 for inst in instances if inst['category'] == '手术')
-        total_instances = len(instances)
-        
-        # 判断严重程度
-        surgery_ratio = surgery_count / total_instances if total_instances > 0 else 0
-        severity = '轻度'
-        if surgery_ratio > 0.5:
-            severity = '重度'
-        elif surgery_ratio > 0.2:
-            severity = '中度'
-        
-        # 转换为统一格式
-        bounding_boxes = []
-        segmentation_masks = []
-        class_labels = []
-        
-        for idx, inst in enumerate(instances):
-            bounding_boxes.append({
-                'id': idx,
-                'x1': inst['bbox'][0],
-                'y1': inst['bbox'][1],
-                'x2': inst['bbox'][2],
-                'y2': inst['bbox'][3],
-                'label': inst['category'],
-                'confidence': inst['score'],
-                'area': inst.get('area', 0)
-            })
-            
-            if inst.get('mask'):
-                segmentation_masks.append({
-                    'id': idx,
-                    'mask': inst['mask'],
-                    'category': inst['category'],
-                    'confidence': inst['score']
-                })
-            
-            class_labels.append({
-                'id': idx,
-                'category': inst['category'],
-                'confidence': inst['score']
-            })
-        
-        # 生成建议
-        recommendations = generate_segmentation_recommendations(
-            observation_count,
-            surgery_count,
-            severity
-        )
-        
-        return {
-            'disease_detected': total_instances > 0,
-            'total_instances': total_instances,
-            'observation_count': observation_count,
-            'surgery_count': surgery_count,
-            'severity': severity,
-            'confidence': np.mean([inst['score'] for inst in instances]) if instances else 0,
-            'bounding_boxes': bounding_boxes,
-            'segmentation_masks': segmentation_masks,
-            'class_labels': class_labels,
-            'class_distribution': {
-                '观察': observation_count,
-                '手术': surgery_count
-            },
-            'recommendations': recommendations,
-            'details': {
-                'model_version': 'local_v1.0.0',
-                'processing_time': 0,
-                'model_type': 'instance_segmentation',
-                'inference_mode': 'local'
-            }
-        }
-        
-    except Exception as e:
-        logger.error(f"本地模型推理失败: {e}")
-        # 回退到模拟模式
-        return simulate_segmentation_detection(image)
-
-def preprocess_image_for_segmentation(image):
-    """预处理图像以适配实例分割模型输入"""
-    # 转换为RGB
-    if image.mode != 'RGB':
-        image = image.convert('RGB')
-    
-    # PaddleDetection模型通常使用以下尺寸之一
-    # 根据您的模型训练时的配置调整
-    target_sizes = {
-        'yolo': (640, 640),
-        'mask_rcnn': (800, 1333),  # 短边800，长边最大1333
-        'default': (512, 512)
+def call_local_model(image, options=None, version=None):
+    """调用本地模型进行推理
+    
+    阈值作为本次调用的参数随图像进入批次，不修改共享模型实例的状态；
+    推理失败时抛出异常，由调用方决定回退方式
+    """
+    options = options or {}
+    if version is None:
+        with model_registry.lease(options.get('model_version')) as version:
+            return call_local_model(image, options, version)
+    # 进程内模型或多进程推理池
+    model = version.model
+    
+    # 单次请求的模型参数，随图像一起进入批次
+    model_options = {
+        'confidence_threshold': float(options.get('confidence_threshold', model.confidence_threshold)),
+        'nms_threshold': float(options.get('nms_threshold', model.nms_threshold)),
+        'mask_format': options.get('mask_format', MASK_FORMAT),
+        'full_masks': options.get('full_masks', False)
     }
     
-    # 使用适合您模型的尺寸
-    target_size = target_sizes.get('default')
+    # 命中推理缓存时跳过模型调用；键包含图像内容哈希、模型标识和阈值
+    cache_key = None
+    image_hash = options.get('image_hash')
+    if inference_cache is not None and image_hash:
+        cache_key = inference_cache.make_key(image_hash, model_options, identity=version.fingerprint)
+        with metrics.span('cache_lookup'):
+            result = inference_cache.get(cache_key)
+    else:
+        result = None
+    cache_hit = result is not None
     
-    # 保持长宽比的缩放
-    image.thumbnail(target_size, Image.Resampling.LANCZOS)
+    # 执行推理：启用批处理时经调度器与并发请求合批
+    raw_output = None
+    if cache_hit:
+        batch_info = {'queue_wait_ms': 0, 'batch_size': 0}
+    else:
+        model_options['keep_raw'] = raw_output_store is not None
+        if batch_scheduler is not None:
+            result = batch_scheduler.predict((image, model_options, version))
+        else:
+            result = model.predict(image, model_options)
+        batch_info = result.pop('batch_info', {})
+        raw_output = result.pop('raw', None)
+        # 推理失败时模型返回的模拟结果是随机的，不能缓存，也不保存原始输出或做影子对比
+        fallback = result.pop('fallback', False)
+        if fallback:
+            raw_output = None
+        # 批处理线程中测得的阶段耗时（已计入指标）并入本请求的追踪
+        stage_timings = result.pop('stage_timings', None)
+        trace = metrics.current_trace()
+        if stage_timings and trace is not None:
+            trace.merge(stage_timings)
+        if batch_info:
+            metrics.record('queue_wait', batch_info.get('queue_wait_ms', 0))
+        if not fallback:
+            if cache_key is not None:
+                inference_cache.put(cache_key, result)
+            # 影子版本对同一请求异步推理，只记录与本版本结果的差异
+            model_registry.submit_shadow(version, image, model_options, result.get('results', []))
     
-    # 创建目标尺寸的画布（填充黑色）
-    new_image = Image.new('RGB', target_size, (0, 0, 0))
+    detection = format_local_result(result.get('results', []), {
+        'queue_wait_ms': batch_info.get('queue_wait_ms', 0),
+        'batch_size': batch_info.get('batch_size', 1),
+        'cache_hit': cache_hit,
+        'model_version': version.name
+    })
+    if raw_output is not None:
+        # save_detection_result 取出后按结果ID保存；记录版本以便用同一版本重新过滤
+        raw_output['model_version'] = version.name
+        detection['_raw_output'] = raw_output
+    return detection
+
+def format_local_result(instances, details=None):
+    """将本地模型的实例列表转换为统一的检测结果格式"""
+    # 统计各类别数量
+    observation_count = sum(1 for inst in instances if inst['category'] == '观察')
+    surgery_count = sum(1 for inst in instances if inst['category'] == '手术')
+    total_instances = len(instances)
     
-    # 将调整后的图像粘贴到中心
-    paste_x = (target_size[0] - image.width) // 2
-    paste_y = (target_size[1] - image.height) // 2
-    new_image.paste(image, (paste_x, paste_y))
+    # 判断严重程度
+    surgery_ratio = surgery_count / total_instances if total_instances > 0 else 0
+    severity = '轻度'
+    if surgery_ratio > 0.5:
+        severity = '重度'
+    elif surgery_ratio > 0.2:
+        severity = '中度'
     
-    # 转换为numpy数组
-    img_array = np.array(new_image)
+    # 转换为统一格式
+    bounding_boxes = []
+    segmentation_masks = []
+    class_labels = []
     
-    # 归一化（根据模型要求调整）
-    img_array = img_array.astype(np.float32) / 255.0
+    for idx, inst in enumerate(instances):
+        bounding_boxes.append({
+            'id': idx,
+            'x1': inst['bbox'][0],
+            'y1': inst['bbox'][1],
+            'x2': inst['bbox'][2],
+            'y2': inst['bbox'][3],
+            'label': inst['category'],
+            'confidence': inst['score'],
+            'area': inst.get('area', 0)
+        })
+        
+        if inst.get('mask'):
+            segmentation_masks.append({
+                'id': idx,
+                'mask': inst['mask'],
+                'category': inst['category'],
+                'confidence': inst['score']
+            })
+        
+        class_labels.append({
+            'id': idx,
+            'category': inst['category'],
+            'confidence': inst['score']
+        })
+    
+    # 生成建议
+    recommendations = generate_segmentation_recommendations(
+        observation_count,
+        surgery_count,
+        severity
+    )
     
-    return img_array
+    return {
+        'disease_detected': total_instances > 0,
+        'total_instances': total_instances,
+        'observation_count': observation_count,
+        'surgery_count': surgery_count,
+        'severity': severity,
+        'confidence': np.mean([inst['score'] for inst in instances]) if instances else 0,
+        'bounding_boxes': bounding_boxes,
+        'segmentation_masks': segmentation_masks,
+        'class_labels': class_labels,
+        'class_distribution': {
+            '观察': observation_count,
+            '手术': surgery_count
+        },
+        'recommendations': recommendations,
+        'details': dict({
+            'model_version': 'local_v1.0.0',
+            'processing_time': 0,
+            'model_type': 'instance_segmentation',
+            'inference_mode': 'local'
+        }, **(details or {}))
+    }
 
-def call_bml_segmentation_model(image_array, original_image, options=None):
+def map_remote_mask(encoded, transform, options=None):
+    """将远程模型在模型输入（letterbox）坐标系输出的掩码映射回原图并按请求格式编码
+
+    Args:
+        encoded: 远程模型返回的掩码（base64 PNG或rle/bitpack字典），覆盖整个模型输入
+        transform: 发送图像时的预处理几何变换
+        options: 检测参数，mask_format / full_masks 同本地推理
+    """
+    options = options or {}
+    mask = mask_codec.decode_mask(encoded)
+    src_y, src_x = mask_index_maps(mask.shape, transform)
+    full = mask[src_y[:, None], src_x[None, :]]
+    mask_format = mask_codec.normalize_format(options.get('mask_format', MASK_FORMAT))
+    if str(options.get('full_masks', False)).lower() == 'true':
+        orig_w, orig_h = transform['original_size']
+        return mask_codec.encode_crop(full, (0, 0), (orig_w, orig_h), mask_format)
+    return mask_codec.encode_mask(full, mask_format)
+
+def call_bml_segmentation_model(prepared, options=None, fallback=True):
     """调用BML平台上的实例分割模型API
 
     支持检测口腔病变并分类为：观察/手术两类
     返回分割掩码和边界框
+    
+    Args:
+        prepared: 使用bml_preprocessor创建的PreparedImage，直接发送其letterbox后的uint8像素
+        options: 检测参数
+        fallback: 调用失败时是否回退到模拟数据；为False时抛出异常
     """
+    original_image = prepared.image
     try:
         if not BML_MODEL_ENDPOINT:
+            if not fallback:
+                raise RemoteInferenceError("未配置BML模型端点")
             logger.warning("未配置BML模型端点，使用模拟数据")
-            return simulate_segmentation_detection(original_image)
-        
-        # 将图像转换为base64
-        img = Image.fromarray((image_array * 255).astype(np.uint8))
-        buffered = io.BytesIO()
-        img.save(buffered, format="PNG")
-        img_base64 = base64.b64encode(buffered.getvalue()).decode()
-        
-        # 构建BML标准请求格式
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {BML_API_KEY}',
-            'X-Baidu-Access-Token': BML_API_KEY
-        }
+            return simulate_segmentation_detection(original_image, options)
         
-        # BML实例分割模型输入格式
-        payload = {
-            'data': {
-                'image': img_base64,
-                'format': 'base64'
-            },
-            'params': {
-                'threshold': options.get('confidence_threshold', 0.5) if options else 0.5,
-                'nms_threshold': options.get('nms_threshold', 0.5) if options else 0.5,
-                'return_mask': True,  # 返回分割掩码
-                'return_bbox': True,   # 返回边界框
-                'max_detections': 20,  # 最多检测20个实例
-                'classes': ['观察', '手术']  # 指定类别
-            }
+        # BML实例分割模型参数；图像由客户端按大小编码为JPEG或原始uint8
+        params = {
+            'threshold': options.get('confidence_threshold', 0.5) if options else 0.5,
+            'nms_threshold': options.get('nms_threshold', 0.5) if options else 0.5,
+            'return_mask': True,  # 返回分割掩码
+            'return_bbox': True,   # 返回边界框
+            'max_detections': 20,  # 最多检测20个实例
+            'classes': ['观察', '手术']  # 指定类别
         }
         
-        # 发送请求到BML模型
+        # 通过连接池客户端发送请求：失败重试、熔断时快速失败，不再阻塞60秒
         logger.info(f"调用BML实例分割模型: {BML_MODEL_ENDPOINT}")
-        response = requests.post(
-            BML_MODEL_ENDPOINT,
-            headers=headers,
-            json=payload,
-            timeout=60  # 增加超时时间
-        )
+        result = bml_client.infer(prepared.pixels, params)
+        logger.info("BML模型调用成功")
         
-        if response.status_code == 200:
-            result = response.json()
-            logger.info("BML模型调用成功")
-            
-            # 解析实例分割结果
-            # 假设模型返回格式：
-            # {
-            #   "results": [{
-            #     "category": "观察",
-            #     "score": 0.95,
-            #     "bbox": [x1, y1, x2, y2],
-            #     "mask": "base64编码的掩码",
-            #     "area": 1234
-            #   }],
-            #   "metadata": {...}
-            # }
+        # 解析实例分割结果
+        # 假设模型返回格式：
+        # {
+        #   "results": [{
+        #     "category": "观察",
+        #     "score": 0.95,
+        #     "bbox": [x1, y1, x2, y2],
+        #     "mask": "base64编码的掩码",
+        #     "area": 1234
+        #   }],
+        #   "metadata": {...}
+        # }
+        
+        instances = result.get('results', [])
+        
+        if instances:
+            # 处理检测到的实例
+            segmentation_masks = []
+            bounding_boxes = []
+            class_labels = []
             
-            instances = result.get('results', [])
+            # 统计各类别数量
+            observation_count = 0
+            surgery_count = 0
             
-            if instances:
-                # 处理检测到的实例
-                segmentation_masks = []
-                bounding_boxes = []
-                class_labels = []
+            for idx, instance in enumerate(instances):
+                category = instance.get('category', '未知')
+                confidence = instance.get('score', 0)
+                
+                # 统计类别
+                if category == '观察':
+                    observation_count += 1
+                elif category == '手术':
+                    surgery_count += 1
                 
-                # 统计各类别数量
-                observation_count = 0
-                surgery_count = 0
+                # 处理边界框：模型在letterbox坐标系输出，映射回原图
+                if instance.get('bbox'):
+                    bbox = [float(v) for v in map_boxes_to_original(instance['bbox'], prepared.transform)[0]]
+                    bounding_boxes.append({
+                        'id': idx,
+                        'x1': bbox[0],
+                        'y1': bbox[1],
+                        'x2': bbox[2],
+                        'y2': bbox[3],
+                        'label': category,
+                        'confidence': confidence,
+                        'area': instance.get('area', 0)
+                    })
                 
-                for idx, instance in enumerate(instances):
-                    category = instance.get('category', '未知')
-                    confidence = instance.get('score', 0)
-                    
-                    # 统计类别
-                    if category == '观察':
-                        observation_count += 1
-                    elif category == '手术':
-                        surgery_count += 1
-                    
-                    # 处理边界框
-                    if instance.get('bbox'):
-                        bbox = instance['bbox']
-                        bounding_boxes.append({
-                            'id': idx,
-                            'x1': bbox[0],
-                            'y1': bbox[1],
-                            'x2': bbox[2],
-                            'y2': bbox[3],
-                            'label': category,
-                            'confidence': confidence,
-                            'area': instance.get('area', 0)
-                        })
-                    
-                    # 处理分割掩码
-                    if instance.get('mask'):
-                        mask_data = base64.b64decode(instance['mask'])
-                        # 根据实际格式解析掩码
-                        segmentation_masks.append({
-                            'id': idx,
-                            'mask': instance['mask'],  # base64编码
-                            'category': category,
-                            'confidence': confidence
-                        })
-                    
-                    class_labels.append({
+                # 处理分割掩码：BML返回letterbox坐标系的base64 PNG，去掉填充并缩放回原图后按请求格式编码
+                if instance.get('mask'):
+                    segmentation_masks.append({
                         'id': idx,
+                        'mask': map_remote_mask(instance['mask'], prepared.transform, options),
                         'category': category,
                         'confidence': confidence
                     })
                 
-                # 判断整体严重程度
-                total_instances = len(instances)
-                surgery_ratio = surgery_count / total_instances if total_instances > 0 else 0
-                
-                severity = '轻度'
-                if surgery_ratio > 0.5:
-                    severity = '重度'
-                elif surgery_ratio > 0.2:
-                    severity = '中度'
-                
-                # 生成建议
-                recommendations = generate_segmentation_recommendations(
-                    observation_count, 
-                    surgery_count,
-                    severity
-                )
-                
-                return {
-                    'disease_detected': total_instances > 0,
-                    'total_instances': total_instances,
-                    'observation_count': observation_count,
-                    'surgery_count': surgery_count,
-                    'severity': severity,
-                    'confidence': np.mean([inst.get('score', 0) for inst in instances]),
-                    'bounding_boxes': bounding_boxes,
-                    'segmentation_masks': segmentation_masks,
-                    'class_labels': class_labels,
-                    'class_distribution': {
-                        '观察': observation_count,
-                        '手术': surgery_count
-                    },
-                    'recommendations': recommendations,
-                    'details': {
-                        'model_version': result.get('metadata', {}).get('model_version', 'v1.0.0'),
-                        'processing_time': result.get('metadata', {}).get('time_ms', 0),
-                        'model_type': 'instance_segmentation'
-                    }
-                }
-            else:
-                # 没有检测到病变
-                return {
-                    'disease_detected': False,
-                    'total_instances': 0,
-                    'observation_count': 0,
-                    'surgery_count': 0,
-                    'severity': '正常',
-                    'confidence': 1.0,
-                    'bounding_boxes': [],
-                    'segmentation_masks': [],
-                    'class_labels': [],
-                    'class_distribution': {
-                        '观察': 0,
-                        '手术': 0
-                    },
-                    'recommendations': ['口腔健康状况良好', '建议定期检查', '保持良好口腔卫生习惯'],
-                    'details': {
-                        'model_version': result.get('metadata', {}).get('model_version', 'v1.0.0'),
-                        'model_type': 'instance_segmentation'
-                    }
+                class_labels.append({
+                    'id': idx,
+                    'category': category,
+                    'confidence': confidence
+                })
+            
+            # 判断整体严重程度
+            total_instances = len(instances)
+            surgery_ratio = surgery_count / total_instances if total_instances > 0 else 0
+            
+            severity = '轻度'
+            if surgery_ratio > 0.5:
+                severity = '重度'
+            elif surgery_ratio > 0.2:
+                severity = '中度'
+            
+            # 生成建议
+            recommendations = generate_segmentation_recommendations(
+                observation_count, 
+                surgery_count,
+                severity
+            )
+            
+            return {
+                'disease_detected': total_instances > 0,
+                'total_instances': total_instances,
+                'observation_count': observation_count,
+                'surgery_count': surgery_count,
+                'severity': severity,
+                'confidence': np.mean([inst.get('score', 0) for inst in instances]),
+                'bounding_boxes': bounding_boxes,
+                'segmentation_masks': segmentation_masks,
+                'class_labels': class_labels,
+                'class_distribution': {
+                    '观察': observation_count,
+                    '手术': surgery_count
+                },
+                'recommendations': recommendations,
+                'details': {
+                    'model_version': result.get('metadata', {}).get('model_version', 'v1.0.0'),
+                    'processing_time': result.get('metadata', {}).get('time_ms', 0),
+                    'model_type': 'instance_segmentation'
                 }
+            }
         else:
-            logger.error(f"BML API错误: {response.status_code}, {response.text}")
-            return simulate_segmentation_detection(original_image)
+            # 没有检测到病变
+            return {
+                'disease_detected': False,
+                'total_instances': 0,
+                'observation_count': 0,
+                'surgery_count': 0,
+                'severity': '正常',
+                'confidence': 1.0,
+                'bounding_boxes': [],
+                'segmentation_masks': [],
+                'class_labels': [],
+                'class_distribution': {
+                    '观察': 0,
+                    '手术': 0
+                },
+                'recommendations': ['口腔健康状况良好', '建议定期检查', '保持良好口腔卫生习惯'],
+                'details': {
+                    'model_version': result.get('metadata', {}).get('model_version', 'v1.0.0'),
+                    'model_type': 'instance_segmentation'
+                }
+            }
+    
+    except RemoteInferenceError as e:
+        logger.error(f"BML API错误: {str(e)}")
+        if not fallback:
+            raise
+        return simulate_segmentation_detection(original_image, options)
     
     except Exception as e:
         logger.error(f"调用BML模型失败: {str(e)}")
-        return simulate_segmentation_detection(original_image)
+        if not fallback:
+            raise
+        return simulate_segmentation_detection(original_image, options)
 
-def simulate_segmentation_detection(image):
-    """模拟实例分割检测结果（用于测试）"""
+def simulate_segmentation_detection(image, options=None):
+    """模拟实例分割检测结果（用于测试），边界框和掩码都在原图坐标系内"""
     import random
     
+    mask_format = (options or {}).get('mask_format', MASK_FORMAT)
+    if isinstance(image, PreparedImage):
+        image_size = image.original_size
+    elif image is not None:
+        image_size = original_size(image)
+    else:
+        image_size = (512, 512)
+    image_width, image_height = image_size
+    
     # 随机生成检测结果
     num_instances = random.randint(0, 3)
     
@@ -637,11 +1523,11 @@ def simulate_segmentation_detection(image):
         
         confidence = random.uniform(0.7, 0.99)
         
-        # 生成随机边界框
-        x1 = random.randint(50, 200)
-        y1 = random.randint(50, 200)
-        width = random.randint(50, 150)
-        height = random.randint(50, 150)
+        # 生成随机边界框（小图上收缩到图像范围内）
+        width = min(random.randint(50, 150), image_width)
+        height = min(random.randint(50, 150), image_height)
+        x1 = random.randint(min(50, image_width - width), min(200, image_width - width))
+        y1 = random.randint(min(50, image_height - height), min(200, image_height - height))
         
         bounding_boxes.append({
             'id': i,
@@ -654,18 +1540,18 @@ def simulate_segmentation_detection(image):
             'area': width * height
         })
         
-        # 生成模拟的掩码（简化为矩形区域的base64编码）
-        mask_img = Image.new('L', (512, 512), 0)
+        # 生成模拟的掩码（边界框内的椭圆区域）
+        mask_img = Image.new('L', (width, height), 0)
         draw = ImageDraw.Draw(mask_img)
-        draw.ellipse([x1, y1, x1 + width, y1 + height], fill=255)
-        
-        mask_buffer = io.BytesIO()
-        mask_img.save(mask_buffer, format='PNG')
-        mask_base64 = base64.b64encode(mask_buffer.getvalue()).decode()
+        draw.ellipse([0, 0, width - 1, height - 1], fill=255)
+        mask_encoded = mask_codec.encode_crop(np.asarray(mask_img), (x1, y1), image_size, mask_format)
+        if (options or {}).get('full_masks'):
+            mask_encoded = mask_codec.encode_crop(
+                mask_codec.decode_mask(mask_encoded), (0, 0), image_size, mask_format)
         
         segmentation_masks.append({
             'id': i,
-            'mask': mask_base64,
+            'mask': mask_encoded,
             'category': category,
             'confidence': confidence
         })
@@ -712,52 +1598,54 @@ def simulate_segmentation_detection(image):
         }
     }
 
-def create_segmentation_visualization(image_path, masks, labels):
-    """创建分割结果的可视化图像"""
+def create_segmentation_visualization(image, masks, labels, save_masks=None):
+    """创建分割结果的可视化图像
+    
+    Args:
+        image: 内存中已解码的PIL图像（兼容传入文件路径）
+        masks: segmentation_masks 列表（png/rle/bitpack编码均可）
+        labels: class_labels 列表，掩码自身未携带类别时使用
+        save_masks: 是否输出每个实例的掩码PNG，默认取SAVE_MASK_FILES；
+                    掩码文件在后台线程写出，不阻塞响应
+    """
     try:
-        # 读取原始图像
-        image = cv2.imread(image_path)
-        if image is None:
-            image = np.zeros((512, 512, 3), dtype=np.uint8)
-        
-        height, width = image.shape[:2]
-        
-        # 创建叠加图像
-        overlay = image.copy()
-        mask_urls = []
+        # 转换为BGR数组
+        if isinstance(image, str):
+            image_bgr = cv2.imread(image)
+        else:
+            image_bgr = cv2.cvtColor(np.asarray(image.convert('RGB')), cv2.COLOR_RGB2BGR)
+        if image_bgr is None:
+            image_bgr = np.zeros((512, 512, 3), dtype=np.uint8)
         
-        # 颜色映射
-        colors = {
-            '观察': (0, 255, 0),    # 绿色
-            '手术': (0, 0, 255),    # 红色
-            '未知': (255, 255, 0)   # 黄色
-        }
+        height, width = image_bgr.shape[:2]
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         
-        for idx, (mask_data, label_data) in enumerate(zip(masks, labels)):
-            category = label_data.get('category', '未知')
-            color = colors.get(category, (255, 255, 255))
-            
-            # 解码掩码
-            if mask_data.get('mask'):
-                mask_base64 = mask_data['mask']
-                mask_bytes = base64.b64decode(mask_base64)
-                mask_img = Image.open(io.BytesIO(mask_bytes)).convert('L')
-                mask_array = np.array(mask_img.resize((width, height)))
-                
-                # 应用掩码到叠加图像
-                mask_bool = mask_array > 128
-                overlay[mask_bool] = overlay[mask_bool] * 0.5 + np.array(color) * 0.5
-                
-                # 保存单独的掩码图像
-                mask_filename = f"mask_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{idx}.png"
-                mask_path = os.path.join(SEGMENTATION_FOLDER, mask_filename)
-                cv2.imwrite(mask_path, mask_array)
-                mask_urls.append(f"/segmentation_results/{mask_filename}")
+        # 一次渲染所有实例
+        crops = visualization.decode_instance_masks(masks, (width, height))
+        categories = []
+        for idx, mask_data in enumerate(masks):
+            label_data = labels[idx] if idx < len(labels) else {}
+            categories.append(mask_data.get('category') or label_data.get('category', '未知'))
+        overlay = visualization.render_overlay(image_bgr, crops, categories)
         
         # 保存可视化结果
-        vis_filename = f"segmentation_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.jpg"
+        vis_filename = f"segmentation_{timestamp}_{uuid.uuid4().hex[:8]}.jpg"
         vis_path = os.path.join(SEGMENTATION_FOLDER, vis_filename)
-        cv2.imwrite(vis_path, overlay)
+        result_writer.submit(vis_path, visualization.encode_image(overlay, '.jpg'))
+        
+        # 单独的掩码图像：延迟到后台写入线程生成和写出
+        mask_urls = []
+        if SAVE_MASK_FILES if save_masks is None else save_masks:
+            for idx, item in enumerate(crops):
+                if item is None:
+                    continue
+                mask_filename = f"mask_{timestamp}_{uuid.uuid4().hex[:8]}_{idx}.png"
+                result_writer.submit(
+                    os.path.join(SEGMENTATION_FOLDER, mask_filename),
+                    item,
+                    encode=partial(_render_mask_file, image_size=(width, height))
+                )
+                mask_urls.append(f"/segmentation_results/{mask_filename}")
         
         return {
             'url': f"/segmentation_results/{vis_filename}",
@@ -771,6 +1659,11 @@ def create_segmentation_visualization(image_path, masks, labels):
             'mask_urls': []
         }
 
+def _render_mask_file(item, image_size):
+    """把单个实例的裁剪掩码编码为整幅PNG（在后台写入线程执行）"""
+    crop, x0, y0 = item
+    return visualization.render_mask_png(crop, x0, y0, image_size)
+
 def generate_segmentation_recommendations(observation_count, surgery_count, severity):
     """根据实例分割结果生成建议"""
     recommendations = []
@@ -816,6 +1709,11 @@ def generate_segmentation_recommendations(observation_count, surgery_count, seve
 def save_detection_result(result, filename):
     """保存检测结果"""
     result_id = str(uuid.uuid4())
+    
+    # 未过滤的原始输出只保存在内存中，供调整阈值时复用
+    raw_output = result.pop('_raw_output', None)
+    if raw_output is not None and raw_output_store is not None:
+        raw_output_store.put(result_id, raw_output)
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     
     # 保存到文件
@@ -828,64 +1726,183 @@ def save_detection_result(result, filename):
         'result': result
     }
     
-    with open(result_file, 'w', encoding='utf-8') as f:
-        json.dump(result_data, f, ensure_ascii=False, indent=2)
+    # 后台写盘，写完前 /api/result 从待写表读取
+    result_writer.submit(result_file, result_data, encode=_encode_result_json)
+    
+    # 写入历史索引
+    try:
+        result_index.add(result_data)
+    except Exception as e:
+        logger.error(f"写入结果索引失败: {str(e)}")
     
     return result_id
 
+def _encode_result_json(result_data):
+    """将检测结果编码为紧凑JSON字节"""
+    return json.dumps(result_data, ensure_ascii=False, separators=(',', ':'), default=_json_default).encode('utf-8')
+
+def load_result_data(result_id):
+    """读取检测结果：优先取尚未落盘的待写结果，不存在时返回None"""
+    result_file = os.path.join(RESULTS_FOLDER, f'{result_id}.json')
+    
+    pending = result_writer.get_pending(result_file)
+    if pending is not None:
+        return pending
+    
+    if not os.path.exists(result_file):
+        return None
+    
+    with open(result_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
 @app.route('/api/result/<result_id>', methods=['GET'])
 def get_result(result_id):
     """获取检测结果"""
     try:
-        result_file = os.path.join(RESULTS_FOLDER, f'{result_id}.json')
+        result_data = load_result_data(result_id)
         
-        if not os.path.exists(result_file):
+        if result_data is None:
             return jsonify({'error': '结果不存在'}), 404
         
-        with open(result_file, 'r', encoding='utf-8') as f:
-            result_data = json.load(f)
-        
         return jsonify(result_data)
     
     except Exception as e:
         logger.error(f"获取结果错误: {str(e)}")
         return jsonify({'error': '获取结果失败'}), 500
 
-@app.route('/api/history', methods=['GET'])
-def get_history():
-    """获取检测历史"""
+@app.route('/api/result/<result_id>/refilter', methods=['POST'])
+def refilter_result(result_id):
+    """按新的阈值重新过滤检测结果
+    
+    结果的原始模型输出仍在内存中时只重新做置信度过滤和NMS，不再推理；
+    原始输出已淘汰（或结果来自缓存/非本地模型），或新阈值低于原始输出保留候选的
+    得分下限（raw_score_floor）时，用保存的原图重新推理。
+    结果文件本身不被修改。
+    """
     try:
-        history = []
-        
-        if os.path.exists(RESULTS_FOLDER):
-            for filename in os.listdir(RESULTS_FOLDER):
-                if filename.endswith('.json'):
-                    filepath = os.path.join(RESULTS_FOLDER, filename)
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        result = data.get('result', {})
-                        history.append({
-                            'id': data['id'],
-                            'timestamp': data['timestamp'],
-                            'disease_detected': result.get('disease_detected', False),
-                            'severity': result.get('severity', '未知'),
-                            'total_instances': result.get('total_instances', 0),
-                            'observation_count': result.get('observation_count', 0),
-                            'surgery_count': result.get('surgery_count', 0),
-                            'confidence': result.get('confidence', 0)
-                        })
-        
-        # 按时间排序
-        history.sort(key=lambda x: x['timestamp'], reverse=True)
+        data = request.get_json(silent=True) or {}
+        options = {
+            'confidence_threshold': float(data.get('confidence_threshold', 0.5)),
+            'nms_threshold': float(data.get('nms_threshold', 0.5)),
+            'mask_format': mask_codec.normalize_format(data.get('mask_format', MASK_FORMAT)),
+            'full_masks': str(data.get('full_masks', False)).lower() == 'true'
+        }
+        include_visualization = str(data.get('include_visualization', False)).lower() == 'true'
+        
+        # 重新过滤/重新推理的实际耗时计入 details.processing_time 与 stages_ms
+        trace = metrics.Trace()
+        with metrics.activate(trace):
+            raw_output = raw_output_store.get(result_id) if raw_output_store is not None else None
+            if raw_output is not None and options['confidence_threshold'] < raw_output.get('score_floor', 0.0):
+                # 保存原始输出时已丢弃得分下限以下的候选，更低的阈值只能重新推理
+                raw_output = None
+            image = None
+            if raw_output is not None:
+                version = model_registry.get(raw_output.get('model_version')) or model_registry.active
+                model = version.model if version is not None else None
+                if model is None:
+                    raise RuntimeError("产生该结果的模型版本已卸载")
+                with metrics.span('postprocess'):
+                    refiltered = model.refilter(raw_output, options)
+                detection = format_local_result(refiltered['results'], {'model_version': version.name})
+                detection['details']['raw_score_floor'] = raw_output.get('score_floor', 0.0)
+                refilter_mode = 'raw'
+            else:
+                result_data = load_result_data(result_id)
+                if result_data is None:
+                    return jsonify({'error': '结果不存在'}), 404
+                filepath = os.path.join(UPLOAD_FOLDER, secure_filename(result_data.get('filename') or ''))
+                image = open_uploaded_image(filepath)
+                if image is None:
+                    return jsonify({'error': '原始图像不存在，无法重新过滤'}), 404
+                options['image_hash'] = compute_image_hash(filepath)
+                detection = run_segmentation_inference(image, options)
+                raw_output = detection.pop('_raw_output', None)
+                if raw_output is not None and raw_output_store is not None:
+                    raw_output_store.put(result_id, raw_output)
+                refilter_mode = 'reinference'
+        
+        detection['details'].update(trace.details())
+        detection['details']['refilter_mode'] = refilter_mode
+        detection['details']['refilter_ms'] = detection['details']['processing_time']
+        
+        if include_visualization and detection.get('segmentation_masks'):
+            if image is None:
+                result_data = load_result_data(result_id) or {}
+                image = open_uploaded_image(
+                    os.path.join(UPLOAD_FOLDER, secure_filename(result_data.get('filename') or '')))
+            if image is not None:
+                visualization_result = create_segmentation_visualization(
+                    image,
+                    detection['segmentation_masks'],
+                    detection.get('class_labels', []),
+                    save_masks=False
+                )
+                detection['visualization_url'] = visualization_result['url']
         
         return jsonify({
             'success': True,
-            'history': history[:50]  # 返回最近50条
+            'result_id': result_id,
+            'detection': detection,
+            'timestamp': datetime.now().isoformat()
         })
     
+    except ValueError as e:
+        return jsonify({'error': f'参数错误：{str(e)}'}), 400
+    except Exception as e:
+        logger.error(f"重新过滤错误: {str(e)}")
+        return jsonify({'error': f'重新过滤失败：{str(e)}'}), 500
+
+@app.route('/api/history', methods=['GET'])
+def get_history():
+    """获取检测历史
+    
+    查询参数：
+        limit: 每页条数（默认50，最大200）
+        cursor: 上一页返回的next_cursor
+        severity: 严重程度过滤，多个用逗号分隔
+        start / end: 时间范围（ISO日期或时间）
+        disease_detected: true/false
+    """
+    payload, status = handle_history(request.args)
+    return jsonify(payload), status
+
+def handle_history(args):
+    """分页查询检测历史（WSGI与ASGI服务共用）
+    
+    Args:
+        args: 查询参数（支持 .get 的映射）
+    
+    Returns:
+        (响应内容, HTTP状态码)
+    """
+    try:
+        limit = max(1, min(int(args.get('limit', 50)), 200))
+        severity = [v for v in args.get('severity', '').split(',') if v]
+        disease_detected = args.get('disease_detected')
+        if disease_detected is not None:
+            disease_detected = disease_detected.lower() in ('1', 'true')
+        
+        history, next_cursor = result_index.query(
+            limit=limit,
+            cursor=args.get('cursor') or None,
+            severity=severity or None,
+            start=args.get('start') or None,
+            end=args.get('end') or None,
+            disease_detected=disease_detected
+        )
+        
+        return {
+            'success': True,
+            'history': history,
+            'next_cursor': next_cursor
+        }, 200
+    
+    except (ValueError, UnicodeDecodeError) as e:
+        return {'error': f'查询参数无效：{str(e)}'}, 400
     except Exception as e:
         logger.error(f"获取历史错误: {str(e)}")
-        return jsonify({'error': '获取历史失败'}), 500
+        return {'error': '获取历史失败'}, 500
 
 @app.route('/api/export/<result_id>', methods=['GET'])
 def export_report(result_id):
@@ -894,13 +1911,10 @@ def export_report(result_id):
         format_type = request.args.get('format', 'pdf')
         
         # 获取检测结果
-        result_file = os.path.join(RESULTS_FOLDER, f'{result_id}.json')
-        if not os.path.exists(result_file):
+        result_data = load_result_data(result_id)
+        if result_data is None:
             return jsonify({'error': '结果不存在'}), 404
         
-        with open(result_file, 'r', encoding='utf-8') as f:
-            result_data = json.load(f)
-        
         # 生成报告
         if format_type == 'pdf':
             # TODO: 实现PDF生成
@@ -962,7 +1976,7 @@ if __name__ == '__main__':
     if USE_LOCAL_MODEL:
         logger.info(f"使用本地模型模式")
         logger.info(f"模型路径: {MODEL_PATH}")
-        logger.info(f"本地模型状态: {'可用' if local_inference is not None else '不可用'}")
+        logger.info(f"本地模型状态: {'可用' if model_registry.active is not None else '不可用'}")
     else:
         logger.info(f"使用远程API模式")
         logger.info(f"模型端点: {BML_MODEL_ENDPOINT if BML_MODEL_ENDPOINT else '未配置（使用模拟数据）'}")
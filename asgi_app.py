@@ -0,0 +1,232 @@
+"""
+ASGI异步服务入口
+/api/detect、/api/upload、/api/result、/api/history 以及静态/结果文件由Quart异步处理：
+请求体非阻塞读取，解码/推理/渲染等CPU密集步骤交给线程池，文件读取使用异步IO。
+其余接口（批量检测、报告导出等）转交给原Flask应用，JSON格式与 app.py 完全一致。
+
+启动方式:
+    hypercorn asgi_app:application --bind 0.0.0.0:8080
+    uvicorn asgi_app:application --host 0.0.0.0 --port 8080
+
+依赖: quart（自带hypercorn与aiofiles）、asgiref
+"""
+
+import os
+import time
+import asyncio
+import mimetypes
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import aiofiles
+from asgiref.wsgi import WsgiToAsgi
+from quart import Quart, Response, g, jsonify, request, send_from_directory
+from werkzeug.exceptions import HTTPException
+from werkzeug.utils import secure_filename
+
+import app as core
+import metrics
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# ASGI服务配置
+ASGI_CPU_WORKERS = int(os.environ.get('ASGI_CPU_WORKERS', 8))  # 解码/推理/渲染线程数
+ASGI_BODY_TIMEOUT = int(os.environ.get('ASGI_BODY_TIMEOUT', 300))  # 读取请求体的最长时间（秒），照顾慢速移动网络
+
+quart_app = Quart(__name__, static_folder=None)
+quart_app.config['MAX_CONTENT_LENGTH'] = core.MAX_FILE_SIZE * 2
+quart_app.config['BODY_TIMEOUT'] = ASGI_BODY_TIMEOUT
+
+# CPU密集步骤在线程池中执行，事件循环只负责收发数据
+cpu_executor = ThreadPoolExecutor(max_workers=ASGI_CPU_WORKERS, thread_name_prefix='asgi-cpu')
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """在CPU线程池中执行同步函数"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(cpu_executor, partial(fn, *args, **kwargs))
+
+
+@quart_app.before_request
+async def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@quart_app.after_request
+async def record_request_metrics(response):
+    """与Flask应用共用HTTP请求计数和延迟直方图"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        core.observe_http_request(request.method, endpoint, response.status_code, time.perf_counter() - started)
+    return response
+
+
+@quart_app.after_request
+async def add_cors_headers(response):
+    """与Flask应用的CORS配置保持一致（允许任意来源访问 /api/*）"""
+    if request.path.startswith('/api/'):
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        if request.method == 'OPTIONS':
+            requested = request.headers.get('Access-Control-Request-Headers')
+            if requested:
+                response.headers['Access-Control-Allow-Headers'] = requested
+            response.headers['Access-Control-Allow-Methods'] = response.headers.get('Allow', 'GET, POST, OPTIONS')
+    return response
+
+
+@quart_app.route('/api/health', methods=['GET'])
+async def health_check():
+    """健康检查接口"""
+    return jsonify(core.build_health_status())
+
+
+@quart_app.route('/api/upload', methods=['POST'])
+async def upload_image():
+    """上传图像接口：请求体异步读取完后再占用线程保存"""
+    files = await request.files
+    payload, status = await run_blocking(core.handle_upload, files.get('image'))
+    return jsonify(payload), status
+
+
+async def save_request_body():
+    """边接收原始图像请求体边异步写盘并计算内容哈希，返回 (文件名, 文件路径, 内容哈希)"""
+    part_path = core.new_upload_part_path()
+    digest = core.new_content_hash()
+    size = 0
+    try:
+        async with aiofiles.open(part_path, 'wb') as f:
+            async for chunk in request.body:
+                size += len(chunk)
+                core.check_upload_size(size)
+                digest.update(chunk)
+                await f.write(chunk)
+        return await run_blocking(core.finalize_upload, part_path, digest.hexdigest(), size)
+    except Exception:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+
+@quart_app.route('/api/detect', methods=['POST'])
+async def detect_disease():
+    """AI检测接口：原始图像字节边接收边写盘，multipart在表单解析后分块写盘，JSON（base64）照旧"""
+    upload = None
+    # 事件循环线程上的协程会交错执行，不能激活线程局部的追踪，上传耗时直接记到追踪上
+    trace = metrics.Trace()
+    try:
+        if request.mimetype == 'multipart/form-data':
+            data = (await request.form).to_dict()
+            file = (await request.files).get('image')
+            if file is not None and file.filename:
+                started = time.perf_counter()
+                upload = await run_blocking(core.save_upload_stream, file.stream)
+                metrics.record('upload', (time.perf_counter() - started) * 1000, trace)
+        elif request.mimetype in core.BINARY_UPLOAD_TYPES:
+            data = request.args.to_dict()
+            started = time.perf_counter()
+            upload = await save_request_body()
+            metrics.record('upload', (time.perf_counter() - started) * 1000, trace)
+        else:
+            data = await request.get_json(silent=True)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    payload, status = await run_blocking(core.handle_detect, data, upload, trace)
+    return jsonify(payload), status
+
+
+@quart_app.route('/api/result/<result_id>', methods=['GET'])
+async def get_result(result_id):
+    """获取检测结果：尚未落盘时从待写表读取，否则异步读取结果文件"""
+    result_file = os.path.join(core.RESULTS_FOLDER, f'{secure_filename(result_id)}.json')
+    try:
+        pending = core.result_writer.get_pending(result_file)
+        if pending is not None:
+            return Response(core._encode_result_json(pending), mimetype='application/json')
+        if not os.path.exists(result_file):
+            return jsonify({'error': '结果不存在'}), 404
+        async with aiofiles.open(result_file, 'rb') as f:
+            content = await f.read()
+        return Response(content, mimetype='application/json')
+    except Exception as e:
+        logger.error(f"获取结果错误: {str(e)}")
+        return jsonify({'error': '获取结果失败'}), 500
+
+
+@quart_app.route('/api/history', methods=['GET'])
+async def get_history():
+    """获取检测历史（SQLite查询在线程池中执行）"""
+    payload, status = await run_blocking(core.handle_history, request.args)
+    return jsonify(payload), status
+
+
+async def send_pending_or_file(folder, filename):
+    """文件尚在后台写入队列中时直接从内存返回，否则异步读取磁盘文件"""
+    pending = core.result_writer.get_pending_bytes(os.path.join(folder, secure_filename(filename)))
+    if pending is not None:
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        return Response(pending, mimetype=mimetype)
+    return await send_from_directory(folder, filename)
+
+
+@quart_app.route('/uploads/<filename>')
+async def uploaded_file(filename):
+    """提供上传文件的访问"""
+    return await send_pending_or_file(core.UPLOAD_FOLDER, filename)
+
+
+@quart_app.route('/segmentation_results/<filename>')
+async def segmentation_file(filename):
+    """提供分割结果文件的访问"""
+    return await send_pending_or_file(core.SEGMENTATION_FOLDER, filename)
+
+
+@quart_app.route('/metrics', methods=['GET'])
+async def metrics_endpoint():
+    """Prometheus指标（与Flask应用共用同一注册表）"""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+@quart_app.route('/')
+async def index():
+    """主页"""
+    return await send_from_directory('.', 'index.html')
+
+
+@quart_app.route('/<path:path>')
+async def serve_static(path):
+    """提供静态文件服务"""
+    if os.path.exists(path):
+        return await send_from_directory('.', path)
+    return "File not found", 404
+
+
+class Dispatcher:
+    """
+    ASGI入口：已实现异步版本的路由交给Quart，其余请求转交给Flask应用
+
+    静态文件通配路由不接管 /api/ 下的路径，这些路径都交给Flask处理
+    """
+
+    def __init__(self, async_app: Quart, wsgi_app):
+        self.async_app = async_app
+        self.wsgi_app = WsgiToAsgi(wsgi_app)
+        self._adapter = async_app.url_map.bind('localhost')
+
+    def _handled_by_async(self, path: str, method: str) -> bool:
+        try:
+            endpoint, _ = self._adapter.match(path, method=method)
+        except HTTPException:
+            return False
+        return not (endpoint == 'serve_static' and path.startswith('/api/'))
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and not self._handled_by_async(scope['path'], scope['method']):
+            await self.wsgi_app(scope, receive, send)
+        else:
+            await self.async_app(scope, receive, send)
+
+
+application = Dispatcher(quart_app, core.app)
@@ -0,0 +1,203 @@
+"""
+动态微批调度模块
+将并发到达的推理请求聚合成批次，一次前向计算后把结果分发回各调用方
+"""
+
+import time
+import queue
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Any
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class _BatchItem:
+    """队列中的单个推理请求"""
+
+    __slots__ = ('payload', 'future', 'enqueue_time')
+
+    def __init__(self, payload: Any):
+        self.payload = payload
+        self.future = Future()
+        self.enqueue_time = time.perf_counter()
+
+
+class MicroBatchScheduler:
+    """
+    微批调度器
+
+    后台线程从队列取出第一个请求后，最多再等待 max_wait_ms 毫秒收集后续请求，
+    凑满 max_batch_size 个请求则立即提交。批处理函数接收载荷列表，
+    返回等长的结果列表；结果为异常对象时只让对应请求失败，批处理函数本身抛出异常时
+    整批失败。concurrency 大于1时多个后台线程各自凑批，
+    允许多个批次同时在途（如后端是多进程推理池）。
+    """
+
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Dict]],
+                 max_batch_size: int = 8, max_wait_ms: float = 5.0,
+                 name: str = 'local', history_size: int = 1000, concurrency: int = 1):
+        """
+        初始化调度器
+
+        Args:
+            batch_fn: 批处理函数，如 LocalModelInference.predict_batch
+            max_batch_size: 单批最大请求数
+            max_wait_ms: 凑批最长等待时间（毫秒）
+            name: 调度器名称，用于日志和统计
+            history_size: 保留用于统计分位数的最近请求数
+            concurrency: 同时在途的批次数（后台批处理线程数）
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._queue_waits = deque(maxlen=history_size)
+        self._batch_size_counts = {}
+        self._total_requests = 0
+        self._total_batches = 0
+        self._total_errors = 0
+
+        self._running = True
+        self._workers = []
+        for i in range(max(1, int(concurrency))):
+            worker = threading.Thread(target=self._run, name=f'batch-{name}-{i}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, payload: Any) -> Future:
+        """提交请求，返回Future；结果为 (推理结果, 批处理信息) 元组"""
+        if not self._running:
+            raise RuntimeError(f"调度器 {self.name} 已关闭")
+        item = _BatchItem(payload)
+        self._queue.put(item)
+        return item.future
+
+    def predict(self, payload: Any, timeout: float = None) -> Dict:
+        """
+        同步提交并等待结果
+
+        返回的结果字典中附带 batch_info：
+        queue_wait_ms（排队等待时间）和 batch_size（所在批次大小）
+        """
+        result, batch_info = self.submit(payload).result(timeout=timeout)
+        result = dict(result)
+        result['batch_info'] = batch_info
+        return result
+
+    def queue_depth(self) -> int:
+        """当前排队的请求数"""
+        return self._queue.qsize()
+
+    def _collect_batch(self) -> List[_BatchItem]:
+        """阻塞取第一个请求，然后在等待窗口内尽量凑满一批"""
+        first = self._queue.get()
+        if first is None:
+            # 关闭信号放回队列，让其他批处理线程也能退出
+            self._queue.put(None)
+            return []
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(block=remaining > 0, timeout=remaining if remaining > 0 else None)
+            except queue.Empty:
+                break
+            if item is None:
+                # 关闭信号放回队列，处理完当前批次后退出
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        """后台批处理循环"""
+        while self._running or not self._queue.empty():
+            batch = self._collect_batch()
+            if not batch:
+                break
+
+            start = time.perf_counter()
+            waits = [(start - item.enqueue_time) * 1000 for item in batch]
+
+            try:
+                results = self.batch_fn([item.payload for item in batch])
+                if len(results) != len(batch):
+                    raise ValueError(f"批处理返回{len(results)}个结果，期望{len(batch)}个")
+            except Exception as e:
+                logger.error(f"批处理推理失败({self.name}): {e}")
+                with self._stats_lock:
+                    self._total_errors += len(batch)
+                for item in batch:
+                    item.future.set_exception(e)
+                continue
+
+            inference_ms = (time.perf_counter() - start) * 1000
+            failed = 0
+            for item, result, wait_ms in zip(batch, results, waits):
+                if isinstance(result, BaseException):
+                    failed += 1
+                    item.future.set_exception(result)
+                    continue
+                item.future.set_result((result, {
+                    'queue_wait_ms': round(wait_ms, 3),
+                    'batch_size': len(batch),
+                    'batch_inference_ms': round(inference_ms, 3)
+                }))
+
+            with self._stats_lock:
+                self._total_errors += failed
+                self._total_requests += len(batch) - failed
+                self._total_batches += 1
+                self._batch_size_counts[len(batch)] = self._batch_size_counts.get(len(batch), 0) + 1
+                self._queue_waits.extend(waits)
+
+    def get_stats(self) -> Dict:
+        """获取调度统计信息"""
+        with self._stats_lock:
+            waits = sorted(self._queue_waits)
+            total_requests = self._total_requests
+            total_batches = self._total_batches
+            batch_size_counts = dict(sorted(self._batch_size_counts.items()))
+            total_errors = self._total_errors
+
+        def percentile(p):
+            if not waits:
+                return 0.0
+            return round(waits[min(len(waits) - 1, int(len(waits) * p))], 3)
+
+        return {
+            'name': self.name,
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'concurrency': len(self._workers),
+            'queue_depth': self.queue_depth(),
+            'total_requests': total_requests,
+            'total_batches': total_batches,
+            'total_errors': total_errors,
+            'avg_batch_size': round(total_requests / total_batches, 3) if total_batches else 0,
+            'batch_size_distribution': batch_size_counts,
+            'queue_wait_ms': {
+                'avg': round(sum(waits) / len(waits), 3) if waits else 0.0,
+                'p50': percentile(0.5),
+                'p95': percentile(0.95),
+                'max': round(waits[-1], 3) if waits else 0.0
+            }
+        }
+
+    def shutdown(self, wait: bool = True):
+        """停止调度器，已入队的请求处理完后退出"""
+        if not self._running:
+            return
+        self._running = False
+        self._queue.put(None)
+        if wait:
+            for worker in self._workers:
+                worker.join()
@@ -0,0 +1,378 @@
+"""
+检测API端到端压测
+经Flask应用（测试客户端，进程内）按给定并发和请求组合驱动 /api/upload、/api/detect、
+/api/history、/api/result，统计吞吐、p50/p95/p99延迟、各接口延迟，以及检测响应
+details 中服务端各阶段耗时（stages_ms 及 *_ms 字段）的分布，结果写成JSON便于跨提交对比。
+
+后端：mock（不加载模型，走模拟结果）或 onnx（合成的小型ONNX模型，或 --model 指定的模型）。
+其余服务配置（ENABLE_BATCHING、INFERENCE_WORKERS、FAST_DECODE 等）沿用环境变量，并记录到结果中。
+
+用法:
+    python benchmarks/bench_api.py [--backend mock|onnx] [--concurrency 1 4 8] [--requests 200]
+                                   [--mix detect=6,upload_detect=2,history=1,result=1]
+                                   [--detect-body raw|multipart|base64] [--output run.json] [--baseline old.json]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import base64
+import random
+import shutil
+import argparse
+import tempfile
+import platform
+import threading
+import subprocess
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from quantize_model import list_images
+
+# 写入结果的服务配置
+RECORDED_SETTINGS = ('USE_LOCAL_MODEL', 'ENABLE_BATCHING', 'BATCH_MAX_SIZE', 'BATCH_MAX_WAIT_MS', 'INFERENCE_WORKERS',
+                     'INFERENCE_CACHE', 'FAST_DECODE', 'MASK_FORMAT', 'SAVE_MASK_FILES', 'WRITE_BEHIND')
+
+# 可组合的操作（LoadTest 的同名方法）
+OPERATIONS = ('detect', 'upload_detect', 'history', 'result')
+
+
+def parse_mix(text):
+    """解析 'detect=6,history=1' 形式的请求组合为 [(操作, 权重)]"""
+    mix = []
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        if name.strip() not in OPERATIONS:
+            raise SystemExit(f"未知操作: {name}，可选 {', '.join(OPERATIONS)}")
+        mix.append((name.strip(), float(weight or 1)))
+    return mix
+
+
+def summarize(values):
+    """延迟分布（毫秒）"""
+    if not values:
+        return {'count': 0}
+    values = np.asarray(values, dtype=np.float64)
+    return {
+        'count': int(values.size),
+        'mean': round(float(values.mean()), 2),
+        'p50': round(float(np.percentile(values, 50)), 2),
+        'p95': round(float(np.percentile(values, 95)), 2),
+        'p99': round(float(np.percentile(values, 99)), 2),
+        'max': round(float(values.max()), 2)
+    }
+
+
+def git_revision():
+    """当前提交及工作区是否有未提交修改"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+class LoadTest:
+    """一次压测会话：持有图像样本、已产生的结果ID，并记录每个请求的耗时"""
+
+    def __init__(self, app_module, images, detect_body, seed=0):
+        self.core = app_module
+        self.images = images
+        self.detect_body = detect_body
+        self.rng = random.Random(seed)
+        self.result_ids = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        self.requests = []  # (接口, 毫秒, 是否成功)
+        self.operations = []  # (操作, 毫秒, 是否成功)
+        self.stages = defaultdict(list)  # 检测响应 details 中的 *_ms 字段
+
+    @property
+    def client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.core.app.test_client()
+        return client
+
+    def pick_image(self):
+        with self._lock:
+            return self.rng.choice(self.images)
+
+    def call(self, endpoint, method, path, **kwargs):
+        """发送一次请求并记录耗时，返回 (响应JSON, 是否成功)"""
+        start = time.perf_counter()
+        response = self.client.open(path, method=method, **kwargs)
+        elapsed = (time.perf_counter() - start) * 1000
+        ok = response.status_code == 200
+        payload = response.get_json(silent=True) or {}
+        with self._lock:
+            self.requests.append((endpoint, elapsed, ok))
+        return payload, ok
+
+    def record_detection(self, payload):
+        """记录检测结果ID和服务端各阶段耗时"""
+        with self._lock:
+            if payload.get('result_id'):
+                self.result_ids.append(payload['result_id'])
+            details = payload.get('detection', {}).get('details', {})
+            stages = details.get('stages_ms', {})
+            for key, value in stages.items():
+                self.stages[key].append(float(value))
+            for key, value in details.items():
+                # 其余 *_ms 字段（如批处理的 queue_wait_ms）已出现在 stages_ms 中的不重复统计
+                if (key.endswith('_ms') and key[:-3] not in stages or key == 'processing_time') \
+                        and isinstance(value, (int, float)) and not isinstance(value, bool):
+                    self.stages[key].append(float(value))
+
+    # ---- 操作 ----
+
+    def detect(self):
+        """直接检测：按 --detect-body 发送原始字节、multipart 或 base64 JSON"""
+        name, content = self.pick_image()
+        query = 'include_visualization=true'
+        if self.detect_body == 'raw':
+            kwargs = {'data': content, 'content_type': 'application/octet-stream'}
+        elif self.detect_body == 'multipart':
+            kwargs = {'data': {'image': (io.BytesIO(content), name)}, 'content_type': 'multipart/form-data'}
+        else:
+            kwargs = {'json': {'image': base64.b64encode(content).decode()}}
+        payload, ok = self.call('/api/detect', 'POST', f'/api/detect?{query}', **kwargs)
+        if ok:
+            self.record_detection(payload)
+        return ok
+
+    def upload_detect(self):
+        """先上传，再按文件名检测，最后读取结果（检测页面的完整流程）"""
+        name, content = self.pick_image()
+        payload, ok = self.call('/api/upload', 'POST', '/api/upload',
+                                data={'image': (io.BytesIO(content), name)}, content_type='multipart/form-data')
+        if not ok:
+            return False
+        payload, ok = self.call('/api/detect', 'POST', '/api/detect', json={'filename': payload['filename']})
+        if not ok:
+            return False
+        self.record_detection(payload)
+        _, ok = self.call('/api/result', 'GET', f"/api/result/{payload['result_id']}")
+        return ok
+
+    def history(self):
+        _, ok = self.call('/api/history', 'GET', '/api/history?limit=20')
+        return ok
+
+    def result(self):
+        with self._lock:
+            result_id = self.rng.choice(self.result_ids) if self.result_ids else None
+        if result_id is None:
+            return self.detect()
+        _, ok = self.call('/api/result', 'GET', f'/api/result/{result_id}')
+        return ok
+
+    def run_operation(self, name):
+        start = time.perf_counter()
+        try:
+            ok = getattr(self, name)()
+        except Exception:
+            ok = False
+        elapsed = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.operations.append((name, elapsed, ok))
+
+    def run(self, plan, concurrency):
+        """按计划的操作序列以给定并发执行，返回本轮统计"""
+        self.reset()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(self.run_operation, plan))
+        elapsed = time.perf_counter() - start
+
+        by_endpoint, by_operation = defaultdict(list), defaultdict(list)
+        endpoint_errors, operation_errors = defaultdict(int), defaultdict(int)
+        for endpoint, ms, ok in self.requests:
+            by_endpoint[endpoint].append(ms)
+            endpoint_errors[endpoint] += not ok
+        for name, ms, ok in self.operations:
+            by_operation[name].append(ms)
+            operation_errors[name] += not ok
+        return {
+            'concurrency': concurrency,
+            'operations': len(plan),
+            'requests': len(self.requests),
+            'errors': sum(operation_errors.values()),
+            'elapsed_s': round(elapsed, 3),
+            'throughput_ops': round(len(plan) / elapsed, 2),
+            'throughput_rps': round(len(self.requests) / elapsed, 2),
+            'latency_ms': summarize([ms for _, ms, _ in self.operations]),
+            'by_operation': {name: dict(summarize(values), errors=operation_errors[name])
+                             for name, values in sorted(by_operation.items())},
+            'by_endpoint': {name: dict(summarize(values), errors=endpoint_errors[name])
+                            for name, values in sorted(by_endpoint.items())},
+            'server_stages_ms': {name: summarize(values) for name, values in sorted(self.stages.items())}
+        }
+
+
+def load_images(folders):
+    """读取样例图像的原始字节 [(文件名, 字节)]"""
+    images = []
+    for folder in folders:
+        path = folder if os.path.isabs(folder) else os.path.join(ROOT, folder)
+        for file in list_images(path):
+            with open(file, 'rb') as f:
+                images.append((os.path.basename(file), f.read()))
+    return images
+
+
+def configure_backend(args, workdir):
+    """在导入app之前通过环境变量选择后端"""
+    os.environ['INFERENCE_CACHE'] = 'true' if args.cache else 'false'
+    os.environ.setdefault('MODEL_WARMUP', 'true')
+    if args.backend == 'mock':
+        os.environ['USE_LOCAL_MODEL'] = 'false'
+        os.environ['BML_MODEL_ENDPOINT'] = ''
+        return 'mock'
+    os.environ['USE_LOCAL_MODEL'] = 'true'
+    if args.model:
+        os.environ['MODEL_PATH'] = os.path.abspath(args.model)
+        os.environ['MODEL_CONFIG'] = os.path.abspath(args.config)
+        return args.model
+    from onnx_test_model import build_test_model
+    model_base = os.path.join(workdir, 'model')
+    build_test_model(f"{model_base}.onnx", args.input_size)
+    with open(f"{model_base}.json", 'w', encoding='utf-8') as f:
+        json.dump({'framework': 'onnx', 'input_size': [args.input_size, args.input_size]}, f)
+    os.environ['MODEL_PATH'] = model_base
+    os.environ['MODEL_CONFIG'] = f"{model_base}.json"
+    return f'合成ONNX模型 {args.input_size}x{args.input_size}'
+
+
+def print_run(run):
+    latency = run['latency_ms']
+    print(f"\n并发 {run['concurrency']}: {run['operations']} 次操作 / {run['requests']} 个请求，"
+          f"{run['elapsed_s']}s，{run['throughput_ops']} 操作/s，{run['throughput_rps']} 请求/s，错误 {run['errors']}")
+    print(f"  {'':<24}{'次数':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'错误':>8}")
+    print(f"  {'全部操作':<22}{latency['count']:>8}{latency['p50']:>10.1f}{latency['p95']:>10.1f}{latency['p99']:>10.1f}"
+          f"{run['errors']:>8}")
+    for group in ('by_operation', 'by_endpoint'):
+        for name, row in run[group].items():
+            print(f"  {name:<24}{row['count']:>8}{row['p50']:>10.1f}{row['p95']:>10.1f}{row['p99']:>10.1f}"
+                  f"{row['errors']:>8}")
+    for name, row in run['server_stages_ms'].items():
+        print(f"  {'[服务端] ' + name:<21}{row['count']:>8}{row['p50']:>10.1f}{row['p95']:>10.1f}{row['p99']:>10.1f}")
+
+
+def compare(runs, baseline_path):
+    """与之前保存的结果按并发逐项对比吞吐和p95"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    previous = {run['concurrency']: run for run in baseline.get('runs', [])}
+    print(f"\n与基线对比（{baseline['meta'].get('commit')}）")
+    print(f"{'并发':<8}{'吞吐 操作/s':>22}{'p95 ms':>22}")
+    for run in runs:
+        old = previous.get(run['concurrency'])
+        if old is None:
+            continue
+        print(f"{run['concurrency']:<8}"
+              f"{old['throughput_ops']:>10.1f} -> {run['throughput_ops']:<9.1f}"
+              f"{old['latency_ms']['p95']:>10.1f} -> {run['latency_ms']['p95']:<9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='检测API端到端压测')
+    parser.add_argument('--backend', choices=('mock', 'onnx'), default='onnx', help='推理后端')
+    parser.add_argument('--model', help='onnx后端使用的模型路径（不含扩展名），缺省生成合成模型')
+    parser.add_argument('--config', help='模型配置文件')
+    parser.add_argument('--input-size', type=int, default=256, help='合成模型的输入边长')
+    parser.add_argument('--images', nargs='+', default=['test_images', 'test_shibie', 'test_fenge'], help='图像目录')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8], help='并发数（每个值一轮）')
+    parser.add_argument('--requests', type=int, default=200, help='每轮操作数')
+    parser.add_argument('--warmup', type=int, default=20, help='每轮前的预热操作数（不计入统计）')
+    parser.add_argument('--mix', default='detect=6,upload_detect=2,history=1,result=1', help='操作组合及权重')
+    parser.add_argument('--detect-body', choices=('raw', 'multipart', 'base64'), default='raw',
+                        help='detect操作的请求体格式')
+    parser.add_argument('--cache', action='store_true', help='启用推理缓存（缺省关闭，每次检测都实际推理）')
+    parser.add_argument('--seed', type=int, default=0, help='操作序列与图像选择的随机种子')
+    parser.add_argument('--output', help='结果JSON路径')
+    parser.add_argument('--baseline', help='对比的历史结果JSON')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    images = load_images(args.images)
+    if not images:
+        raise SystemExit("没有找到样例图像")
+
+    # app 在当前目录下创建 uploads/results 等目录，压测在临时目录中进行
+    workdir = tempfile.mkdtemp(prefix='bench_api_')
+    cwd = os.getcwd()
+    core = None
+    try:
+        backend = configure_backend(args, workdir)
+        os.chdir(workdir)
+        import app as core
+
+        start = time.perf_counter()
+        client = core.app.test_client()
+        while client.get('/api/ready').status_code != 200:
+            time.sleep(0.1)
+        ready_s = time.perf_counter() - start
+
+        test = LoadTest(core, images, args.detect_body, seed=args.seed)
+        names, weights = zip(*mix)
+        rng = random.Random(args.seed)
+        print(f"后端: {backend}，图像 {len(images)} 张，组合 {args.mix}，请求体 {args.detect_body}")
+
+        runs = []
+        for concurrency in args.concurrency:
+            if args.warmup:
+                test.run(rng.choices(names, weights, k=args.warmup), concurrency)
+            run = test.run(rng.choices(names, weights, k=args.requests), concurrency)
+            runs.append(run)
+            print_run(run)
+
+        commit, dirty = git_revision()
+        report = {
+            'meta': {
+                'benchmark': 'bench_api',
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'commit': commit,
+                'dirty': dirty,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'backend': backend,
+                'ready_s': round(ready_s, 3),
+                'images': len(images),
+                'args': vars(args),
+                'settings': {name: getattr(core, name, None) for name in RECORDED_SETTINGS}
+            },
+            'runs': runs
+        }
+        if args.output:
+            output = os.path.join(cwd, args.output)
+            with open(output, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"\n结果已写入 {output}")
+        if args.baseline:
+            compare(runs, os.path.join(cwd, args.baseline))
+    finally:
+        if core is not None:
+            core.result_writer.flush(timeout=30)
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
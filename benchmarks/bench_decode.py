@@ -0,0 +1,131 @@
+"""
+上传图像解码基准
+对比全分辨率解码（Image.open + convert('RGB')）与按模型输入尺寸降分辨率解码（ImageDecoder）
+的单张解码耗时和峰值内存。每种模式在独立的Python进程中测量，峰值RSS互不影响。
+
+测试集：test_images/、test_shibie/ 原图，以及由它们放大生成的大尺寸JPEG/PNG
+（模拟手机拍摄的大图上传，其中一组带EXIF旋转标记）
+
+用法:
+    python benchmarks/bench_decode.py [--dirs test_images test_shibie] [--large-size 4000x3000]
+                                      [--target 512x512] [--repeat 5]
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from quantize_model import list_images
+
+# 在子进程中执行的测量脚本，结果以JSON写到标准输出最后一行
+PROBE = r'''
+import os, sys, json, time
+def peak_rss_mb():
+    # VmHWM在exec时重置；ru_maxrss会带上父进程的峰值
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+sys.path.insert(0, {root!r})
+from PIL import Image
+from image_decode import ImageDecoder
+files = {files!r}
+decoder = ImageDecoder()
+def decode(path):
+    if {mode!r} == 'full':
+        with Image.open(path) as image:
+            return image.convert('RGB')
+    return decoder.decode(path, {target!r})
+rss_before = peak_rss_mb()
+latencies, sizes = [], set()
+for _ in range({repeat!r}):
+    for path in files:
+        start = time.perf_counter()
+        image = decode(path)
+        latencies.append((time.perf_counter() - start) * 1000)
+        sizes.add('%dx%d' % image.size)
+        del image
+latencies.sort()
+print(json.dumps({{
+    'p50_ms': latencies[len(latencies) // 2],
+    'mean_ms': sum(latencies) / len(latencies),
+    'peak_rss_mb': peak_rss_mb(),
+    'base_rss_mb': rss_before,
+    'sizes': sorted(sizes)
+}}))
+'''
+
+
+def probe(files, mode, target, repeat):
+    code = PROBE.format(root=ROOT, files=files, mode=mode, target=target, repeat=repeat)
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def build_large_set(sources, workdir, size):
+    """把样例图像放大为大尺寸JPEG/PNG，并生成一组带EXIF旋转标记（Orientation=6）的JPEG"""
+    from PIL import Image
+    groups = {'大图JPEG': [], '大图PNG': [], '大图JPEG+EXIF旋转': []}
+    for i, path in enumerate(sources):
+        with Image.open(path) as image:
+            large = image.convert('RGB').resize(size, Image.Resampling.BICUBIC)
+        jpeg = os.path.join(workdir, f'large_{i}.jpg')
+        large.save(jpeg, quality=90)
+        groups['大图JPEG'].append(jpeg)
+        png = os.path.join(workdir, f'large_{i}.png')
+        large.save(png, compress_level=1)
+        groups['大图PNG'].append(png)
+        rotated = os.path.join(workdir, f'large_{i}_exif.jpg')
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        large.transpose(Image.Transpose.ROTATE_90).save(rotated, quality=90, exif=exif)
+        groups['大图JPEG+EXIF旋转'].append(rotated)
+    return groups
+
+
+def main():
+    parser = argparse.ArgumentParser(description='上传图像解码基准')
+    parser.add_argument('--dirs', nargs='+', default=['test_images', 'test_shibie'], help='样例图像目录')
+    parser.add_argument('--large-size', default='4000x3000', help='放大生成的大图尺寸，空字符串不生成')
+    parser.add_argument('--target', default='512x512', help='模型输入尺寸（降分辨率解码的目标）')
+    parser.add_argument('--repeat', type=int, default=5, help='重复次数')
+    args = parser.parse_args()
+
+    target = tuple(int(v) for v in args.target.lower().split('x'))
+    groups = {}
+    for folder in args.dirs:
+        path = folder if os.path.isabs(folder) else os.path.join(ROOT, folder)
+        files = list_images(path)
+        if files:
+            groups[folder] = files
+
+    workdir = tempfile.mkdtemp(prefix='bench_decode_')
+    try:
+        if args.large_size:
+            size = tuple(int(v) for v in args.large_size.lower().split('x'))
+            samples = [path for files in groups.values() for path in files][:4]
+            groups.update(build_large_set(samples, workdir, size))
+
+        print(f"目标尺寸 {target[0]}x{target[1]}，每组重复 {args.repeat} 次")
+        print(f"{'图像组':<22}{'模式':<12}{'p50 ms':>10}{'平均 ms':>10}{'峰值RSS MB':>12}{'解码增量 MB':>12}"
+              f"{'解码尺寸':>22}")
+        for name, files in groups.items():
+            for mode, label in (('full', '全分辨率'), ('reduced', '降分辨率')):
+                row = probe(files, mode, target, args.repeat)
+                print(f"{name:<22}{label:<12}{row['p50_ms']:>10.2f}{row['mean_ms']:>10.2f}"
+                      f"{row['peak_rss_mb']:>12.1f}{row['peak_rss_mb'] - row['base_rss_mb']:>12.1f}"
+                      f"{','.join(row['sizes']):>22}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+ONNX Runtime会话基准
+对比默认会话（默认参数、每次调用 get_inputs() + run(None, ...)）与按配置调优的会话
+（线程数、图优化级别、优化模型缓存、预解析输入输出名、IO绑定预分配输出）在CPU上的
+启动耗时和单次推理耗时
+
+用法:
+    python benchmarks/bench_onnx_session.py [--model path/to/model.onnx] [--batch 1 4] [--repeat 20]
+未指定 --model 时生成合成模型（benchmarks/onnx_test_model.py）
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+import onnxruntime as ort
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from model_inference import LocalModelInference
+from onnx_test_model import build_test_model
+
+
+def timed(fn, repeat):
+    """返回平均耗时（毫秒）和最后一次结果"""
+    result = fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) * 1000 / repeat, result
+
+
+def load_tuned(model_base, config_path):
+    start = time.perf_counter()
+    model = LocalModelInference(model_base, config_path)
+    return model, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ONNX Runtime会话基准')
+    parser.add_argument('--model', help='.onnx模型文件，缺省生成合成模型')
+    parser.add_argument('--size', type=int, default=512, help='模型输入边长')
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 4], help='批大小')
+    parser.add_argument('--threads', type=int, default=0, help='算子内线程数，0为可用核数')
+    parser.add_argument('--repeat', type=int, default=20, help='重复次数')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_onnx_')
+    try:
+        model_file = os.path.join(workdir, 'model.onnx')
+        if args.model:
+            shutil.copy(args.model, model_file)
+        else:
+            build_test_model(model_file, args.size)
+        model_base = model_file[:-len('.onnx')]
+        config_path = os.path.join(workdir, 'model_config.json')
+        with open(config_path, 'w', encoding='utf-8') as f:
+            json.dump({'framework': 'onnx', 'input_size': [args.size, args.size],
+                       'cpu_threads': args.threads or None,
+                       'onnx': {'graph_optimization_level': 'all', 'io_binding': True}}, f)
+
+        print(f"ONNX Runtime {ort.__version__}, 模型: {args.model or '合成模型'}")
+        rows = []
+
+        start = time.perf_counter()
+        default = ort.InferenceSession(model_file, providers=['CPUExecutionProvider'])
+        rows.append(('启动 默认会话', (time.perf_counter() - start) * 1000))
+        _, cold_ms = load_tuned(model_base, config_path)
+        rows.append(('启动 调优会话（首次，写出优化缓存）', cold_ms))
+        tuned, warm_ms = load_tuned(model_base, config_path)
+        rows.append(('启动 调优会话（加载优化缓存）', warm_ms))
+        assert tuned.model_type == 'onnx', '调优会话加载失败'
+
+        rng = np.random.default_rng(0)
+        for batch_size in args.batch:
+            batch = rng.random((batch_size, 3, args.size, args.size), dtype=np.float32)
+
+            def run_default():
+                return default.run(None, {default.get_inputs()[0].name: batch})
+
+            ms, expected = timed(run_default, args.repeat)
+            rows.append((f'推理 默认会话 batch={batch_size}', ms))
+
+            tuned._onnx_io_binding = False
+            ms, _ = timed(lambda: tuned._run_onnx(batch), args.repeat)
+            rows.append((f'推理 调优会话 batch={batch_size}', ms))
+
+            tuned._onnx_io_binding = True
+            ms, outputs = timed(lambda: tuned._run_onnx(batch), args.repeat)
+            rows.append((f'推理 调优会话+IO绑定 batch={batch_size}', ms))
+            for a, b in zip(expected, outputs):
+                assert np.allclose(a, b, atol=1e-4), '调优会话输出与默认会话不一致'
+
+        print(f"{'步骤':<40}{'平均ms':>10}")
+        for name, ms in rows:
+            print(f"{name:<40}{ms:>10.2f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
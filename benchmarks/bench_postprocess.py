@@ -0,0 +1,144 @@
+"""
+后处理性能基准
+用数千个随机候选框对比逐个循环的参考实现与向量化后处理阶段（NMS / 按类别NMS / 掩码NMS / 边界框还原）
+
+用法:
+    python benchmarks/bench_postprocess.py [--boxes 5000] [--masks 300] [--repeat 20]
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from postprocess import PostProcessor, nms, batched_nms, mask_nms
+from preprocessing import map_boxes_to_original
+
+INPUT_SIZE = (512, 512)
+
+
+def make_candidates(count, num_classes=2, seed=0):
+    """生成成簇分布的随机候选框（模拟检测头输出的大量重叠框）"""
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(40, 472, (max(1, count // 50), 2))
+    picks = centers[rng.integers(0, len(centers), count)] + rng.normal(0, 6, (count, 2))
+    sizes = rng.uniform(20, 80, (count, 2))
+    boxes = np.concatenate([picks - sizes / 2, picks + sizes / 2], axis=1).astype(np.float32)
+    scores = rng.uniform(0, 1, count).astype(np.float32)
+    labels = rng.integers(0, num_classes, count)
+    return np.clip(boxes, 0, INPUT_SIZE[0]), scores, labels
+
+
+def make_masks(boxes, mask_size=128):
+    """按边界框生成椭圆掩码，覆盖整个模型输入"""
+    ratio = mask_size / INPUT_SIZE[0]
+    ys, xs = np.mgrid[0:mask_size, 0:mask_size]
+    masks = np.zeros((len(boxes), mask_size, mask_size), dtype=bool)
+    for i, (x1, y1, x2, y2) in enumerate(boxes * ratio):
+        cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+        rx, ry = max((x2 - x1) / 2, 1), max((y2 - y1) / 2, 1)
+        masks[i] = ((xs - cx) / rx) ** 2 + ((ys - cy) / ry) ** 2 <= 1
+    return masks
+
+
+def reference_nms(boxes, scores, iou_threshold):
+    """逐对比较的参考NMS"""
+    order = sorted(range(len(scores)), key=lambda i: -scores[i])
+    suppressed = [False] * len(order)
+    keep = []
+    for a, i in enumerate(order):
+        if suppressed[a]:
+            continue
+        keep.append(i)
+        for b in range(a + 1, len(order)):
+            if suppressed[b]:
+                continue
+            j = order[b]
+            xx1, yy1 = max(boxes[i][0], boxes[j][0]), max(boxes[i][1], boxes[j][1])
+            xx2, yy2 = min(boxes[i][2], boxes[j][2]), min(boxes[i][3], boxes[j][3])
+            inter = max(0.0, xx2 - xx1) * max(0.0, yy2 - yy1)
+            area_i = (boxes[i][2] - boxes[i][0]) * (boxes[i][3] - boxes[i][1])
+            area_j = (boxes[j][2] - boxes[j][0]) * (boxes[j][3] - boxes[j][1])
+            if inter / max(area_i + area_j - inter, 1e-9) > iou_threshold:
+                suppressed[b] = True
+    return keep
+
+
+def reference_rescale(boxes, transform):
+    """旧版逐框循环、每次迭代重新计算缩放系数的还原方式"""
+    mapped = []
+    for box in boxes:
+        orig_w, orig_h = transform['original_size']
+        scale_x, scale_y = transform['scale_x'], transform['scale_y']
+        mapped.append([
+            min(max((box[0] - transform['pad_x']) / scale_x, 0), orig_w),
+            min(max((box[1] - transform['pad_y']) / scale_y, 0), orig_h),
+            min(max((box[2] - transform['pad_x']) / scale_x, 0), orig_w),
+            min(max((box[3] - transform['pad_y']) / scale_y, 0), orig_h)
+        ])
+    return mapped
+
+
+def timed(fn, repeat):
+    """返回平均耗时（毫秒）和最后一次结果"""
+    result = fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) * 1000 / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='后处理性能基准')
+    parser.add_argument('--boxes', type=int, default=5000, help='候选框数')
+    parser.add_argument('--masks', type=int, default=300, help='参与掩码NMS的候选数')
+    parser.add_argument('--iou', type=float, default=0.5, help='NMS IoU阈值')
+    parser.add_argument('--repeat', type=int, default=20, help='重复次数')
+    args = parser.parse_args()
+
+    boxes, scores, labels = make_candidates(args.boxes)
+    transform = {'original_size': (1920, 1080), 'input_size': INPUT_SIZE,
+                 'content_size': (512, 288), 'scale_x': 512 / 1920, 'scale_y': 288 / 1080,
+                 'pad_x': 0, 'pad_y': 112}
+    print(f"候选框数: {args.boxes}, IoU阈值: {args.iou}")
+
+    rows = []
+
+    ref_ms, ref_keep = timed(lambda: reference_nms(boxes.tolist(), scores.tolist(), args.iou),
+                             max(1, args.repeat // 10))
+    vec_ms, vec_keep = timed(lambda: nms(boxes, scores, args.iou), args.repeat)
+    assert sorted(ref_keep) == sorted(vec_keep.tolist()), '向量化NMS与参考实现结果不一致'
+    rows.append(('NMS 参考实现（逐对循环）', ref_ms, len(ref_keep)))
+    rows.append(('NMS 向量化', vec_ms, len(vec_keep)))
+
+    cls_ms, cls_keep = timed(lambda: batched_nms(boxes, scores, labels, args.iou), args.repeat)
+    rows.append(('按类别NMS（坐标平移）', cls_ms, len(cls_keep)))
+
+    for top_k in (0, 1000):
+        processor = PostProcessor(pre_nms_top_k=top_k, max_detections=100)
+        ms, keep = timed(lambda: processor.select(boxes, scores, labels, 0.05, args.iou), args.repeat)
+        rows.append((f"完整选择 conf>0.05 pre_top_k={top_k or '不限'}", ms, len(keep)))
+
+    subset = np.argsort(-scores)[:args.masks]
+    masks = make_masks(boxes[subset])
+    ratio = masks.shape[1] / INPUT_SIZE[0]
+    ms, keep = timed(lambda: mask_nms(masks, boxes[subset] * ratio, scores[subset], labels[subset], args.iou),
+                     args.repeat)
+    rows.append((f"掩码NMS（{args.masks}个, 裁剪到边界框）", ms, len(keep)))
+
+    ref_ms, _ = timed(lambda: reference_rescale(boxes, transform), max(1, args.repeat // 10))
+    vec_ms, mapped = timed(lambda: map_boxes_to_original(boxes, transform), args.repeat)
+    assert np.allclose(np.asarray(reference_rescale(boxes, transform)), mapped, atol=1e-3)
+    rows.append(('边界框还原 逐框循环', ref_ms, len(boxes)))
+    rows.append(('边界框还原 向量化', vec_ms, len(mapped)))
+
+    print(f"{'步骤':<36}{'平均ms':>10}{'输出数':>8}")
+    for name, ms, count in rows:
+        print(f"{name:<36}{ms:>10.3f}{count:>8}")
+
+
+if __name__ == '__main__':
+    main()
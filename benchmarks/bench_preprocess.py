@@ -0,0 +1,108 @@
+"""
+预处理性能基准
+对比旧版逐通道归一化路径与查表融合预处理的单张延迟和峰值内存
+
+用法:
+    python benchmarks/bench_preprocess.py [图像目录...] [--size 512] [--repeat 20]
+"""
+
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from preprocessing import ImagePreprocessor
+
+MEAN = [0.485, 0.456, 0.406]
+STD = [0.229, 0.224, 0.225]
+
+
+def legacy_preprocess(image, input_size):
+    """旧版 LocalModelInference.preprocess_image 实现"""
+    image = image.resize(input_size, Image.Resampling.LANCZOS)
+    img_array = np.array(image).astype(np.float32)
+    img_array = img_array / 255.0
+    for i in range(3):
+        img_array[:, :, i] = (img_array[:, :, i] - MEAN[i]) / STD[i]
+    img_array = img_array.transpose(2, 0, 1)
+    img_array = np.expand_dims(img_array, axis=0)
+    return img_array
+
+
+def load_images(folders):
+    """读取目录中的图像文件（保留未解码状态以便draft模式生效）"""
+    paths = []
+    for folder in folders:
+        for name in sorted(os.listdir(folder)):
+            if name.lower().rsplit('.', 1)[-1] in ('png', 'jpg', 'jpeg', 'bmp'):
+                paths.append(os.path.join(folder, name))
+    return paths
+
+
+def measure(fn, paths, repeat, preload):
+    """
+    返回 (单张平均延迟ms, p95延迟ms, 峰值内存MB)
+
+    内存追踪从预热调用之前开始，融合路径首次调用时分配的复用缓冲区计入峰值
+    """
+    images = [Image.open(p).convert('RGB') for p in paths] if preload else None
+
+    tracemalloc.start()
+    # 预热（不计入延迟）
+    fn(images[0] if preload else Image.open(paths[0]))
+
+    latencies = []
+    for _ in range(repeat):
+        for i, path in enumerate(paths):
+            image = images[i] if preload else Image.open(path)
+            start = time.perf_counter()
+            fn(image)
+            latencies.append((time.perf_counter() - start) * 1000)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return float(np.mean(latencies)), float(np.percentile(latencies, 95)), peak / 1024 / 1024
+
+
+def main():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description='预处理性能基准')
+    parser.add_argument('folders', nargs='*', default=[os.path.join(root, 'test_images'),
+                                                       os.path.join(root, 'test_shibie')])
+    parser.add_argument('--size', type=int, default=512, help='模型输入边长')
+    parser.add_argument('--repeat', type=int, default=10, help='每张图像重复次数')
+    args = parser.parse_args()
+
+    paths = load_images(args.folders)
+    if not paths:
+        print('未找到图像')
+        return
+    input_size = (args.size, args.size)
+
+    # 校验新旧路径数值一致
+    sample = Image.open(paths[0]).convert('RGB')
+    fused = ImagePreprocessor(input_size, MEAN, STD)
+    diff = np.abs(legacy_preprocess(sample, input_size) - fused(sample)).max()
+    print(f"图像数: {len(paths)}, 输入尺寸: {input_size}, 新旧结果最大误差: {diff:.2e}")
+
+    variants = [
+        ('legacy (LANCZOS + 逐通道循环)', lambda img: legacy_preprocess(img, input_size), True),
+        ('fused  (LANCZOS + 查表融合)', ImagePreprocessor(input_size, MEAN, STD), True),
+        ('fused  (BILINEAR + reduce)', ImagePreprocessor(input_size, MEAN, STD,
+                                                         fast_mode_min_pixels=0), True),
+        ('fused  (JPEG draft + BILINEAR, 含解码)',
+         ImagePreprocessor(input_size, MEAN, STD, fast_mode_min_pixels=0, jpeg_draft=True), False),
+    ]
+
+    print(f"{'路径':<34}{'平均ms':>10}{'p95 ms':>10}{'峰值MB':>10}")
+    for name, fn, preload in variants:
+        mean_ms, p95_ms, peak_mb = measure(fn, paths, args.repeat, preload)
+        print(f"{name:<34}{mean_ms:>10.2f}{p95_ms:>10.2f}{peak_mb:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
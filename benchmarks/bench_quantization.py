@@ -0,0 +1,172 @@
+"""
+量化变体基准
+为FP32 ONNX模型生成 int8_dynamic / int8_static / fp16 变体（quantize_model.py），
+在评估图像上逐个对比：单张延迟、批量吞吐、模型体积，以及与FP32结果的一致性
+（按类别和边界框IoU匹配实例后的框F1与平均掩码IoU），用数据选择线上变体
+
+用法:
+    python benchmarks/bench_quantization.py [--model models/oral_health_model --config models/model_config.json]
+                                            [--images test_images] [--calibration test_images] [--batch 4]
+未指定 --model 时使用合成模型（权重随机，一致性数字只反映数值误差，不代表真实精度）
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import mask_codec
+from model_inference import LocalModelInference
+from postprocess import box_iou
+from quantize_model import build_variant, list_images, variant_file
+
+
+def match_instances(reference, candidate, iou_threshold=0.5):
+    """同类别实例按边界框IoU贪心匹配，返回 [(参考下标, 候选下标)]"""
+    pairs, used = [], set()
+    if not reference or not candidate:
+        return pairs
+    cand_boxes = np.array([inst['bbox'] for inst in candidate], dtype=np.float32)
+    for i, inst in enumerate(reference):
+        ious = box_iou(np.asarray(inst['bbox'], dtype=np.float32), cand_boxes)
+        for j in np.argsort(-ious):
+            if ious[j] < iou_threshold:
+                break
+            if j not in used and candidate[j]['category'] == inst['category']:
+                used.add(j)
+                pairs.append((i, int(j)))
+                break
+    return pairs
+
+
+def mask_iou(a, b):
+    """两个编码掩码的IoU（解码为整幅掩码后计算）"""
+    if a is None or b is None:
+        return None
+    ma, mb = mask_codec.decode_mask(a) > 0, mask_codec.decode_mask(b) > 0
+    union = np.logical_or(ma, mb).sum()
+    return float(np.logical_and(ma, mb).sum() / union) if union else 1.0
+
+
+def agreement(reference_results, candidate_results):
+    """返回 (框F1, 平均掩码IoU)"""
+    matched = ref_total = cand_total = 0
+    ious = []
+    for ref, cand in zip(reference_results, candidate_results):
+        ref, cand = ref['results'], cand['results']
+        pairs = match_instances(ref, cand)
+        matched += len(pairs)
+        ref_total += len(ref)
+        cand_total += len(cand)
+        for i, j in pairs:
+            value = mask_iou(ref[i].get('mask'), cand[j].get('mask'))
+            if value is not None:
+                ious.append(value)
+    if ref_total + cand_total == 0:
+        return 1.0, 1.0
+    f1 = 2 * matched / (ref_total + cand_total)
+    return f1, (float(np.mean(ious)) if ious else float('nan'))
+
+
+def evaluate(model_base, config_path, variant, images, batch_size, repeat):
+    """加载变体并测量延迟、吞吐，返回 (指标, 每张图像的结果)"""
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    config['model_variant'] = variant
+    variant_config = os.path.join(os.path.dirname(config_path), f'config_{variant}.json')
+    with open(variant_config, 'w', encoding='utf-8') as f:
+        json.dump(config, f)
+
+    model = LocalModelInference(model_base, variant_config)
+    if model.model_type != 'onnx':
+        raise RuntimeError(f"{variant} 加载失败")
+    options = {'full_masks': True}
+    prepared = [model.prepare(image) for image in images]
+
+    results = model.predict_batch(prepared[:1], [options])  # 预热
+    latencies = []
+    for _ in range(repeat):
+        for item in prepared:
+            start = time.perf_counter()
+            model.predict_batch([item], [options])
+            latencies.append((time.perf_counter() - start) * 1000)
+    results = [model.predict_batch([item], [options])[0] for item in prepared]
+
+    batches = [prepared[i:i + batch_size] for i in range(0, len(prepared), batch_size)]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for batch in batches:
+            model.predict_batch(batch, [options] * len(batch))
+    throughput = repeat * len(prepared) / (time.perf_counter() - start)
+
+    metrics = {
+        'size_mb': os.path.getsize(variant_file(model_base, variant)) / 1024 / 1024,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'throughput': throughput
+    }
+    return metrics, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='量化变体基准')
+    parser.add_argument('--model', help='FP32模型路径（不含扩展名），缺省生成合成模型')
+    parser.add_argument('--config', help='模型配置文件')
+    parser.add_argument('--images', default=os.path.join(ROOT, 'test_images'), help='评估图像目录')
+    parser.add_argument('--calibration', default=os.path.join(ROOT, 'test_images'), help='静态量化校准图像目录')
+    parser.add_argument('--variants', nargs='+', default=['int8_dynamic', 'int8_static', 'fp16'])
+    parser.add_argument('--batch', type=int, default=4, help='吞吐测试的批大小')
+    parser.add_argument('--repeat', type=int, default=3, help='重复次数')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_quant_')
+    try:
+        model_base = os.path.join(workdir, 'model')
+        config_path = os.path.join(workdir, 'model_config.json')
+        if args.model:
+            shutil.copy(f"{args.model}.onnx", f"{model_base}.onnx")
+            shutil.copy(args.config, config_path)
+        else:
+            from onnx_test_model import build_test_model
+            build_test_model(f"{model_base}.onnx", 512)
+            with open(config_path, 'w', encoding='utf-8') as f:
+                json.dump({'framework': 'onnx', 'input_size': [512, 512], 'confidence_threshold': 0.5}, f)
+
+        images = []
+        for path in list_images(args.images):
+            with Image.open(path) as image:
+                images.append(image.convert('RGB'))
+        print(f"评估图像: {len(images)} 张, 模型: {args.model or '合成模型'}")
+
+        rows = []
+        reference_metrics, reference = evaluate(model_base, config_path, 'fp32', images, args.batch, args.repeat)
+        rows.append(('fp32', reference_metrics, 1.0, 1.0))
+        for variant in args.variants:
+            start = time.perf_counter()
+            build_variant(variant, model_base, config_path, args.calibration)
+            build_s = time.perf_counter() - start
+            metrics, results = evaluate(model_base, config_path, variant, images, args.batch, args.repeat)
+            f1, miou = agreement(reference, results)
+            metrics['build_s'] = build_s
+            rows.append((variant, metrics, f1, miou))
+
+        print(f"{'变体':<14}{'体积MB':>8}{'p50 ms':>9}{'p95 ms':>9}{'吞吐/s':>9}{'框F1':>8}{'掩码IoU':>9}{'生成s':>8}")
+        for variant, m, f1, miou in rows:
+            print(f"{variant:<14}{m['size_mb']:>8.2f}{m['p50_ms']:>9.1f}{m['p95_ms']:>9.1f}{m['throughput']:>9.2f}"
+                  f"{f1:>8.3f}{miou:>9.3f}{m.get('build_s', 0):>8.1f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+远程推理客户端基准
+对本地桩服务对比：每次新建连接+PNG载荷的旧调用方式、连接池客户端（JPEG / 原始uint8）、
+长尾延迟下的对冲请求，以及远端不可用时熔断前后的失败耗时
+
+用法:
+    python benchmarks/bench_remote_client.py [--requests 200] [--concurrency 8] [--size 512]
+"""
+
+import io
+import os
+import sys
+import time
+import base64
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bml_stub_server import StubConfig, start_stub_server
+from remote_client import RemoteInferenceClient, RemoteInferenceError, encode_payload
+
+
+def legacy_call(endpoint, pixels):
+    """旧版调用：每次 requests.post（新建连接）并发送PNG"""
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='PNG')
+    payload = {'data': {'image': base64.b64encode(buffer.getvalue()).decode(), 'format': 'base64'},
+               'params': {}}
+    response = requests.post(endpoint, json=payload, timeout=60)
+    response.raise_for_status()
+    return response.json()
+
+
+def run_load(call, count, concurrency):
+    """并发执行 count 次调用，返回 (总耗时秒, 每次延迟ms列表, 失败数)"""
+    def one(_):
+        start = time.perf_counter()
+        try:
+            call()
+            ok = True
+        except Exception:
+            ok = False
+        return (time.perf_counter() - start) * 1000, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(one, range(count)))
+    elapsed = time.perf_counter() - start
+    return elapsed, [ms for ms, _ in results], sum(1 for _, ok in results if not ok)
+
+
+def report(name, elapsed, latencies, failures, count):
+    latencies = np.asarray(latencies)
+    print(f"{name:<34}{count / elapsed:>10.1f}{np.percentile(latencies, 50):>10.1f}"
+          f"{np.percentile(latencies, 99):>10.1f}{failures:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='远程推理客户端基准')
+    parser.add_argument('--requests', type=int, default=200, help='每组请求数')
+    parser.add_argument('--concurrency', type=int, default=8, help='并发数')
+    parser.add_argument('--size', type=int, default=512, help='模型输入边长')
+    parser.add_argument('--latency-ms', type=float, default=20, help='桩服务常规延迟')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    # 平滑图像更接近真实照片的压缩率
+    base = rng.integers(0, 255, (args.size // 16, args.size // 16, 3), dtype=np.uint8)
+    pixels = np.asarray(Image.fromarray(base).resize((args.size, args.size), Image.BILINEAR))
+
+    for fmt in ('png', 'jpeg', 'raw'):
+        size = len(encode_payload(pixels, fmt)['image'])
+        print(f"载荷 {fmt:<5} base64体积: {size / 1024:.1f} KB")
+
+    config = StubConfig(latency_ms=args.latency_ms)
+    server, endpoint = start_stub_server(config)
+    print(f"\n{'场景':<34}{'吞吐/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'失败':>8}")
+
+    n, c = args.requests, args.concurrency
+    report('旧版 requests.post + PNG', *run_load(lambda: legacy_call(endpoint, pixels), n, c), n)
+    for fmt in ('jpeg', 'raw'):
+        client = RemoteInferenceClient(endpoint, max_concurrency=c, payload_format=fmt)
+        report(f'连接池客户端 + {fmt}', *run_load(lambda: client.infer(pixels), n, c), n)
+        client.close()
+
+    # 长尾：5%的请求耗时10倍
+    config.tail_ms, config.tail_rate = args.latency_ms * 10, 0.05
+    plain = RemoteInferenceClient(endpoint, max_concurrency=c * 2, payload_format='jpeg')
+    report('长尾5% 不对冲', *run_load(lambda: plain.infer(pixels), n, c), n)
+    # 对冲等待时间取近期p95，只有落在长尾的请求才会被对冲
+    hedged = RemoteInferenceClient(endpoint, max_concurrency=c * 2, payload_format='jpeg', hedge_after_ms='auto')
+    report('长尾5% 对冲(auto=p95)', *run_load(lambda: hedged.infer(pixels), n, c), n)
+    print(f"  对冲统计: {hedged.get_stats()['hedged']} 次对冲, {hedged.get_stats()['hedge_wins']} 次对冲请求先返回")
+    plain.close()
+    hedged.close()
+
+    # 远端不可用：熔断打开后请求立即失败
+    config.tail_rate, config.down = 0, True
+    client = RemoteInferenceClient(endpoint, max_retries=1, backoff=0.05, breaker_failures=3, payload_format='jpeg')
+    for i in range(6):
+        start = time.perf_counter()
+        try:
+            client.infer(pixels)
+        except RemoteInferenceError as e:
+            print(f"  远端故障 第{i + 1}次: {(time.perf_counter() - start) * 1000:7.1f} ms  "
+                  f"{type(e).__name__}  熔断器={client.breaker.state}")
+    client.close()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+启动耗时与内存基准
+每个场景在独立的Python进程中测量（避免模块缓存影响）：
+    - 导入 model_inference：按需导入（当前） vs 导入全部已安装框架（旧版行为）
+    - 加载模型后首个请求的延迟：不预热 vs 预热之后
+
+用法:
+    python benchmarks/bench_startup.py [--model path/to/model --config path/to/model_config.json]
+未指定 --model 时生成合成ONNX模型
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# 在子进程中执行的测量脚本，结果以JSON写到标准输出最后一行
+PROBE = r'''
+import os, sys, json, time
+def rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+import model_inference
+if {eager!r}:
+    for name in model_inference.FRAMEWORKS:
+        model_inference.import_framework(name)
+result = {{'import_ms': (time.perf_counter() - start) * 1000, 'import_rss_mb': rss_mb()}}
+if {model!r}:
+    from PIL import Image
+    import numpy as np
+    start = time.perf_counter()
+    model = model_inference.LocalModelInference({model!r}, {config!r})
+    result['load_ms'] = (time.perf_counter() - start) * 1000
+    if {warmup!r}:
+        start = time.perf_counter()
+        model.warmup((1,))
+        result['warmup_ms'] = (time.perf_counter() - start) * 1000
+    image = Image.fromarray(np.random.default_rng(0).integers(0, 255, (480, 640, 3), dtype=np.uint8))
+    start = time.perf_counter()
+    model.predict(image)
+    result['first_request_ms'] = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    model.predict(image)
+    result['second_request_ms'] = (time.perf_counter() - start) * 1000
+    result['rss_mb'] = rss_mb()
+    result['model_type'] = model.model_type
+print(json.dumps(result))
+'''
+
+
+def probe(eager=False, model='', config='', warmup=False):
+    code = PROBE.format(root=ROOT, eager=eager, model=model, config=config, warmup=warmup)
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='启动耗时与内存基准')
+    parser.add_argument('--model', help='模型路径（不含扩展名），缺省生成合成ONNX模型')
+    parser.add_argument('--config', help='模型配置文件')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_startup_')
+    try:
+        model, config = args.model, args.config
+        if not model:
+            from onnx_test_model import build_test_model
+            model = os.path.join(workdir, 'model')
+            config = os.path.join(workdir, 'model_config.json')
+            build_test_model(f"{model}.onnx", 512)
+            with open(config, 'w', encoding='utf-8') as f:
+                json.dump({'framework': 'onnx', 'input_size': [512, 512]}, f)
+
+        lazy = probe()
+        eager = probe(eager=True)
+        print(f"{'导入 model_inference':<28}{'耗时ms':>10}{'RSS MB':>10}")
+        print(f"{'  按需导入':<28}{lazy['import_ms']:>10.1f}{lazy['import_rss_mb']:>10.1f}")
+        print(f"{'  导入全部已安装框架':<26}{eager['import_ms']:>10.1f}{eager['import_rss_mb']:>10.1f}")
+
+        # 先加载一次，使优化模型缓存已存在，两个场景的加载条件相同
+        probe(model=model, config=config)
+        cold = probe(model=model, config=config)
+        warm = probe(model=model, config=config, warmup=True)
+        print(f"\n{'模型加载与首个请求':<26}{'加载ms':>10}{'预热ms':>10}{'首请求ms':>10}{'次请求ms':>10}{'RSS MB':>10}")
+        for name, row in (('  不预热', cold), ('  预热后', warm)):
+            print(f"{name:<28}{row['load_ms']:>10.1f}{row.get('warmup_ms', 0):>10.1f}"
+                  f"{row['first_request_ms']:>10.1f}{row['second_request_ms']:>10.1f}{row['rss_mb']:>10.1f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
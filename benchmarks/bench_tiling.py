@@ -0,0 +1,129 @@
+"""
+分块推理基准
+在不同分辨率的大图上对比整图缩放（单次前向）与分块推理（重叠窗口一批前向 + 跨窗口合并）
+的单张延迟和吞吐，以及每张图像的窗口数，用于选择 tiling 的 tile_size / overlap / min_size
+
+用法:
+    python benchmarks/bench_tiling.py [--model models/oral_health_model --config models/model_config.json]
+                                      [--images 大图目录] [--sizes 1536x768 3000x1500] [--overlap 0.2]
+                                      [--output tiling.json]
+未指定 --model 时使用合成ONNX模型（只反映计算量，检测结果无意义）
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from model_inference import LocalModelInference
+from quantize_model import list_images
+
+
+def load_model(model_base, config, tiling, workdir, name):
+    """按给定的 tiling 配置在临时目录中写出配置文件并加载模型（不在模型文件旁留下文件）"""
+    config = dict(config, tiling=tiling)
+    config_path = os.path.join(workdir, f"{name}_config.json")
+    with open(config_path, 'w', encoding='utf-8') as f:
+        json.dump(config, f)
+    model = LocalModelInference(model_base, config_path)
+    if model.model_type in (None, 'mock'):
+        raise RuntimeError("模型加载失败")
+    return model
+
+
+def measure(model, images, repeat):
+    """返回 (p50毫秒, 吞吐 张/秒, 平均窗口数, 平均实例数)"""
+    options = {'confidence_threshold': 0.5}
+    model.predict(images[0], options)  # 预热
+    latencies, tiles, instances = [], [], []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for image in images:
+            begin = time.perf_counter()
+            result = model.predict(image, options)
+            latencies.append((time.perf_counter() - begin) * 1000)
+            tiles.append(result.get('tiles', 1))
+            instances.append(len(result['results']))
+    throughput = repeat * len(images) / (time.perf_counter() - start)
+    return float(np.percentile(latencies, 50)), throughput, float(np.mean(tiles)), float(np.mean(instances))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='分块推理基准')
+    parser.add_argument('--model', help='模型路径（不含扩展名），缺省生成合成ONNX模型')
+    parser.add_argument('--config', help='模型配置文件')
+    parser.add_argument('--images', help='大图目录，缺省按 --sizes 生成随机图像')
+    parser.add_argument('--sizes', nargs='+', default=['1024x512', '1536x768', '3000x1500'], help='生成图像的尺寸')
+    parser.add_argument('--tile-size', type=int, default=0, help='窗口边长（原图像素），0为模型输入尺寸')
+    parser.add_argument('--overlap', type=float, default=0.2, help='窗口重叠比例')
+    parser.add_argument('--max-tiles', type=int, default=16, help='单张图像最多窗口数')
+    parser.add_argument('--repeat', type=int, default=3, help='重复次数')
+    parser.add_argument('--output', help='结果JSON路径')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_tiling_')
+    try:
+        if args.model:
+            model_base = os.path.join(workdir, 'model')
+            for ext in ('.onnx', '.pdmodel', '.pdiparams', '.pth'):
+                if os.path.exists(f"{args.model}{ext}"):
+                    shutil.copy(f"{args.model}{ext}", f"{model_base}{ext}")
+            with open(args.config, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        else:
+            from onnx_test_model import build_test_model
+            model_base = os.path.join(workdir, 'model')
+            build_test_model(f"{model_base}.onnx", 512)
+            config = {'framework': 'onnx', 'input_size': [512, 512]}
+
+        input_size = config.get('input_size', [512, 512])
+        tiling = {'enabled': True, 'min_size': 0, 'overlap': args.overlap, 'max_tiles': args.max_tiles,
+                  'tile_size': args.tile_size or input_size}
+        resize_model = load_model(model_base, config, {'enabled': False}, workdir, 'resize')
+        tiled_model = load_model(model_base, config, tiling, workdir, 'tiled')
+
+        if args.images:
+            groups = {}
+            for path in list_images(args.images):
+                with Image.open(path) as image:
+                    image = image.convert('RGB')
+                groups.setdefault(f"{image.width}x{image.height}", []).append(image)
+        else:
+            rng = np.random.default_rng(0)
+            groups = {}
+            for size in args.sizes:
+                width, height = (int(v) for v in size.lower().split('x'))
+                groups[size] = [Image.fromarray(rng.integers(0, 255, (height, width, 3), dtype=np.uint8))
+                                for _ in range(2)]
+
+        print(f"模型: {args.model or '合成模型'}, 输入 {input_size[0]}x{input_size[1]}, "
+              f"窗口 {tiling['tile_size']}, 重叠 {args.overlap}")
+        print(f"{'图像尺寸':<14}{'模式':<10}{'窗口数':>8}{'p50 ms':>10}{'吞吐/s':>10}{'实例数':>8}")
+        rows = []
+        for size, images in groups.items():
+            for mode, name, model in (('resize', '整图缩放', resize_model), ('tiled', '分块', tiled_model)):
+                p50, throughput, tiles, instances = measure(model, images, args.repeat)
+                print(f"{size:<14}{name:<10}{tiles:>8.1f}{p50:>10.1f}{throughput:>10.2f}{instances:>8.1f}")
+                rows.append({'size': size, 'mode': mode, 'tiles': round(tiles, 2), 'p50_ms': round(p50, 2),
+                             'throughput': round(throughput, 2), 'instances': round(instances, 2)})
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump({'model': args.model or 'synthetic', 'input_size': input_size, 'tiling': tiling,
+                           'results': rows}, f, ensure_ascii=False, indent=2)
+            print(f"\n结果已写入 {args.output}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
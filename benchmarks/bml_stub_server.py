@@ -0,0 +1,130 @@
+"""
+BML模型API本地桩服务
+按BML实例分割接口格式返回固定结果，可配置延迟、长尾延迟和故障率，
+用于在没有远程模型的环境中验证客户端的重试、熔断与对冲行为
+
+用法:
+    python benchmarks/bml_stub_server.py [--port 8500] [--latency-ms 30] [--tail-ms 500]
+                                         [--tail-rate 0.05] [--error-rate 0]
+    BML_MODEL_ENDPOINT=http://127.0.0.1:8500/ python app.py
+"""
+
+import io
+import json
+import time
+import base64
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from PIL import Image
+
+
+def decode_image(data):
+    """按请求中的 encoding 字段解码图像，返回 (W, H)"""
+    raw = base64.b64decode(data['image'])
+    if data.get('encoding') == 'raw':
+        height, width = data['shape'][:2]
+        np.frombuffer(raw, dtype=np.uint8).reshape(data['shape'])
+        return width, height
+    return Image.open(io.BytesIO(raw)).size
+
+
+def make_response(size):
+    """生成一个位于图像中心的“观察”实例"""
+    width, height = size
+    x1, y1, x2, y2 = width // 4, height // 4, width * 3 // 4, height * 3 // 4
+    mask = np.zeros((height, width), dtype=np.uint8)
+    mask[y1:y2, x1:x2] = 255
+    buffer = io.BytesIO()
+    Image.fromarray(mask).save(buffer, format='PNG')
+    return {
+        'results': [{
+            'category': '观察',
+            'score': 0.9,
+            'bbox': [x1, y1, x2, y2],
+            'mask': base64.b64encode(buffer.getvalue()).decode(),
+            'area': int((x2 - x1) * (y2 - y1))
+        }],
+        'metadata': {'model_version': 'stub', 'time_ms': 0}
+    }
+
+
+class StubConfig:
+    """桩服务行为配置（可在运行中修改）"""
+
+    def __init__(self, latency_ms=30.0, tail_ms=0.0, tail_rate=0.0, error_rate=0.0, down=False):
+        self.latency_ms = latency_ms
+        self.tail_ms = tail_ms
+        self.tail_rate = tail_rate
+        self.error_rate = error_rate
+        self.down = down
+        self.requests = 0
+        self.lock = threading.Lock()
+
+
+def make_handler(config: StubConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # 支持keep-alive
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            with config.lock:
+                config.requests += 1
+            delay = config.latency_ms
+            if config.tail_rate and random.random() < config.tail_rate:
+                delay = config.tail_ms
+            time.sleep(delay / 1000)
+
+            if config.down or (config.error_rate and random.random() < config.error_rate):
+                self._send(503, {'error': 'unavailable'})
+                return
+            try:
+                payload = json.loads(body)
+                size = decode_image(payload['data'])
+            except Exception as e:
+                self._send(400, {'error': str(e)})
+                return
+            self._send(200, make_response(size))
+
+        def _send(self, status, payload):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+def start_stub_server(config: StubConfig, port: int = 0):
+    """在后台线程中启动桩服务，返回 (server, endpoint)"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}/'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BML模型API本地桩服务')
+    parser.add_argument('--port', type=int, default=8500, help='监听端口')
+    parser.add_argument('--latency-ms', type=float, default=30, help='常规响应延迟')
+    parser.add_argument('--tail-ms', type=float, default=0, help='长尾响应延迟')
+    parser.add_argument('--tail-rate', type=float, default=0, help='长尾响应比例')
+    parser.add_argument('--error-rate', type=float, default=0, help='返回503的比例')
+    args = parser.parse_args()
+
+    config = StubConfig(args.latency_ms, args.tail_ms, args.tail_rate, args.error_rate)
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(config))
+    print(f"BML桩服务: http://127.0.0.1:{args.port}/")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
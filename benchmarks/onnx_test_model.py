@@ -0,0 +1,108 @@
+"""
+合成ONNX实例分割模型
+输出格式与 LocalModelInference._predict_onnx 约定一致（boxes / labels / scores / masks），
+计算量接近小型分割网络，用于在没有训练好的模型时做基准测试
+
+用法:
+    python benchmarks/onnx_test_model.py models/bench_model.onnx [--size 512] [--instances 100]
+"""
+
+import os
+import argparse
+
+import numpy as np
+import onnx
+from onnx import TensorProto, helper, numpy_helper
+
+
+def _conv(name, inputs, out_channels, in_channels, kernel, stride, rng, nodes, initializers):
+    """添加一个带偏置的卷积，返回输出名"""
+    weight = rng.normal(0, np.sqrt(2.0 / (in_channels * kernel * kernel)),
+                        (out_channels, in_channels, kernel, kernel)).astype(np.float32)
+    bias = rng.normal(0, 0.01, out_channels).astype(np.float32)
+    initializers += [numpy_helper.from_array(weight, f'{name}_w'), numpy_helper.from_array(bias, f'{name}_b')]
+    nodes.append(helper.make_node('Conv', [inputs, f'{name}_w', f'{name}_b'], [name],
+                                  kernel_shape=[kernel, kernel], strides=[stride, stride],
+                                  pads=[kernel // 2] * 4))
+    return name
+
+
+def build_test_model(path: str, input_size: int = 512, instances: int = 100, width: int = 32, seed: int = 0):
+    """
+    生成合成模型并保存
+
+    主干为4层步长卷积（1/4分辨率特征），掩码头输出 instances 个通道，
+    得分、类别、边界框由全局池化后的特征回归。batch维为动态维度
+    """
+    rng = np.random.default_rng(seed)
+    nodes, initializers = [], []
+
+    x = _conv('stem', 'image', width, 3, 3, 2, rng, nodes, initializers)
+    nodes.append(helper.make_node('Relu', [x], ['stem_r']))
+    x = _conv('down', 'stem_r', width * 2, width, 3, 2, rng, nodes, initializers)
+    nodes.append(helper.make_node('Relu', [x], ['down_r']))
+    x = _conv('mid1', 'down_r', width * 2, width * 2, 3, 1, rng, nodes, initializers)
+    nodes.append(helper.make_node('Relu', [x], ['mid1_r']))
+    x = _conv('mid2', 'mid1_r', width * 2, width * 2, 3, 1, rng, nodes, initializers)
+    nodes.append(helper.make_node('Relu', [x], ['feat']))
+
+    # 掩码头：(N, K, H/4, W/4)
+    _conv('mask_logits', 'feat', instances, width * 2, 1, 1, rng, nodes, initializers)
+    nodes.append(helper.make_node('Sigmoid', ['mask_logits'], ['masks']))
+
+    # 实例头：全局池化后回归 K×(4框 + 1分 + 2类)
+    nodes.append(helper.make_node('GlobalAveragePool', ['feat'], ['pooled']))
+    _conv('head', 'pooled', instances * 7, width * 2, 1, 1, rng, nodes, initializers)
+    initializers.append(numpy_helper.from_array(np.array([0, instances, 7], dtype=np.int64), 'head_shape'))
+    nodes.append(helper.make_node('Reshape', ['head', 'head_shape'], ['head_r']))
+    for name, start, end in (('box_raw', 0, 4), ('score_raw', 4, 5), ('cls_raw', 5, 7)):
+        initializers += [numpy_helper.from_array(np.array([start], dtype=np.int64), f'{name}_s'),
+                         numpy_helper.from_array(np.array([end], dtype=np.int64), f'{name}_e'),
+                         numpy_helper.from_array(np.array([2], dtype=np.int64), f'{name}_a')]
+        nodes.append(helper.make_node('Slice', ['head_r', f'{name}_s', f'{name}_e', f'{name}_a'], [name]))
+
+    # 边界框：中心+宽高 -> (x1, y1, x2, y2)，像素坐标
+    initializers += [numpy_helper.from_array(np.array([float(input_size)], dtype=np.float32), 'size'),
+                     numpy_helper.from_array(np.array([0.5], dtype=np.float32), 'half')]
+    nodes.append(helper.make_node('Sigmoid', ['box_raw'], ['box_sig']))
+    nodes.append(helper.make_node('Split', ['box_sig'], ['centers', 'sizes'], axis=2, num_outputs=2))
+    nodes.append(helper.make_node('Mul', ['sizes', 'half'], ['half_sizes']))
+    nodes.append(helper.make_node('Sub', ['centers', 'half_sizes'], ['tl']))
+    nodes.append(helper.make_node('Add', ['centers', 'half_sizes'], ['br']))
+    nodes.append(helper.make_node('Concat', ['tl', 'br'], ['box_norm'], axis=2))
+    nodes.append(helper.make_node('Mul', ['box_norm', 'size'], ['boxes']))
+
+    initializers.append(numpy_helper.from_array(np.array([2], dtype=np.int64), 'squeeze_axis'))
+    nodes.append(helper.make_node('Sigmoid', ['score_raw'], ['score_sig']))
+    nodes.append(helper.make_node('Squeeze', ['score_sig', 'squeeze_axis'], ['scores']))
+    nodes.append(helper.make_node('ArgMax', ['cls_raw'], ['labels'], axis=2, keepdims=0))
+
+    mask_size = input_size // 4
+    graph = helper.make_graph(
+        nodes, 'synthetic_instance_segmentation',
+        [helper.make_tensor_value_info('image', TensorProto.FLOAT, ['N', 3, input_size, input_size])],
+        [helper.make_tensor_value_info('boxes', TensorProto.FLOAT, ['N', instances, 4]),
+         helper.make_tensor_value_info('labels', TensorProto.INT64, ['N', instances]),
+         helper.make_tensor_value_info('scores', TensorProto.FLOAT, ['N', instances]),
+         helper.make_tensor_value_info('masks', TensorProto.FLOAT, ['N', instances, mask_size, mask_size])],
+        initializers
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 18)])
+    model.ir_version = 9
+    onnx.checker.check_model(model)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    onnx.save(model, path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成合成ONNX实例分割模型')
+    parser.add_argument('output', help='输出的.onnx文件路径')
+    parser.add_argument('--size', type=int, default=512, help='模型输入边长')
+    parser.add_argument('--instances', type=int, default=100, help='候选实例数')
+    args = parser.parse_args()
+    print(build_test_model(args.output, args.size, args.instances))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+上传图像解码
+按模型输入尺寸降分辨率解码：JPEG在DCT域按1/2、1/4、1/8直接解出小图（draft），
+其他格式解码后用整数倍box降采样（reduce），之后的缩放、可视化都在小图上进行。
+EXIF方向在降采样之后的小图上应用；解码前按文件头中的尺寸拒绝解压炸弹。
+"""
+
+import logging
+from typing import Optional, Tuple
+
+from PIL import Image
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# EXIF Orientation 标签
+EXIF_ORIENTATION = 0x0112
+
+# EXIF方向 -> 转正所需的变换
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90
+}
+
+
+class ImageDecodeError(ValueError):
+    """无法解码或超出限制的图像"""
+
+
+def original_size(image: Image.Image) -> Tuple[int, int]:
+    """图像在全分辨率、方向转正后的尺寸；未经降分辨率解码的图像即其自身尺寸"""
+    return tuple(image.info.get('original_size', image.size))
+
+
+class ImageDecoder:
+    """
+    上传图像解码器
+
+    解码结果是已加载的RGB图像，info['original_size'] 记录全分辨率尺寸，
+    推理结果（边界框、掩码）仍按全分辨率坐标输出。
+    """
+
+    def __init__(self, max_pixels: int = 50_000_000, reduce: bool = True):
+        """
+        Args:
+            max_pixels: 允许解码的最大像素数（按文件头尺寸判断，超过即拒绝）
+            reduce: 是否按目标尺寸降分辨率解码
+        """
+        self.max_pixels = max_pixels
+        self.reduce = reduce
+
+    def open(self, source) -> Image.Image:
+        """只读取文件头并检查像素数，不解码像素数据"""
+        try:
+            image = Image.open(source)
+        except Image.DecompressionBombError:
+            raise ImageDecodeError('图像尺寸超过限制')
+        except (OSError, SyntaxError):
+            raise ImageDecodeError('无法识别的图像格式')
+        if image.width * image.height > self.max_pixels:
+            image.close()
+            raise ImageDecodeError(f'图像尺寸超过限制（{image.width}x{image.height}）')
+        return image
+
+    def decode(self, source, min_size: Optional[Tuple[int, int]] = None) -> Image.Image:
+        """
+        解码图像
+
+        Args:
+            source: 文件路径或文件对象
+            min_size: 解码结果（方向转正后）至少保留的尺寸 (宽, 高)，通常是模型输入尺寸；
+                None表示按原分辨率解码
+
+        Returns:
+            已加载的RGB图像
+        """
+        image = self.open(source)
+        full_size = image.size
+        orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+        transpose = ORIENTATION_TRANSPOSE.get(orientation)
+        if transpose in (Image.Transpose.TRANSPOSE, Image.Transpose.TRANSVERSE,
+                         Image.Transpose.ROTATE_90, Image.Transpose.ROTATE_270):
+            # 转正后宽高互换，目标尺寸按存储方向换算
+            full_size = (full_size[1], full_size[0])
+            if min_size is not None:
+                min_size = (min_size[1], min_size[0])
+
+        reduce = self.reduce and min_size is not None
+        try:
+            if reduce and image.format == 'JPEG':
+                # draft选择使结果不小于目标尺寸的最大缩小倍数，解码时直接得到小图
+                image.draft('RGB', tuple(min_size))
+            image.load()
+        except Image.DecompressionBombError:
+            raise ImageDecodeError('图像尺寸超过限制')
+        except (OSError, SyntaxError) as e:
+            raise ImageDecodeError(f'图像解码失败：{e}')
+
+        if reduce:
+            if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+                image = image.convert('RGB')
+            factor = min(image.width // min_size[0], image.height // min_size[1])
+            if factor >= 2:
+                image = image.reduce(factor)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        if transpose is not None:
+            image = image.transpose(transpose)
+
+        image.info['original_size'] = full_size
+        return image
@@ -0,0 +1,304 @@
+"""
+推理结果缓存模块
+以图像内容哈希 + 模型标识 + 推理参数为键缓存模型输出，
+包含内存LRU层和可选的磁盘层，模型文件变化时自动失效
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 影响模型输出、需要纳入缓存键的请求参数
+KEY_OPTIONS = ('confidence_threshold', 'nms_threshold', 'mask_format', 'full_masks')
+
+
+def new_content_hash():
+    """创建增量内容哈希对象（边接收上传边计算时使用），结果与 hash_bytes / hash_file 一致"""
+    return hashlib.blake2b(digest_size=20)
+
+
+def hash_bytes(data: bytes) -> str:
+    """计算图像字节的内容哈希"""
+    digest = new_content_hash()
+    digest.update(data)
+    return digest.hexdigest()
+
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """分块计算文件内容哈希"""
+    digest = new_content_hash()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class InferenceCache:
+    """
+    两级推理结果缓存
+
+    内存层为按条目数限制的LRU；磁盘层按总字节数限制，超出时淘汰最久未访问的文件。
+    磁盘条目存放在以模型标识命名的子目录下，模型变化后旧目录整体删除。
+    """
+
+    def __init__(self, identity_fn: Callable[[], str], max_entries: int = 256,
+                 disk_dir: Optional[str] = None, disk_max_bytes: int = 512 * 1024 * 1024,
+                 identity_check_interval: float = 5.0):
+        """
+        初始化缓存
+
+        Args:
+            identity_fn: 返回当前模型标识（如模型文件路径+修改时间+大小）的函数
+            max_entries: 内存层最大条目数
+            disk_dir: 磁盘层目录，None表示不启用
+            disk_max_bytes: 磁盘层最大总字节数
+            identity_check_interval: 检查模型标识是否变化的最短间隔（秒）
+        """
+        self.identity_fn = identity_fn
+        self.max_entries = max(1, max_entries)
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.identity_check_interval = identity_check_interval
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self._stats = {'hits': 0, 'memory_hits': 0, 'disk_hits': 0, 'misses': 0,
+                       'evictions': 0, 'disk_evictions': 0, 'invalidations': 0}
+
+        self._identity = identity_fn()
+        self._identity_checked = time.monotonic()
+        if self.disk_dir:
+            self._load_disk_index()
+
+    def _model_key(self) -> str:
+        return hashlib.blake2b(self._identity.encode('utf-8'), digest_size=8).hexdigest()
+
+    def _disk_subdir(self) -> str:
+        return os.path.join(self.disk_dir, self._model_key())
+
+    def _load_disk_index(self):
+        """启动时扫描磁盘层：保留当前模型的条目，删除其他模型的旧目录"""
+        os.makedirs(self._disk_subdir(), exist_ok=True)
+        for name in os.listdir(self.disk_dir):
+            path = os.path.join(self.disk_dir, name)
+            if os.path.isdir(path) and name != self._model_key():
+                self._remove_dir(path)
+        entries = []
+        for name in os.listdir(self._disk_subdir()):
+            path = os.path.join(self._disk_subdir(), name)
+            stat = os.stat(path)
+            entries.append((stat.st_atime, name[:-5], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+
+    def _remove_dir(self, path: str):
+        for name in os.listdir(path):
+            try:
+                os.remove(os.path.join(path, name))
+            except OSError:
+                pass
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
+
+    def _check_identity(self):
+        """模型文件变化时清空缓存（调用方持有锁）"""
+        now = time.monotonic()
+        if now - self._identity_checked < self.identity_check_interval:
+            return
+        self._identity_checked = now
+        identity = self.identity_fn()
+        if identity == self._identity:
+            return
+        logger.info("模型已变化，推理缓存失效")
+        old_subdir = self._disk_subdir() if self.disk_dir else None
+        self._identity = identity
+        self._memory.clear()
+        self._disk.clear()
+        self._disk_bytes = 0
+        self._stats['invalidations'] += 1
+        if old_subdir:
+            self._remove_dir(old_subdir)
+            os.makedirs(self._disk_subdir(), exist_ok=True)
+
+    def make_key(self, content_hash: str, options: Optional[Dict] = None, identity: Optional[str] = None) -> str:
+        """组合图像哈希、模型标识和推理参数生成缓存键
+
+        identity 为实际执行推理的模型标识（如灰度版本），缺省为当前模型标识
+        """
+        options = options or {}
+        params = json.dumps({k: options.get(k) for k in KEY_OPTIONS}, sort_keys=True)
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(content_hash.encode('utf-8'))
+        digest.update((identity or self._identity).encode('utf-8'))
+        digest.update(params.encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """查询缓存，未命中返回None"""
+        with self._lock:
+            self._check_identity()
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._stats['hits'] += 1
+                self._stats['memory_hits'] += 1
+                return self._memory[key]
+            on_disk = key in self._disk
+            if on_disk:
+                self._disk.move_to_end(key)
+
+        if on_disk:
+            try:
+                with open(os.path.join(self._disk_subdir(), f'{key}.json'), 'r', encoding='utf-8') as f:
+                    value = json.load(f)
+                with self._lock:
+                    self._stats['hits'] += 1
+                    self._stats['disk_hits'] += 1
+                    self._put_memory(key, value)
+                return value
+            except (OSError, ValueError):
+                with self._lock:
+                    self._disk_bytes -= self._disk.pop(key, 0)
+
+        with self._lock:
+            self._stats['misses'] += 1
+        return None
+
+    def put(self, key: str, value: Dict):
+        """写入缓存（值需可JSON序列化，调用方不应再修改）"""
+        with self._lock:
+            self._check_identity()
+            self._put_memory(key, value)
+        if self.disk_dir:
+            self._put_disk(key, value)
+
+    def _put_memory(self, key: str, value: Dict):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    def _put_disk(self, key: str, value: Dict):
+        try:
+            data = json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        except (TypeError, ValueError) as e:
+            logger.warning(f"推理结果无法写入磁盘缓存: {e}")
+            return
+        subdir = self._disk_subdir()
+        path = os.path.join(subdir, f'{key}.json')
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"写入磁盘缓存失败: {e}")
+            return
+
+        evicted = []
+        with self._lock:
+            self._disk_bytes += len(data) - self._disk.pop(key, 0)
+            self._disk[key] = len(data)
+            while self._disk_bytes > self.disk_max_bytes and len(self._disk) > 1:
+                old_key, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                self._stats['disk_evictions'] += 1
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(os.path.join(subdir, f'{old_key}.json'))
+            except OSError:
+                pass
+
+    def clear(self):
+        """清空两级缓存"""
+        with self._lock:
+            self._memory.clear()
+            keys = list(self._disk)
+            self._disk.clear()
+            self._disk_bytes = 0
+        if self.disk_dir:
+            for key in keys:
+                try:
+                    os.remove(os.path.join(self._disk_subdir(), f'{key}.json'))
+                except OSError:
+                    pass
+
+    def get_stats(self) -> Dict:
+        """获取命中/未命中/淘汰统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+            stats['disk_entries'] = len(self._disk)
+            stats['disk_bytes'] = self._disk_bytes
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+def _raw_nbytes(raw: Dict) -> int:
+    """估算保留的原始输出占用的字节数"""
+    return sum(value.nbytes for value in raw.values() if hasattr(value, 'nbytes'))
+
+
+class RawOutputStore:
+    """
+    按结果ID保存未过滤的模型原始输出（边界框/类别/得分/掩码）
+
+    按总字节数限制容量，超出时淘汰最久未访问的结果；
+    被淘汰的结果只能重新推理，不影响已保存的检测结果
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def put(self, result_id: str, raw: Dict):
+        """保存一条原始输出，单条超过容量上限时不保存"""
+        size = _raw_nbytes(raw)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if result_id in self._entries:
+                self._bytes -= self._entries.pop(result_id)[1]
+            self._entries[result_id] = (raw, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self._stats['evictions'] += 1
+
+    def get(self, result_id: str) -> Optional[Dict]:
+        """获取原始输出，不存在或已淘汰返回None"""
+        with self._lock:
+            entry = self._entries.get(result_id)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(result_id)
+            self._stats['hits'] += 1
+            return entry[0]
+
+    def get_stats(self) -> Dict:
+        """获取命中/淘汰统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+        return stats
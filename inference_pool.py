@@ -0,0 +1,622 @@
+"""
+多进程推理池模块
+每个工作进程持有独立的 LocalModelInference，按CPU核数划分进程数和每进程线程数并绑定核心；
+主进程只做预处理，预处理后的张量和输出掩码通过 multiprocessing.shared_memory 传递，不经过pickle
+
+工作进程以独立解释器启动（python -m inference_pool --worker），不会重新导入 app.py
+"""
+
+import os
+import sys
+import time
+import uuid
+import socket
+import logging
+import argparse
+import threading
+import subprocess
+from concurrent.futures import Future
+from multiprocessing import AuthenticationError, resource_tracker, shared_memory
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import metrics
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 小于该字节数的输出数组直接随消息发送，不值得建立共享内存块
+SHM_MIN_BYTES = 64 * 1024
+
+# 工作进程中限制数学库线程数的环境变量，必须在导入numpy/推理框架之前设置
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+
+def available_cores() -> List[int]:
+    """当前进程可用的CPU核心编号"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_workers(num_cores: int, workers: int = 0, threads_per_worker: int = 0) -> Tuple[int, int]:
+    """
+    按核心数确定进程数和每进程线程数
+
+    都未指定时每进程最多4线程、进程数铺满全部核心；只指定其一时由核心数推出另一个
+    """
+    num_cores = max(1, num_cores)
+    if workers <= 0 and threads_per_worker <= 0:
+        threads_per_worker = min(4, num_cores)
+    if workers <= 0:
+        workers = max(1, num_cores // threads_per_worker)
+    if threads_per_worker <= 0:
+        threads_per_worker = max(1, num_cores // workers)
+    return workers, threads_per_worker
+
+
+def _untrack(shm: shared_memory.SharedMemory):
+    """取消资源跟踪：共享内存块的生命周期由创建它的主进程或接收方负责"""
+    try:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+
+
+def export_arrays(arrays: Dict[str, np.ndarray]) -> Dict:
+    """
+    将一组数组写入一个新的共享内存块
+
+    Returns:
+        描述符 {'shm': 名称, 'layout': [(键, dtype, shape, 偏移)]}，接收方负责释放
+    """
+    layout = []
+    offset = 0
+    for key, value in arrays.items():
+        # 8字节对齐
+        offset = (offset + 7) & ~7
+        layout.append((key, value.dtype.str, value.shape, offset))
+        offset += value.nbytes
+    shm = shared_memory.SharedMemory(create=True, size=max(1, offset))
+    _untrack(shm)
+    for (key, dtype, shape, start), value in zip(layout, arrays.values()):
+        np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=start)[...] = value
+    shm.close()
+    return {'shm': shm.name, 'layout': layout}
+
+
+def import_arrays(descriptor: Dict) -> Dict[str, np.ndarray]:
+    """从共享内存块复制出数组并释放该内存块"""
+    shm = shared_memory.SharedMemory(name=descriptor['shm'])
+    try:
+        return {key: np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=start).copy()
+                for key, dtype, shape, start in descriptor['layout']}
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def discard_arrays(descriptor: Dict):
+    """释放无人接收的共享内存块（如调用方已超时放弃的批次结果）"""
+    try:
+        shm = shared_memory.SharedMemory(name=descriptor['shm'])
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+def _unlink(shm: shared_memory.SharedMemory):
+    """删除共享内存块的名字；已映射的进程不受影响"""
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _pack_result(result: Dict) -> Dict:
+    """把推理结果中较大的原始输出数组（主要是掩码）移入共享内存"""
+    packed = result
+    # raw 为保留的原始输出，candidates 为分块推理窗口的候选
+    for field in ('raw', 'candidates'):
+        section = result.get(field)
+        if not section:
+            continue
+        arrays = {key: value for key, value in section.items() if isinstance(value, np.ndarray)}
+        if sum(value.nbytes for value in arrays.values()) < SHM_MIN_BYTES:
+            continue
+        packed = dict(packed)
+        packed[field] = {key: value for key, value in section.items() if key not in arrays}
+        packed[f'{field}_arrays'] = export_arrays(arrays)
+    return packed
+
+
+def _unpack_result(result: Dict) -> Dict:
+    """_pack_result 的逆操作（主进程执行）"""
+    for field in ('raw', 'candidates'):
+        descriptor = result.pop(f'{field}_arrays', None)
+        if descriptor is not None:
+            result[field].update(import_arrays(descriptor))
+    return result
+
+
+def _discard_result(result: Dict):
+    """释放 _pack_result 移入共享内存、但调用方已不再接收的数组"""
+    for field in ('raw', 'candidates'):
+        descriptor = result.get(f'{field}_arrays')
+        if descriptor is not None:
+            discard_arrays(descriptor)
+
+
+class _Worker:
+    """主进程中对单个工作进程的记录"""
+
+    def __init__(self, index: int, cpus: Sequence[int]):
+        self.index = index
+        self.cpus = list(cpus)
+        self.process = None
+        self.conn = None
+        self.model_type = None
+        self.inflight = {}
+        # 已发给该进程的批次输入共享内存块：进程回复（或退出）后才能删除，
+        # 调用方超时放弃时进程可能仍在读取
+        self.buffers = {}
+        self.send_lock = threading.Lock()
+        self.alive = False
+
+
+class InferencePool:
+    """
+    多进程推理池
+
+    对外提供与 LocalModelInference 相同的 prepare / predict / predict_batch / refilter 接口，
+    可直接替换进程内模型。主进程持有一个不加载模型的 LocalModelInference，
+    负责预处理、按新阈值重新过滤等轻量操作。
+    """
+
+    def __init__(self, model_path: str, config_path: str, workers: int = 0,
+                 threads_per_worker: int = 0, start_timeout: float = 300.0,
+                 task_timeout: float = 120.0, fallback_on_error: bool = True):
+        """
+        初始化推理池并启动工作进程
+
+        Args:
+            model_path: 模型文件路径（不含扩展名）
+            config_path: 模型配置文件路径
+            workers: 工作进程数，<=0 按核心数自动确定
+            threads_per_worker: 每个进程的推理线程数，<=0 自动确定
+            start_timeout: 等待工作进程加载模型的最长时间（秒）
+            task_timeout: 单个批次的最长等待时间（秒）
+            fallback_on_error: 工作进程推理失败时是否返回模拟结果（False时主进程收到异常）
+        """
+        from model_inference import LocalModelInference
+
+        self.model_path = os.path.abspath(model_path)
+        self.config_path = os.path.abspath(config_path)
+        self.task_timeout = task_timeout
+        self.fallback_on_error = fallback_on_error
+        self._host = LocalModelInference(self.model_path, self.config_path, load_model=False)
+
+        cores = available_cores()
+        self.num_workers, self.threads_per_worker = plan_workers(len(cores), workers, threads_per_worker)
+
+        self._lock = threading.Lock()
+        self._stats = {'batches': 0, 'images': 0, 'errors': 0, 'restarts': 0}
+        self._running = True
+        self._authkey = os.urandom(32)
+        self._listener = Listener(family='AF_UNIX', authkey=self._authkey)
+
+        self._workers = []
+        for index in range(self.num_workers):
+            start = (index * self.threads_per_worker) % len(cores)
+            cpus = [cores[(start + k) % len(cores)] for k in range(self.threads_per_worker)]
+            self._workers.append(_Worker(index, cpus))
+
+        for worker in self._workers:
+            self._spawn(worker)
+        deadline = time.monotonic() + start_timeout
+        try:
+            for worker in self._workers:
+                self._accept(worker, deadline)
+        except Exception:
+            self.shutdown(timeout=1.0)
+            raise
+
+        model_types = {worker.model_type for worker in self._workers}
+        self._host.model_type = model_types.pop() if len(model_types) == 1 else 'mixed'
+        logger.info(f"推理池已启动: {self.num_workers}个进程 x {self.threads_per_worker}线程, "
+                    f"模型类型 {self._host.model_type}")
+
+    # ---- 工作进程管理 ----
+
+    def _spawn(self, worker: _Worker):
+        """以独立解释器启动工作进程"""
+        env = dict(os.environ)
+        for name in THREAD_ENV_VARS:
+            env[name] = str(self.threads_per_worker)
+        module_dir = os.path.dirname(os.path.abspath(__file__))
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [module_dir, env.get('PYTHONPATH')]))
+        env['INFERENCE_POOL_AUTHKEY'] = self._authkey.hex()
+        worker.process = subprocess.Popen([
+            sys.executable, '-m', 'inference_pool', '--worker',
+            '--address', self._listener.address,
+            '--index', str(worker.index),
+            '--model-path', self.model_path,
+            '--config-path', self.config_path,
+            '--threads', str(self.threads_per_worker),
+            '--cpus', ','.join(str(cpu) for cpu in worker.cpus)
+        ] + ([] if self.fallback_on_error else ['--no-fallback']), env=env)
+
+    def _accept(self, worker: _Worker, deadline: float):
+        """
+        等待工作进程连接并完成模型加载（先启动完成的其他进程会被顺带接入）
+
+        工作进程在连接前退出（模型路径错误、导入失败等）或超过期限时抛出异常
+        """
+        while not worker.alive:
+            conn = self._next_connection(worker, deadline)
+            if conn is None:
+                continue
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                conn.close()
+                continue
+            if message[0] != 'ready':
+                conn.close()
+                continue
+            _, index, model_type = message
+            target = self._workers[index]
+            target.conn = conn
+            target.model_type = model_type
+            target.alive = True
+            threading.Thread(target=self._reader, args=(target,), name=f'inference-pool-reader-{index}',
+                             daemon=True).start()
+            if target is worker:
+                return
+
+    def _next_connection(self, worker: _Worker, deadline: float) -> Optional[Connection]:
+        """
+        接受下一个连接，握手失败返回None
+
+        Listener.accept 不支持超时：监视线程发现等待的进程已退出或超过期限时，
+        连接监听地址后立即断开，使阻塞中的accept因握手失败返回
+        """
+        done = threading.Event()
+        failure = []
+
+        def watch():
+            while not done.wait(0.2):
+                code = worker.process.poll()
+                if code is not None:
+                    failure.append(RuntimeError(f"推理进程{worker.index}启动失败，退出码{code}"))
+                elif time.monotonic() > deadline:
+                    failure.append(TimeoutError(f"推理进程{worker.index}启动超时"))
+                else:
+                    continue
+                try:
+                    with socket.socket(socket.AF_UNIX) as sock:
+                        sock.connect(self._listener.address)
+                except OSError:
+                    pass
+                return
+
+        threading.Thread(target=watch, name=f'inference-pool-accept-{worker.index}', daemon=True).start()
+        try:
+            conn = self._listener.accept()
+        except (EOFError, OSError, AuthenticationError):
+            conn = None
+        finally:
+            done.set()
+        if conn is None and failure:
+            raise failure[0]
+        return conn
+
+    def _reader(self, worker: _Worker):
+        """接收某个工作进程返回的结果"""
+        conn = worker.conn
+        while True:
+            try:
+                status, task_id, payload = conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                future = worker.inflight.pop(task_id, None)
+                buffer = worker.buffers.pop(task_id, None)
+            if buffer is not None:
+                _unlink(buffer)
+            if future is None:
+                # 调用方已超时放弃：结果中的共享内存块无人接收，直接释放
+                if status == 'ok':
+                    for result in payload[0]:
+                        _discard_result(result)
+                continue
+            if status == 'ok':
+                try:
+                    results, stages = payload
+                    future.set_result(([_unpack_result(result) for result in results], stages))
+                except Exception as e:
+                    future.set_exception(e)
+            elif status == 'warm':
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(payload))
+        self._on_worker_exit(worker)
+
+    def _on_worker_exit(self, worker: _Worker):
+        """工作进程退出：未完成的批次报错，池仍在运行时重启该进程"""
+        with self._lock:
+            worker.alive = False
+            inflight = list(worker.inflight.values())
+            worker.inflight.clear()
+        for future in inflight:
+            future.set_exception(RuntimeError(f"推理进程{worker.index}异常退出"))
+        if not self._running:
+            return
+        logger.error(f"推理进程{worker.index}已退出，正在重启")
+        with self._lock:
+            self._stats['restarts'] += 1
+        try:
+            worker.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            worker.process.kill()
+            worker.process.wait()
+        # 旧进程已结束，不会再访问它未回复的批次输入
+        self._release_buffers(worker)
+        self._spawn(worker)
+        try:
+            self._accept(worker, time.monotonic() + 300)
+        except Exception as e:
+            logger.error(f"重启推理进程{worker.index}失败: {e}")
+
+    def _release_buffers(self, worker: _Worker):
+        """删除某个进程未回复的批次输入共享内存块"""
+        with self._lock:
+            buffers = list(worker.buffers.values())
+            worker.buffers.clear()
+        for buffer in buffers:
+            _unlink(buffer)
+
+    def _pick_worker(self) -> _Worker:
+        """选择在途批次最少的存活进程"""
+        with self._lock:
+            alive = [worker for worker in self._workers if worker.alive]
+            if not alive:
+                raise RuntimeError("没有可用的推理进程")
+            return min(alive, key=lambda worker: len(worker.inflight))
+
+    # ---- 推理接口 ----
+
+    def decode_size(self):
+        """上传图像解码时至少保留的尺寸（与进程内模型相同）"""
+        return self._host.decode_size()
+
+    def prepare(self, image):
+        """创建惰性预处理阶段（与进程内模型相同）"""
+        return self._host.prepare(image)
+
+    def predict(self, image, options: Optional[Dict] = None) -> Dict:
+        """单张图像推理"""
+        return self.predict_batch([image], [options])[0]
+
+    def predict_batch(self, images: List, options: Optional[List[Optional[Dict]]] = None) -> List[Dict]:
+        """
+        批量推理：主进程把预处理结果直接写入共享内存，工作进程原地读取后推理
+
+        Returns:
+            与输入顺序一一对应的推理结果字典列表
+        """
+        if not images:
+            return []
+        images = [self._host.prepare(image) for image in images]
+        options = [opts or {} for opts in (options or [None] * len(images))]
+        if self._host.tiler is not None and self._host.model_type not in (None, 'mock'):
+            # 分块推理：窗口展开和跨窗口合并在主进程完成，窗口批次照常交给工作进程
+            return self._host.tiler.run(images, options, self._predict_prepared, self._host.build_tiled_result)
+        return self._predict_prepared(images, options)
+
+    def _predict_prepared(self, images: List, options: List[Dict]) -> List[Dict]:
+        """把已包装的图像批次写入共享内存并交给在途批次最少的工作进程"""
+        input_w, input_h = self._host.input_size
+        shape = (len(images), 3, input_h, input_w)
+
+        shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 4)
+        handed_over = False
+        try:
+            with metrics.span('preprocess'):
+                batch = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+                for i, image in enumerate(images):
+                    self._host.preprocessor.normalize_into(image.pixels, batch[i])
+                del batch
+                transforms = [image.transform for image in images]
+
+            worker = self._pick_worker()
+            task_id = uuid.uuid4().hex
+            future = Future()
+            with self._lock:
+                worker.inflight[task_id] = future
+                # 发出后输入块由工作进程的回复（或进程退出）负责删除，超时放弃时进程可能仍在读取
+                worker.buffers[task_id] = shm
+                self._stats['batches'] += 1
+                self._stats['images'] += len(images)
+            try:
+                try:
+                    with worker.send_lock:
+                        worker.conn.send(('predict', task_id, shm.name, shape, transforms, options))
+                except Exception:
+                    with self._lock:
+                        worker.buffers.pop(task_id, None)
+                    raise
+                handed_over = True
+                results, stages = future.result(timeout=self.task_timeout)
+            except Exception:
+                with self._lock:
+                    worker.inflight.pop(task_id, None)
+                    self._stats['errors'] += 1
+                raise
+            # 工作进程中测得的前向/后处理耗时计入本进程的请求追踪和指标
+            for name, ms in stages.items():
+                metrics.record(name, ms)
+            return results
+        finally:
+            shm.close()
+            if not handed_over:
+                _unlink(shm)
+
+    def warmup(self, batch_sizes: Tuple[int, ...] = (1,)) -> float:
+        """
+        各工作进程并行预热（见 LocalModelInference.warmup）
+
+        Returns:
+            最慢进程的预热耗时（毫秒）
+        """
+        futures = []
+        with self._lock:
+            workers = [worker for worker in self._workers if worker.alive]
+        for worker in workers:
+            task_id = uuid.uuid4().hex
+            future = Future()
+            with self._lock:
+                worker.inflight[task_id] = future
+            with worker.send_lock:
+                worker.conn.send(('warmup', task_id, tuple(batch_sizes)))
+            futures.append(future)
+        return max([future.result(timeout=self.task_timeout) for future in futures], default=0.0)
+
+    def refilter(self, raw: Dict, options: Optional[Dict] = None) -> Dict:
+        """按新阈值重新过滤保留的原始输出（在主进程完成，不经过工作进程）"""
+        return self._host.refilter(raw, options)
+
+    def model_fingerprint(self) -> str:
+        """模型标识（用于推理缓存失效）"""
+        return self._host.model_fingerprint()
+
+    @property
+    def model_type(self) -> str:
+        return self._host.model_type
+
+    @property
+    def confidence_threshold(self) -> float:
+        return self._host.confidence_threshold
+
+    @property
+    def nms_threshold(self) -> float:
+        return self._host.nms_threshold
+
+    def get_model_info(self) -> Dict:
+        """获取模型信息"""
+        info = self._host.get_model_info()
+        info['inference_pool'] = self.get_stats()
+        return info
+
+    def get_stats(self) -> Dict:
+        """获取推理池统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['workers'] = [{
+                'index': worker.index,
+                'pid': worker.process.pid if worker.process else None,
+                'alive': worker.alive,
+                'cpus': worker.cpus,
+                'inflight': len(worker.inflight)
+            } for worker in self._workers]
+        stats['num_workers'] = self.num_workers
+        stats['threads_per_worker'] = self.threads_per_worker
+        return stats
+
+    def shutdown(self, timeout: float = 10.0):
+        """停止所有工作进程"""
+        if not self._running:
+            return
+        self._running = False
+        for worker in self._workers:
+            if worker.conn is not None:
+                try:
+                    with worker.send_lock:
+                        worker.conn.send(('stop', None))
+                except (OSError, ValueError):
+                    pass
+        for worker in self._workers:
+            if worker.process is None:
+                continue
+            try:
+                worker.process.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                worker.process.kill()
+                worker.process.wait()
+            self._release_buffers(worker)
+        self._listener.close()
+
+
+def worker_main(address: str, index: int, model_path: str, config_path: str,
+                threads: int, cpus: Sequence[int], fallback_on_error: bool = True):
+    """工作进程主循环"""
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        try:
+            os.sched_setaffinity(0, set(cpus))
+        except OSError as e:
+            logger.warning(f"推理进程{index}绑定CPU失败: {e}")
+
+    from model_inference import LocalModelInference
+    model = LocalModelInference(model_path, config_path, num_threads=threads, fallback_on_error=fallback_on_error)
+
+    conn = Client(address, family='AF_UNIX', authkey=bytes.fromhex(os.environ['INFERENCE_POOL_AUTHKEY']))
+    conn.send(('ready', index, model.model_type))
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        if message[0] == 'stop':
+            break
+        if message[0] == 'warmup':
+            _, task_id, batch_sizes = message
+            try:
+                conn.send(('warm', task_id, model.warmup(batch_sizes)))
+            except Exception as e:
+                logger.error(f"推理进程{index}预热失败: {e}")
+                conn.send(('error', task_id, str(e)))
+            continue
+        _, task_id, shm_name, shape, transforms, options = message
+        try:
+            shm = shared_memory.SharedMemory(name=shm_name)
+            _untrack(shm)
+            try:
+                batch = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+                trace = metrics.Trace()
+                with metrics.activate(trace):
+                    results = model.predict_tensor(batch, transforms, options)
+                del batch
+            finally:
+                shm.close()
+            conn.send(('ok', task_id, ([_pack_result(result) for result in results], trace.stages)))
+        except Exception as e:
+            logger.error(f"推理进程{index}处理批次失败: {e}")
+            conn.send(('error', task_id, str(e)))
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='推理池工作进程')
+    parser.add_argument('--worker', action='store_true')
+    parser.add_argument('--address', required=True)
+    parser.add_argument('--index', type=int, default=0)
+    parser.add_argument('--model-path', required=True)
+    parser.add_argument('--config-path', required=True)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--cpus', default='')
+    parser.add_argument('--no-fallback', action='store_true', help='推理失败时返回错误而不是模拟结果')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'),
+                        format=f'%(asctime)s [inference-{args.index}] %(levelname)s %(message)s')
+    cpus = [int(cpu) for cpu in args.cpus.split(',') if cpu]
+    worker_main(args.address, args.index, args.model_path, args.config_path, args.threads, cpus,
+                fallback_on_error=not args.no_fallback)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""
+推理路由模块
+在本地模型与远程BML端点等多个推理后端之间按预计完成时间分发请求：
+每个后端记录在途请求数和近期延迟（指数滑动平均），请求发往预计最快完成的后端，
+后端失败时依次尝试下一个，全部失败时走兜底函数
+"""
+
+import time
+import random
+import logging
+import threading
+from collections import Counter, deque
+from typing import Callable, Dict, List, Optional
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 延迟直方图桶上界（毫秒）
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+class NoBackendAvailable(Exception):
+    """没有可用的推理后端"""
+
+
+class LatencyHistogram:
+    """固定桶的累计延迟直方图（与Prometheus histogram语义一致）"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value_ms: float):
+        for i, bound in enumerate(self.buckets):
+            if value_ms <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.total += value_ms
+
+    def snapshot(self) -> Dict:
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {'buckets': buckets, 'count': self.count, 'sum_ms': round(self.total, 3)}
+
+
+class InferenceBackend:
+    """
+    推理后端
+
+    预计完成时间 = 延迟滑动平均 × (1 + 在途请求数 / 并行容量)，
+    没有样本时使用 initial_latency_ms 作为先验
+    """
+
+    def __init__(self, name: str, handler: Callable, capacity: int = 1,
+                 initial_latency_ms: float = 200.0, is_available: Optional[Callable[[], bool]] = None,
+                 alpha: float = 0.2):
+        """
+        初始化后端
+
+        Args:
+            name: 后端名称（local / remote 等）
+            handler: handler(image, options) -> 检测结果，失败时抛出异常
+            capacity: 可并行处理的请求数（本地为批大小×进程数，远程为并发上限）
+            initial_latency_ms: 尚无样本时的延迟先验
+            is_available: 返回后端当前是否可用（例如远程熔断器未打开）
+            alpha: 延迟滑动平均的平滑系数
+        """
+        self.name = name
+        self.handler = handler
+        self.capacity = max(1, capacity)
+        self.is_available = is_available or (lambda: True)
+        self.alpha = alpha
+        self.ewma_ms = float(initial_latency_ms)
+        self.inflight = 0
+        self.requests = 0
+        self.errors = 0
+        self.histogram = LatencyHistogram()
+
+    def expected_ms(self) -> float:
+        """预计完成时间（毫秒），调用方需持有路由器锁"""
+        return self.ewma_ms * (1 + self.inflight / self.capacity)
+
+    def record(self, latency_ms: float, ok: bool):
+        """记录一次请求结果，调用方需持有路由器锁"""
+        self.inflight -= 1
+        self.requests += 1
+        if ok:
+            self.ewma_ms += self.alpha * (latency_ms - self.ewma_ms)
+            self.histogram.observe(latency_ms)
+        else:
+            self.errors += 1
+
+
+class InferenceRouter:
+    """
+    推理路由器
+
+    使用方式:
+        router = InferenceRouter([local_backend, remote_backend], fallback=simulate)
+        result = router.run(image, options)
+    """
+
+    def __init__(self, backends: List[InferenceBackend], fallback: Optional[Callable] = None,
+                 explore_rate: float = 0.02, decision_history: int = 100):
+        """
+        初始化路由器
+
+        Args:
+            backends: 推理后端列表，预计完成时间相同时按列表顺序优先
+            fallback: 所有后端都不可用或失败时调用的 fallback(image, options)
+            explore_rate: 随机探测非最优后端的比例，使长期未被选中的后端延迟估计得以更新
+            decision_history: 保留的最近路由决策条数
+        """
+        self.backends = list(backends)
+        self.fallback = fallback
+        self.explore_rate = explore_rate
+        self._lock = threading.Lock()
+        self._random = random.Random()
+        self._decisions = deque(maxlen=decision_history)
+        self._decision_counts = Counter()
+
+    def _choose(self) -> List[InferenceBackend]:
+        """按预计完成时间排序可用后端，并登记首选后端的在途请求"""
+        with self._lock:
+            ranked = sorted(
+                (b for b in self.backends if b.is_available()),
+                key=lambda b: b.expected_ms()
+            )
+            if not ranked:
+                return ranked
+            reason = 'fastest'
+            # 探测：偶尔把请求发给有空闲容量的次优后端
+            if len(ranked) > 1 and self._random.random() < self.explore_rate:
+                idle = [b for b in ranked[1:] if b.inflight < b.capacity]
+                if idle:
+                    choice = self._random.choice(idle)
+                    ranked.remove(choice)
+                    ranked.insert(0, choice)
+                    reason = 'explore'
+            self._decisions.append({
+                'time': time.time(),
+                'backend': ranked[0].name,
+                'reason': reason,
+                'expected_ms': {b.name: round(b.expected_ms(), 2) for b in ranked}
+            })
+            self._decision_counts[(ranked[0].name, reason)] += 1
+            ranked[0].inflight += 1
+            return ranked
+
+    def run(self, image, options: Optional[Dict] = None) -> Dict:
+        """
+        将请求分发到预计最快的后端；失败时依次尝试其余后端
+
+        Raises:
+            NoBackendAvailable: 所有后端都失败且未设置兜底函数
+        """
+        ranked = self._choose()
+        last_error = None
+        for i, backend in enumerate(ranked):
+            if i > 0:
+                with self._lock:
+                    backend.inflight += 1
+                    self._decision_counts[(backend.name, 'failover')] += 1
+            start = time.perf_counter()
+            try:
+                result = backend.handler(image, options)
+            except Exception as e:
+                with self._lock:
+                    backend.record((time.perf_counter() - start) * 1000, ok=False)
+                logger.warning(f"推理后端 {backend.name} 失败: {e}")
+                last_error = e
+                continue
+            with self._lock:
+                backend.record((time.perf_counter() - start) * 1000, ok=True)
+            if isinstance(result, dict) and isinstance(result.get('details'), dict):
+                result['details']['inference_backend'] = backend.name
+            return result
+
+        if self.fallback is not None:
+            return self.fallback(image, options)
+        raise NoBackendAvailable(f"没有可用的推理后端: {last_error}")
+
+    def get_stats(self, recent: int = 0) -> Dict:
+        """
+        获取路由统计
+
+        Args:
+            recent: 附带的最近路由决策条数
+        """
+        with self._lock:
+            backends = {
+                b.name: {
+                    'available': b.is_available(),
+                    'inflight': b.inflight,
+                    'capacity': b.capacity,
+                    'ewma_latency_ms': round(b.ewma_ms, 2),
+                    'expected_ms': round(b.expected_ms(), 2),
+                    'requests': b.requests,
+                    'errors': b.errors,
+                    'latency_histogram': b.histogram.snapshot()
+                }
+                for b in self.backends
+            }
+            decisions = {}
+            for (name, reason), count in self._decision_counts.items():
+                decisions.setdefault(name, {})[reason] = count
+            stats = {'backends': backends, 'decisions': decisions}
+            if recent:
+                stats['recent_decisions'] = list(self._decisions)[-recent:]
+        return stats
@@ -0,0 +1,174 @@
+"""
+实例掩码编解码模块
+支持三种格式：
+- png: 整幅掩码PNG编码后base64（字符串，默认格式，现有客户端和前端页面按此解码）
+- rle: COCO风格的未压缩游程编码，裁剪到实例边界框
+- bitpack: np.packbits位压缩后base64，裁剪到实例边界框
+
+rle/bitpack 体积小、编解码快，由请求参数 mask_format 显式选择。
+
+rle/bitpack编码结果为字典：
+    {
+        'format': 'rle' | 'bitpack',
+        'size': [H, W],            # 整幅图像尺寸
+        'crop': [x0, y0, x1, y1],  # 编码区域（像素，右开区间）
+        'counts': [...]            # rle：按列优先顺序、从0开始交替的游程长度
+        'data': '...'              # bitpack：按行优先顺序打包的位数据（base64）
+    }
+"""
+
+import io
+import base64
+import logging
+import numpy as np
+from PIL import Image
+from typing import Dict, Optional, Sequence, Tuple, Union
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+MASK_FORMATS = ('png', 'rle', 'bitpack')
+DEFAULT_MASK_FORMAT = 'png'
+
+EncodedMask = Union[str, Dict]
+
+
+def normalize_format(mask_format: Optional[str]) -> str:
+    """校验掩码格式，未知格式回退到默认格式"""
+    if mask_format in MASK_FORMATS:
+        return mask_format
+    if mask_format:
+        logger.warning(f"不支持的掩码格式 {mask_format}，使用 {DEFAULT_MASK_FORMAT}")
+    return DEFAULT_MASK_FORMAT
+
+
+def mask_bbox(mask: np.ndarray) -> Tuple[int, int, int, int]:
+    """计算掩码前景的紧致边界框 (x0, y0, x1, y1)，空掩码返回全零框"""
+    rows = np.flatnonzero(mask.any(axis=1))
+    if rows.size == 0:
+        return 0, 0, 0, 0
+    cols = np.flatnonzero(mask.any(axis=0))
+    return int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+
+
+def rle_encode(binary: np.ndarray) -> list:
+    """按列优先顺序对二值数组做游程编码，首个游程为背景（可能为0）"""
+    flat = np.asarray(binary, dtype=bool).ravel(order='F')
+    if flat.size == 0:
+        return []
+    change = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    boundaries = np.concatenate(([0], change, [flat.size]))
+    counts = np.diff(boundaries)
+    if flat[0]:
+        counts = np.concatenate(([0], counts))
+    return counts.tolist()
+
+
+def rle_decode(counts: Sequence[int], shape: Tuple[int, int]) -> np.ndarray:
+    """游程解码为形状为shape的布尔数组"""
+    counts = np.asarray(counts, dtype=np.int64)
+    values = np.zeros(counts.size, dtype=bool)
+    values[1::2] = True
+    flat = np.repeat(values, counts)
+    return flat.reshape(shape, order='F')
+
+
+def encode_crop(crop: np.ndarray, offset: Tuple[int, int], full_size: Tuple[int, int],
+                mask_format: str = DEFAULT_MASK_FORMAT) -> EncodedMask:
+    """
+    编码已裁剪到实例区域的掩码
+
+    Args:
+        crop: 裁剪区域的二值掩码 (h, w)
+        offset: 裁剪区域左上角在整幅图像中的坐标 (x0, y0)
+        full_size: 整幅图像尺寸 (W, H)
+        mask_format: 编码格式
+    """
+    mask_format = normalize_format(mask_format)
+    binary = np.asarray(crop) > 0
+    x0, y0 = int(offset[0]), int(offset[1])
+    h, w = binary.shape
+    width, height = full_size
+
+    if mask_format == 'png':
+        full = np.zeros((height, width), dtype=np.uint8)
+        full[y0:y0 + h, x0:x0 + w] = binary * np.uint8(255)
+        return _encode_png(full)
+
+    encoded = {
+        'format': mask_format,
+        'size': [int(height), int(width)],
+        'crop': [x0, y0, x0 + w, y0 + h]
+    }
+    if mask_format == 'rle':
+        encoded['counts'] = rle_encode(binary)
+    else:
+        encoded['data'] = base64.b64encode(np.packbits(binary, axis=None).tobytes()).decode()
+    return encoded
+
+
+def encode_mask(mask: np.ndarray, mask_format: str = DEFAULT_MASK_FORMAT) -> EncodedMask:
+    """编码整幅掩码，rle/bitpack会先裁剪到前景边界框"""
+    mask_format = normalize_format(mask_format)
+    height, width = mask.shape[:2]
+    if mask_format == 'png':
+        return _encode_png(np.where(np.asarray(mask) > 0, 255, 0).astype(np.uint8))
+    x0, y0, x1, y1 = mask_bbox(np.asarray(mask) > 0)
+    return encode_crop(mask[y0:y1, x0:x1], (x0, y0), (width, height), mask_format)
+
+
+def decode_crop(encoded: EncodedMask) -> Tuple[np.ndarray, Tuple[int, int, int, int], Tuple[int, int]]:
+    """
+    解码为裁剪区域掩码
+
+    Returns:
+        (布尔掩码, 裁剪框 (x0, y0, x1, y1), 整幅尺寸 (H, W))
+    """
+    if isinstance(encoded, str):
+        full = _decode_png(encoded)
+        height, width = full.shape
+        return full, (0, 0, width, height), (height, width)
+
+    height, width = encoded['size']
+    x0, y0, x1, y1 = encoded['crop']
+    shape = (y1 - y0, x1 - x0)
+    if encoded['format'] == 'rle':
+        crop = rle_decode(encoded['counts'], shape)
+    elif encoded['format'] == 'bitpack':
+        packed = np.frombuffer(base64.b64decode(encoded['data']), dtype=np.uint8)
+        crop = np.unpackbits(packed, count=shape[0] * shape[1]).astype(bool).reshape(shape)
+    else:
+        raise ValueError(f"未知掩码格式: {encoded.get('format')}")
+    return crop, (x0, y0, x1, y1), (height, width)
+
+
+def decode_mask(encoded: EncodedMask) -> np.ndarray:
+    """解码为整幅布尔掩码"""
+    crop, (x0, y0, x1, y1), (height, width) = decode_crop(encoded)
+    if crop.shape == (height, width):
+        return crop
+    full = np.zeros((height, width), dtype=bool)
+    full[y0:y1, x0:x1] = crop
+    return full
+
+
+def transcode(encoded: EncodedMask, mask_format: str) -> EncodedMask:
+    """转换掩码格式，格式相同时原样返回"""
+    mask_format = normalize_format(mask_format)
+    current = 'png' if isinstance(encoded, str) else encoded.get('format')
+    if current == mask_format:
+        return encoded
+    return encode_mask(decode_mask(encoded), mask_format)
+
+
+def _encode_png(mask: np.ndarray) -> str:
+    """将uint8掩码编码为base64 PNG字符串"""
+    buffer = io.BytesIO()
+    Image.fromarray(mask).save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def _decode_png(mask_base64: str) -> np.ndarray:
+    """解码base64 PNG为布尔掩码"""
+    mask_img = Image.open(io.BytesIO(base64.b64decode(mask_base64))).convert('L')
+    return np.asarray(mask_img) > 128
@@ -10,52 +10,151 @@ from PIL import Image
 import logging
 import base64
 import io
+import hashlib
+import platform
+import threading
+import time
 from typing import Dict, List, Optional, Tuple, Any
 
+from preprocessing import ImagePreprocessor, PreparedImage, identity_transform, native_transform, mask_index_maps
+import mask_codec
+import metrics
+from postprocess import PostProcessor
+from tiling import TiledInference
+
 # 配置日志
 logger = logging.getLogger(__name__)
 
-# 尝试导入不同的深度学习框架
-PADDLE_AVAILABLE = False
-ONNX_AVAILABLE = False
-TORCH_AVAILABLE = False
+# 深度学习框架按需导入：只导入配置（或模型文件）对应的框架，
+# 避免启动时把 paddle / onnxruntime / torch 全部加载进内存
+paddle = None
+paddle_infer = None
+ort = None
+torch = None
+
+FRAMEWORKS = ('paddle', 'onnx', 'torch')
+_framework_status = {}
+_framework_lock = threading.Lock()
+
+
+def import_framework(framework: str) -> bool:
+    """
+    导入指定的推理框架，返回是否可用
+    
+    每个框架只尝试导入一次，结果缓存
+    
+    Args:
+        framework: paddle / onnx / torch
+    """
+    global paddle, paddle_infer, ort, torch
+    with _framework_lock:
+        if framework in _framework_status:
+            return _framework_status[framework]
+        try:
+            if framework == 'paddle':
+                import paddle as paddle_module
+                import paddle.inference as paddle_inference
+                paddle, paddle_infer = paddle_module, paddle_inference
+                logger.info("PaddlePaddle框架可用")
+            elif framework == 'onnx':
+                import onnxruntime
+                ort = onnxruntime
+                logger.info("ONNX Runtime可用")
+            elif framework == 'torch':
+                import torch as torch_module
+                import torchvision  # noqa: F401
+                torch = torch_module
+                logger.info("PyTorch框架可用")
+            else:
+                raise ImportError(f"未知框架: {framework}")
+            available = True
+        except ImportError as e:
+            logger.warning(f"{framework} 框架不可用: {e}")
+            available = False
+        _framework_status[framework] = available
+        return available
 
-try:
-    import paddle
-    import paddle.inference as paddle_infer
-    from paddledet.core.workspace import load_config
-    from paddledet.engine import Trainer
-    PADDLE_AVAILABLE = True
-    logger.info("PaddlePaddle框架可用")
-except ImportError:
-    logger.warning("PaddlePaddle未安装，尝试其他框架")
 
-try:
-    import onnxruntime as ort
-    ONNX_AVAILABLE = True
-    logger.info("ONNX Runtime可用")
-except ImportError:
-    logger.warning("ONNX Runtime未安装")
+# ONNX张量类型到NumPy类型（IO绑定预分配输出缓冲用）
+ONNX_DTYPES = {
+    'tensor(float)': np.float32,
+    'tensor(float16)': np.float16,
+    'tensor(double)': np.float64,
+    'tensor(int64)': np.int64,
+    'tensor(int32)': np.int32,
+    'tensor(uint8)': np.uint8,
+    'tensor(bool)': np.bool_
+}
 
-try:
-    import torch
-    import torchvision
-    TORCH_AVAILABLE = True
-    logger.info("PyTorch框架可用")
-except ImportError:
-    logger.warning("PyTorch未安装")
+# 配置中的图优化级别名称对应的 ort.GraphOptimizationLevel 成员
+ONNX_OPTIMIZATION_LEVELS = {
+    'disable': 'ORT_DISABLE_ALL',
+    'basic': 'ORT_ENABLE_BASIC',
+    'extended': 'ORT_ENABLE_EXTENDED',
+    'all': 'ORT_ENABLE_ALL'
+}
+
+
+def available_cpu_count() -> int:
+    """当前进程可用的CPU核数（考虑CPU亲和性限制）"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _cpu_signature() -> str:
+    """CPU型号与指令集的短哈希，用于区分与硬件相关的优化模型缓存"""
+    info = platform.machine()
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            for line in f:
+                if line.startswith(('model name', 'flags')):
+                    info += line
+                if info.count('\n') >= 2:
+                    break
+    except OSError:
+        info += platform.processor()
+    return hashlib.blake2b(info.encode(), digest_size=4).hexdigest()
+
+
+def load_model_config(config_path: str) -> Dict:
+    """加载模型配置文件，不存在或解析失败时返回默认配置"""
+    if os.path.exists(config_path):
+        try:
+            with open(config_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"加载配置文件失败: {e}")
+    
+    # 默认配置
+    return {
+        'model_type': 'instance_segmentation',
+        'framework': 'paddle',
+        'classes': ['观察', '手术'],
+        'input_size': [512, 512],
+        'confidence_threshold': 0.5,
+        'nms_threshold': 0.5,
+        'mean': [0.485, 0.456, 0.406],
+        'std': [0.229, 0.224, 0.225]
+    }
 
 
 class LocalModelInference:
     """本地模型推理类"""
     
-    def __init__(self, model_path: str = None, config_path: str = None):
+    def __init__(self, model_path: str = None, config_path: str = None,
+                 num_threads: Optional[int] = None, load_model: bool = True,
+                 fallback_on_error: bool = True):
         """
         初始化本地模型
         
         Args:
             model_path: 模型文件路径（支持.pdparams, .onnx, .pth等）
             config_path: 模型配置文件路径
+            num_threads: 推理框架的CPU线程数，默认取配置项cpu_threads，未配置时为可用核数
+            load_model: 为False时只加载配置、预处理和后处理（如多进程推理池的主进程）
+            fallback_on_error: 推理失败时是否返回模拟结果；为False时抛出异常，
+                由推理路由器记录错误并转发给其他后端
         """
         self.model_path = model_path or os.environ.get('MODEL_PATH', 'models/eye_pterygium_model')
         self.config_path = config_path or os.environ.get('MODEL_CONFIG', 'models/model_config.json')
@@ -63,6 +162,7 @@ class LocalModelInference:
         self.model = None
         self.predictor = None
         self.model_type = None
+        self.fallback_on_error = fallback_on_error
         self.config = self.load_config()
         
         # 类别映射
@@ -73,58 +173,78 @@ class LocalModelInference:
         self.input_size = tuple(self.config.get('input_size', [512, 512]))
         self.confidence_threshold = self.config.get('confidence_threshold', 0.5)
         self.nms_threshold = self.config.get('nms_threshold', 0.5)
+        self.mask_format = mask_codec.normalize_format(self.config.get('mask_format', mask_codec.DEFAULT_MASK_FORMAT))
+        
+        # 模型变体：fp32 / int8_dynamic / int8_static / fp16（由 quantize_model.py 生成）
+        self.model_variant = self.config.get('model_variant', 'fp32')
+        
+        # 预处理器：均值/方差查找表在此一次性计算
+        self.preprocessor = ImagePreprocessor.from_config(self.config, self.input_size)
+        
+        # 后处理器：NMS/top-k/边界框还原，三种推理框架共用
+        self.postprocessor = PostProcessor.from_config(self.config)
+        
+        # 分块推理：配置 tiling.enabled 后，长边超过 tiling.min_size 的图像切成重叠窗口推理
+        self.tiler = TiledInference.from_config(self.config, self.input_size)
+        
+        # CPU线程数：按实际可用核数而不是固定值
+        self.num_threads = int(num_threads or self.config.get('cpu_threads') or available_cpu_count())
         
         # 加载模型
-        self.load_model()
+        if load_model:
+            self.load_model()
     
     def load_config(self) -> Dict:
         """加载模型配置文件"""
-        if os.path.exists(self.config_path):
-            try:
-                with open(self.config_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                logger.error(f"加载配置文件失败: {e}")
-        
-        # 默认配置
-        return {
-            'model_type': 'instance_segmentation',
-            'framework': 'paddle',
-            'classes': ['观察', '手术'],
-            'input_size': [512, 512],
-            'confidence_threshold': 0.5,
-            'nms_threshold': 0.5,
-            'mean': [0.485, 0.456, 0.406],
-            'std': [0.229, 0.224, 0.225]
-        }
+        return load_model_config(self.config_path)
     
     def load_model(self):
-        """根据可用框架加载模型"""
+        """根据配置的框架加载模型，只导入用到的那一个框架"""
         framework = self.config.get('framework', 'auto')
+        loaders = {
+            'paddle': (self._check_paddle_model, self._load_paddle_model),
+            'onnx': (self._check_onnx_model, self._load_onnx_model),
+            'torch': (self._check_torch_model, self._load_torch_model)
+        }
         
         if framework == 'auto':
-            # 自动检测可用框架
-            if PADDLE_AVAILABLE and self._check_paddle_model():
-                self._load_paddle_model()
-            elif ONNX_AVAILABLE and self._check_onnx_model():
-                self._load_onnx_model()
-            elif TORCH_AVAILABLE and self._check_torch_model():
-                self._load_torch_model()
-            else:
-                logger.warning("未找到可用的模型文件或框架")
-                self.model_type = 'mock'
+            # 按模型文件自动选择框架，只导入存在模型文件的框架
+            for name in FRAMEWORKS:
+                check, load = loaders[name]
+                if check() and import_framework(name):
+                    load()
+                    return
+            logger.warning("未找到可用的模型文件或框架")
+            self.model_type = 'mock'
         else:
             # 指定框架加载
-            if framework == 'paddle' and PADDLE_AVAILABLE:
-                self._load_paddle_model()
-            elif framework == 'onnx' and ONNX_AVAILABLE:
-                self._load_onnx_model()
-            elif framework == 'torch' and TORCH_AVAILABLE:
-                self._load_torch_model()
+            if framework in loaders and import_framework(framework):
+                loaders[framework][1]()
             else:
                 logger.error(f"指定的框架 {framework} 不可用")
                 self.model_type = 'mock'
     
+    def warmup(self, batch_sizes: Tuple[int, ...] = (1,)) -> float:
+        """
+        预热：用全零输入按各批大小执行一次前向
+        
+        触发算子初始化、内核JIT编译和内存池分配，使首个真实请求不承担这些开销
+        
+        Returns:
+            预热耗时（毫秒）
+        """
+        if self.model_type in (None, 'mock'):
+            return 0.0
+        start = time.perf_counter()
+        width, height = self.input_size
+        for batch_size in batch_sizes:
+            batch = np.zeros((batch_size, 3, height, width), dtype=np.float32)
+            transforms = [identity_transform((width, height))] * batch_size
+            self.predict_tensor(batch, transforms, [{}] * batch_size)
+        elapsed = (time.perf_counter() - start) * 1000
+        logger.info(f"模型预热完成: 批大小{list(batch_sizes)}, 耗时{elapsed:.1f}ms")
+        return elapsed
+    
     def _check_paddle_model(self) -> bool:
         """检查PaddlePaddle模型文件是否存在"""
         model_file = f"{self.model_path}.pdparams"
@@ -132,8 +252,20 @@ class LocalModelInference:
     
     def _check_onnx_model(self) -> bool:
         """检查ONNX模型文件是否存在"""
-        model_file = f"{self.model_path}.onnx"
-        return os.path.exists(model_file)
+        return os.path.exists(self._model_file('.onnx'))
+    
+    def _model_file(self, ext: str) -> str:
+        """
+        按配置的模型变体选择模型文件：<模型路径>.<变体><扩展名>
+        
+        变体文件不存在时回退到原始（FP32）模型
+        """
+        if self.model_variant and self.model_variant != 'fp32':
+            path = f"{self.model_path}.{self.model_variant}{ext}"
+            if os.path.exists(path):
+                return path
+            logger.warning(f"模型变体 {self.model_variant} 不存在（{path}），使用原始模型")
+        return f"{self.model_path}{ext}"
     
     def _check_torch_model(self) -> bool:
         """检查PyTorch模型文件是否存在"""
@@ -144,8 +276,9 @@ class LocalModelInference:
         """加载PaddlePaddle模型"""
         try:
             # 使用Paddle Inference API
-            model_file = f"{self.model_path}.pdmodel"
-            params_file = f"{self.model_path}.pdiparams"
+            # 量化变体为PaddleSlim导出的 <模型路径>.<变体>.pdmodel/.pdiparams
+            model_file = self._model_file('.pdmodel')
+            params_file = model_file[:-len('.pdmodel')] + '.pdiparams'
             
             if os.path.exists(model_file) and os.path.exists(params_file):
                 # 创建配置
@@ -156,12 +289,14 @@ class LocalModelInference:
                     config.enable_use_gpu(1000, 0)
                 else:
                     config.enable_mkldnn()
-                    config.set_cpu_math_library_num_threads(4)
+                    if self.model_variant.startswith('int8') and model_file != f"{self.model_path}.pdmodel":
+                        config.enable_mkldnn_int8()
+                    config.set_cpu_math_library_num_threads(self.num_threads)
                 
                 # 创建预测器
                 self.predictor = paddle_infer.create_predictor(config)
                 self.model_type = 'paddle'
-                logger.info("成功加载PaddlePaddle模型")
+                logger.info(f"成功加载PaddlePaddle模型: {model_file}")
             else:
                 logger.error(f"PaddlePaddle模型文件不存在: {model_file}, {params_file}")
                 self.model_type = 'mock'
@@ -171,20 +306,103 @@ class LocalModelInference:
             self.model_type = 'mock'
     
     def _load_onnx_model(self):
-        """加载ONNX模型"""
+        """
+        加载ONNX模型
+        
+        会话参数来自配置的 onnx 段:
+            intra_op_threads: 算子内线程数，默认为 num_threads
+            inter_op_threads: 算子间线程数，默认1
+            execution_mode: sequential / parallel，默认sequential
+            graph_optimization_level: disable / basic / extended / all，默认all
+            allow_spinning: 线程空闲时是否自旋等待，多进程推理池中建议关闭，默认true
+            optimized_model_cache: 是否缓存图优化后的模型，默认true
+            io_binding: 是否使用IO绑定和预分配输出缓冲，默认true
+            providers: 执行提供者优先级，默认CUDA、CPU中可用的
+        """
         try:
-            model_file = f"{self.model_path}.onnx"
+            model_file = self._model_file('.onnx')
+            settings = self.config.get('onnx', {})
+            
+            available = ort.get_available_providers()
+            providers = [p for p in settings.get('providers', ['CUDAExecutionProvider', 'CPUExecutionProvider'])
+                         if p in available] or ['CPUExecutionProvider']
+            session_options = self._onnx_session_options(settings)
+            
+            # 图优化结果缓存：首次启动时写出优化后的模型，之后直接加载，跳过图优化
+            cache_file = None
+            if settings.get('optimized_model_cache', True) and \
+                    session_options.graph_optimization_level != ort.GraphOptimizationLevel.ORT_DISABLE_ALL:
+                cache_file = self._onnx_cache_file(model_file, settings, providers)
             
-            # 创建ONNX Runtime会话
-            providers = ['CUDAExecutionProvider', 'CPUExecutionProvider']
-            self.predictor = ort.InferenceSession(model_file, providers=providers)
+            self.predictor = None
+            if cache_file and os.path.exists(cache_file) and \
+                    os.path.getmtime(cache_file) >= os.path.getmtime(model_file):
+                try:
+                    cached_options = self._onnx_session_options(settings)
+                    cached_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+                    self.predictor = ort.InferenceSession(cache_file, sess_options=cached_options, providers=providers)
+                    logger.info(f"加载图优化缓存: {cache_file}")
+                except Exception as e:
+                    logger.warning(f"图优化缓存不可用，重新优化: {e}")
+            if self.predictor is None:
+                if cache_file:
+                    session_options.optimized_model_filepath = cache_file
+                try:
+                    self.predictor = ort.InferenceSession(model_file, sess_options=session_options, providers=providers)
+                except Exception:
+                    if not cache_file:
+                        raise
+                    # 模型目录不可写等情况下不缓存
+                    session_options = self._onnx_session_options(settings)
+                    self.predictor = ort.InferenceSession(model_file, sess_options=session_options, providers=providers)
+            
+            # 输入输出名称和形状只解析一次
+            input_meta = self.predictor.get_inputs()[0]
+            batch_dim = input_meta.shape[0] if input_meta.shape else 1
+            self._onnx_input_name = input_meta.name
+            self._onnx_batched = not (isinstance(batch_dim, int) and batch_dim > 0)
+            self._onnx_outputs = [(meta.name, meta.shape, ONNX_DTYPES.get(meta.type))
+                                  for meta in self.predictor.get_outputs()]
+            self._onnx_output_names = [name for name, _, _ in self._onnx_outputs]
+            self._onnx_io_binding = bool(settings.get('io_binding', True))
+            self._onnx_device = 'cuda' if self.predictor.get_providers()[0] == 'CUDAExecutionProvider' else 'cpu'
+            self._onnx_local = threading.local()
             self.model_type = 'onnx'
-            logger.info("成功加载ONNX模型")
+            logger.info(f"成功加载ONNX模型: {model_file}, providers={self.predictor.get_providers()}")
             
         except Exception as e:
             logger.error(f"加载ONNX模型失败: {e}")
             self.model_type = 'mock'
     
+    def _onnx_session_options(self, settings: Dict) -> 'ort.SessionOptions':
+        """根据配置创建ONNX Runtime会话参数"""
+        session_options = ort.SessionOptions()
+        session_options.intra_op_num_threads = int(settings.get('intra_op_threads') or self.num_threads)
+        session_options.inter_op_num_threads = int(settings.get('inter_op_threads', 1))
+        session_options.execution_mode = (ort.ExecutionMode.ORT_PARALLEL
+                                          if settings.get('execution_mode') == 'parallel'
+                                          else ort.ExecutionMode.ORT_SEQUENTIAL)
+        session_options.graph_optimization_level = getattr(ort.GraphOptimizationLevel, ONNX_OPTIMIZATION_LEVELS.get(
+            settings.get('graph_optimization_level', 'all'), 'ORT_ENABLE_ALL'))
+        if not settings.get('allow_spinning', True):
+            session_options.add_session_config_entry('session.intra_op.allow_spinning', '0')
+        return session_options
+    
+    def _onnx_cache_file(self, model_file: str, settings: Dict, providers: List[str]) -> str:
+        """
+        图优化缓存文件路径
+        
+        优化后的图与ONNX Runtime版本、优化级别和执行提供者相关，都编码进文件名；
+        all 级别的优化（NCHWc布局等）与CPU型号相关，文件名中再加上CPU标识
+        """
+        level = settings.get('graph_optimization_level', 'all')
+        device = 'cuda' if providers[0] == 'CUDAExecutionProvider' else 'cpu'
+        if device == 'cpu' and level == 'all':
+            device = f"cpu-{_cpu_signature()}"
+        cache_dir = settings.get('optimized_model_dir') or os.path.dirname(model_file) or '.'
+        name = os.path.splitext(os.path.basename(model_file))[0]
+        return os.path.join(cache_dir, f"{name}.ort{ort.__version__}-{level}-{device}.opt.onnx")
+    
     def _load_torch_model(self):
         """加载PyTorch模型"""
         try:
@@ -192,6 +410,7 @@ class LocalModelInference:
             
             # 加载模型权重
             device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+            torch.set_num_threads(self.num_threads)
             
             # 这里需要根据实际模型架构创建模型
             # 示例：使用torchvision的Mask R-CNN
@@ -212,149 +431,337 @@ class LocalModelInference:
             self.model_type = 'mock'
     
     def preprocess_image(self, image: Image.Image) -> np.ndarray:
-        """预处理图像"""
-        # 调整尺寸
-        image = image.resize(self.input_size, Image.Resampling.LANCZOS)
-        
-        # 转换为numpy数组
-        img_array = np.array(image).astype(np.float32)
-        
-        # 归一化
-        img_array = img_array / 255.0
-        
-        # 标准化（如果配置中有）
-        mean = self.config.get('mean', [0.485, 0.456, 0.406])
-        std = self.config.get('std', [0.229, 0.224, 0.225])
-        
-        for i in range(3):
-            img_array[:, :, i] = (img_array[:, :, i] - mean[i]) / std[i]
-        
-        # 转换维度 HWC -> CHW
-        img_array = img_array.transpose(2, 0, 1)
-        
-        # 添加batch维度
-        img_array = np.expand_dims(img_array, axis=0)
+        """
+        预处理图像
         
-        return img_array
+        返回形状为(1, 3, H, W)的数组，它是预处理器复用缓冲区的视图，
+        同一线程再次预处理前有效
+        """
+        return self.preprocessor(image)
     
-    def predict(self, image: Image.Image) -> Dict:
+    def predict(self, image: Image.Image, options: Optional[Dict] = None) -> Dict:
         """
         执行模型推理
         
         Args:
-            image: PIL图像对象
+            image: PIL图像对象，或由本模型预处理器创建的PreparedImage
+            options: 单次请求参数，如 mask_format
             
         Returns:
             推理结果字典
         """
+        return self.predict_batch([image], [options])[0]
+    
+    def predict_batch(self, images: List[Image.Image], options: Optional[List[Optional[Dict]]] = None) -> List[Dict]:
+        """
+        批量执行模型推理，多张图像拼成一个NCHW批次做一次前向计算
+        
+        Args:
+            images: PIL图像对象或PreparedImage列表
+            options: 与images一一对应的请求参数列表，批次内各请求可以不同
+            
+        Returns:
+            与输入顺序一一对应的推理结果字典列表
+        """
+        if not images:
+            return []
+        
+        # 统一包装为共享预处理阶段；调用方已准备好的输入直接复用，不再重复缩放
+        images = [self.prepare(image) for image in images]
+        options = [opts or {} for opts in (options or [None] * len(images))]
+        
+        if self.tiler is not None and self.model_type not in (None, 'mock'):
+            return self.tiler.run(images, options, self._predict_prepared, self.build_tiled_result)
+        return self._predict_prepared(images, options)
+    
+    def _predict_prepared(self, images: List[PreparedImage], options: List[Dict]) -> List[Dict]:
+        """按框架对已包装的图像批次推理"""
+        if self.model_type == 'torch':
+            return self._predict_torch(images, options)
+        elif self.model_type in ('paddle', 'onnx'):
+            with metrics.span('preprocess'):
+                batch = self.preprocess_batch(images)
+                transforms = [image.transform for image in images]
+            return self.predict_tensor(batch, transforms, options)
+        else:
+            return [self._predict_mock(image.original_size, opts) for image, opts in zip(images, options)]
+    
+    def predict_tensor(self, batch: np.ndarray, transforms: List[Dict],
+                       options: Optional[List[Optional[Dict]]] = None) -> List[Dict]:
+        """
+        对已预处理的NCHW批次执行推理
+        
+        多进程推理池的工作进程通过共享内存拿到主进程预处理好的批次后调用此方法
+        
+        Args:
+            batch: 形状为(N, 3, H, W)的float32数组
+            transforms: 每张图像的预处理几何变换
+            options: 每张图像的请求参数
+        """
+        options = [opts or {} for opts in (options or [None] * len(transforms))]
         if self.model_type == 'paddle':
-            return self._predict_paddle(image)
+            return self._predict_paddle(batch, transforms, options)
         elif self.model_type == 'onnx':
-            return self._predict_onnx(image)
+            return self._predict_onnx(batch, transforms, options)
         elif self.model_type == 'torch':
-            return self._predict_torch(image)
+            return self._predict_torch_tensor(batch, transforms, options)
         else:
-            return self._predict_mock(image)
+            return [self._predict_mock(t['original_size'], opts) for t, opts in zip(transforms, options)]
+    
+    def decode_size(self) -> Optional[Tuple[int, int]]:
+        """上传图像解码时至少保留的尺寸；启用分块推理时需要原分辨率，返回None"""
+        if self.tiler is not None:
+            return None
+        return self.preprocessor.input_size
     
-    def _predict_paddle(self, image: Image.Image) -> Dict:
+    def prepare(self, image) -> PreparedImage:
+        """创建惰性预处理阶段，只有实际推理时才执行缩放"""
+        if isinstance(image, PreparedImage) and image.preprocessor is self.preprocessor:
+            return image
+        if isinstance(image, PreparedImage):
+            image = image.image
+        return PreparedImage(image, self.preprocessor)
+    
+    def preprocess_batch(self, images: List[PreparedImage]) -> np.ndarray:
+        """将多张图像预处理为NCHW批次（复用预处理器缓冲区）"""
+        return self.preprocessor.transform_batch(images)
+    
+    def _predict_paddle(self, img_array: np.ndarray, transforms: List[Dict], options: List[Dict]) -> List[Dict]:
         """使用PaddlePaddle模型推理"""
         try:
-            # 预处理
-            img_array = self.preprocess_image(image)
-            
             # 获取输入输出名称
             input_names = self.predictor.get_input_names()
             output_names = self.predictor.get_output_names()
             
             # 设置输入
             input_handle = self.predictor.get_input_handle(input_names[0])
-            input_handle.reshape([1, 3, self.input_size[0], self.input_size[1]])
+            input_handle.reshape(list(img_array.shape))
             input_handle.copy_from_cpu(img_array)
             
             # 执行推理
-            self.predictor.run()
+            with metrics.span('inference'):
+                self.predictor.run()
+                
+                # 获取输出
+                results = {}
+                for output_name in output_names:
+                    output_handle = self.predictor.get_output_handle(output_name)
+                    results[output_name] = output_handle.copy_to_cpu()
             
-            # 获取输出
-            results = {}
-            for output_name in output_names:
-                output_handle = self.predictor.get_output_handle(output_name)
-                results[output_name] = output_handle.copy_to_cpu()
-            
-            # 解析结果
-            return self._parse_results(results, image.size)
+            # 按图像拆分，转换为统一的候选格式后走共用的后处理
+            with metrics.span('postprocess'):
+                per_image = [self._paddle_to_detections(r)
+                             for r in self._split_paddle_outputs(results, len(transforms))]
+                return [self._parse_results(r, transform, opts)
+                        for r, transform, opts in zip(per_image, transforms, options)]
             
         except Exception as e:
-            logger.error(f"PaddlePaddle推理失败: {e}")
-            return self._predict_mock(image)
+            return self._fallback_results('PaddlePaddle', e, [t['original_size'] for t in transforms], options)
     
-    def _predict_onnx(self, image: Image.Image) -> Dict:
+    def _split_paddle_outputs(self, results: Dict, batch_size: int) -> List[Dict]:
+        """
+        按bbox_num将Paddle检测输出拆分到每张图像
+        
+        Paddle检测模型把整个批次的检测框拼接在一起输出，另有一个形状为[N]的
+        bbox_num输出记录每张图像的检测数量
+        """
+        if batch_size == 1:
+            return [results]
+        
+        bbox_num_key = None
+        for name, value in results.items():
+            if value.ndim == 1 and value.shape[0] == batch_size and np.issubdtype(value.dtype, np.integer):
+                bbox_num_key = name
+                break
+        if bbox_num_key is None:
+            raise ValueError("无法从模型输出中找到bbox_num，不能拆分批次结果")
+        
+        offsets = np.concatenate([[0], np.cumsum(results[bbox_num_key])])
+        per_image = []
+        for i in range(batch_size):
+            start, end = int(offsets[i]), int(offsets[i + 1])
+            per_image.append({
+                name: (value[i:i + 1] if name == bbox_num_key else value[start:end])
+                for name, value in results.items()
+            })
+        return per_image
+    
+    def _paddle_to_detections(self, outputs: Dict) -> Dict:
+        """
+        将Paddle检测输出转换为 boxes/labels/scores/masks 字典
+        
+        PaddleDetection导出模型的检测框输出为 (N, 6) 的 [类别, 得分, x1, y1, x2, y2]，
+        实例分割模型另有 (N, H, W) 的掩码输出；没有检测结果时会输出类别为-1的占位框
+        """
+        detections = {'boxes': None, 'labels': None, 'scores': None, 'masks': None}
+        for value in outputs.values():
+            if value.ndim == 2 and value.shape[1] == 6:
+                labels = value[:, 0].astype(np.int64)
+                detections['labels'] = labels
+                detections['scores'] = np.where(labels >= 0, value[:, 1], 0).astype(np.float32)
+                detections['boxes'] = value[:, 2:6]
+            elif value.ndim == 3:
+                detections['masks'] = value
+        return detections
+    
+    def _predict_onnx(self, img_array: np.ndarray, transforms: List[Dict], options: List[Dict]) -> List[Dict]:
         """使用ONNX模型推理"""
         try:
-            # 预处理
-            img_array = self.preprocess_image(image)
-            
-            # 获取输入名称
-            input_name = self.predictor.get_inputs()[0].name
+            # batch维为动态维度的模型输出带批次维；导出时batch维固定的模型只能逐张推理
+            batched = self._onnx_batched
+            if len(transforms) > 1 and not batched:
+                return [result for i in range(len(transforms))
+                        for result in self._predict_onnx(img_array[i:i + 1], transforms[i:i + 1], options[i:i + 1])]
             
             # 执行推理
-            outputs = self.predictor.run(None, {input_name: img_array})
+            with metrics.span('inference'):
+                outputs = self._run_onnx(np.ascontiguousarray(img_array, dtype=np.float32))
             
             # 解析结果
-            results = {
-                'boxes': outputs[0] if len(outputs) > 0 else None,
-                'labels': outputs[1] if len(outputs) > 1 else None,
-                'scores': outputs[2] if len(outputs) > 2 else None,
-                'masks': outputs[3] if len(outputs) > 3 else None
-            }
-            
-            return self._parse_results(results, image.size)
+            keys = ['boxes', 'labels', 'scores', 'masks']
+            parsed = []
+            with metrics.span('postprocess'):
+                for i, transform in enumerate(transforms):
+                    results = {}
+                    for j, key in enumerate(keys):
+                        if j >= len(outputs):
+                            results[key] = None
+                        elif batched:
+                            results[key] = outputs[j][i]
+                        else:
+                            results[key] = outputs[j]
+                    parsed.append(self._parse_results(results, transform, options[i]))
+            return parsed
             
         except Exception as e:
-            logger.error(f"ONNX推理失败: {e}")
-            return self._predict_mock(image)
+            return self._fallback_results('ONNX', e, [t['original_size'] for t in transforms], options)
     
-    def _predict_torch(self, image: Image.Image) -> Dict:
+    def _run_onnx(self, batch: np.ndarray) -> List[np.ndarray]:
+        """
+        执行ONNX会话
+        
+        IO绑定模式下输入直接绑定到调用方数组，形状固定的输出写入按线程、按批大小
+        预分配的缓冲区（后处理只读取并复制需要的部分，下一次推理前不再引用）；
+        形状动态的输出由ONNX Runtime分配
+        """
+        if not self._onnx_io_binding:
+            return self.predictor.run(self._onnx_output_names, {self._onnx_input_name: batch})
+        
+        bindings = getattr(self._onnx_local, 'bindings', None)
+        if bindings is None:
+            bindings = self._onnx_local.bindings = {}
+        batch_size = batch.shape[0]
+        entry = bindings.get(batch_size)
+        if entry is None:
+            binding = self.predictor.io_binding()
+            buffers = {}
+            for name, shape, dtype in self._onnx_outputs:
+                dims = [batch_size if i == 0 and not isinstance(d, int) else d for i, d in enumerate(shape)]
+                # 按模型输出顺序绑定，get_outputs() 的顺序与之一致
+                if self._onnx_device == 'cpu' and dtype is not None and all(isinstance(d, int) and d > 0 for d in dims):
+                    buffers[name] = np.empty(dims, dtype=dtype)
+                    binding.bind_output(name, 'cpu', 0, dtype, dims, buffers[name].ctypes.data)
+                else:
+                    binding.bind_output(name, 'cpu')
+            entry = bindings[batch_size] = (binding, buffers)
+        binding, buffers = entry
+        
+        binding.bind_cpu_input(self._onnx_input_name, batch)
+        for name in self._onnx_output_names:
+            if name not in buffers:
+                # 动态输出每次重新绑定，由本次推理按实际形状分配
+                binding.bind_output(name, 'cpu')
+        self.predictor.run_with_iobinding(binding)
+        
+        return [buffers[name] if name in buffers else value.numpy()
+                for name, value in zip(self._onnx_output_names, binding.get_outputs())]
+    
+    def _predict_torch(self, images: List[PreparedImage], options: List[Dict]) -> List[Dict]:
         """使用PyTorch模型推理"""
         try:
             import torch
             from torchvision import transforms
             
             # 预处理
-            transform = transforms.Compose([
-                transforms.ToTensor(),
-                transforms.Normalize(
-                    mean=self.config.get('mean', [0.485, 0.456, 0.406]),
-                    std=self.config.get('std', [0.229, 0.224, 0.225])
-                )
-            ])
-            
-            img_tensor = transform(image).unsqueeze(0).to(self.device)
+            with metrics.span('preprocess'):
+                transform = transforms.Compose([
+                    transforms.ToTensor(),
+                    transforms.Normalize(
+                        mean=self.config.get('mean', [0.485, 0.456, 0.406]),
+                        std=self.config.get('std', [0.229, 0.224, 0.225])
+                    )
+                ])
+                
+                # torchvision检测模型接受尺寸不同的图像列表作为一个批次
+                img_tensors = [transform(image.image.convert('RGB')).to(self.device) for image in images]
             
             # 推理
-            with torch.no_grad():
-                outputs = self.model(img_tensor)
+            with metrics.span('inference'), torch.no_grad():
+                outputs = self.model(img_tensors)
             
             # 解析结果
-            if len(outputs) > 0:
-                output = outputs[0]
-                results = {
-                    'boxes': output['boxes'].cpu().numpy() if 'boxes' in output else None,
-                    'labels': output['labels'].cpu().numpy() if 'labels' in output else None,
-                    'scores': output['scores'].cpu().numpy() if 'scores' in output else None,
-                    'masks': output['masks'].cpu().numpy() if 'masks' in output else None
-                }
-                return self._parse_results(results, image.size)
+            parsed = []
+            with metrics.span('postprocess'):
+                for output, image, opts in zip(outputs, images, options):
+                    results = {
+                        'boxes': output['boxes'].cpu().numpy() if 'boxes' in output else None,
+                        'labels': output['labels'].cpu().numpy() if 'labels' in output else None,
+                        'scores': output['scores'].cpu().numpy() if 'scores' in output else None,
+                        'masks': output['masks'].cpu().numpy() if 'masks' in output else None
+                    }
+                    # torchvision模型在输入图像的坐标系输出；降分辨率解码的图像需按比例放大回原图坐标
+                    parsed.append(self._parse_results(results, native_transform(image.image), opts))
+            return parsed
             
-            return self._get_empty_result()
+        except Exception as e:
+            return self._fallback_results('PyTorch', e, [image.original_size for image in images], options)
+    
+    def _predict_torch_tensor(self, batch: np.ndarray, transforms: List[Dict], options: List[Dict]) -> List[Dict]:
+        """使用PyTorch模型对已预处理的批次推理（输出在模型输入坐标系，按变换映射回原图）"""
+        try:
+            import torch
+            
+            img_tensors = [torch.from_numpy(np.ascontiguousarray(item)).to(self.device) for item in batch]
+            with metrics.span('inference'), torch.no_grad():
+                outputs = self.model(img_tensors)
+            
+            parsed = []
+            with metrics.span('postprocess'):
+                for output, transform, opts in zip(outputs, transforms, options):
+                    results = {key: output[key].cpu().numpy() if key in output else None
+                               for key in ('boxes', 'labels', 'scores', 'masks')}
+                    parsed.append(self._parse_results(results, transform, opts))
+            return parsed
             
         except Exception as e:
-            logger.error(f"PyTorch推理失败: {e}")
-            return self._predict_mock(image)
+            return self._fallback_results('PyTorch', e, [t['original_size'] for t in transforms], options)
     
-    def _predict_mock(self, image: Image.Image) -> Dict:
-        """模拟推理（用于测试）"""
+    def _fallback_results(self, framework: str, error: Exception, sizes: List[Tuple[int, int]],
+                          options: List[Dict]) -> List[Dict]:
+        """
+        推理失败时的模拟结果
+        
+        结果带 fallback 标记，调用方据此跳过推理缓存等只应保存真实推理结果的步骤；
+        fallback_on_error 为False时直接抛出原异常
+        """
+        logger.error(f"{framework}推理失败: {error}")
+        if not self.fallback_on_error:
+            raise error
+        results = []
+        for size, opts in zip(sizes, options):
+            result = self._predict_mock(size, opts)
+            result['fallback'] = True
+            results.append(result)
+        return results
+    
+    def _predict_mock(self, image_size: Tuple[int, int], options: Optional[Dict] = None) -> Dict:
+        """模拟推理（用于测试），image_size 为原图尺寸 (W, H)"""
         import random
         
+        mask_format = (options or {}).get('mask_format', self.mask_format)
+        full_masks = bool((options or {}).get('full_masks', False))
+        
+        width, height = image_size
         num_instances = random.randint(0, 3)
         
         if num_instances == 0:
@@ -366,76 +773,109 @@ class LocalModelInference:
             confidence = random.uniform(0.7, 0.99)
             
             # 生成随机边界框
-            x1 = random.uniform(0.1, 0.4) * image.width
-            y1 = random.uniform(0.1, 0.4) * image.height
-            x2 = random.uniform(0.5, 0.9) * image.width
-            y2 = random.uniform(0.5, 0.9) * image.height
+            x1 = random.uniform(0.1, 0.4) * width
+            y1 = random.uniform(0.1, 0.4) * height
+            x2 = random.uniform(0.5, 0.9) * width
+            y2 = random.uniform(0.5, 0.9) * height
             
-            # 生成模拟掩码
-            mask = np.zeros((image.height, image.width), dtype=np.uint8)
-            mask[int(y1):int(y2), int(x1):int(x2)] = 255
+            # 生成模拟掩码（矩形区域）
+            crop = np.ones((int(y2) - int(y1), int(x2) - int(x1)), dtype=bool)
+            mask = mask_codec.encode_crop(crop, (int(x1), int(y1)), image_size, mask_format)
+            if full_masks:
+                mask = mask_codec.encode_crop(mask_codec.decode_mask(mask), (0, 0), image_size, mask_format)
             
             instances.append({
                 'category': category,
                 'score': confidence,
                 'bbox': [x1, y1, x2, y2],
-                'mask': self._encode_mask(mask),
+                'mask': mask,
                 'area': (x2 - x1) * (y2 - y1)
             })
         
         return {'results': instances}
     
-    def _parse_results(self, raw_results: Dict, original_size: Tuple[int, int]) -> Dict:
-        """解析模型输出结果"""
+    def _parse_results(self, raw_results: Dict, transform: Dict, options: Optional[Dict] = None) -> Dict:
+        """
+        解析模型输出结果
+        
+        Args:
+            raw_results: 模型原始输出
+            transform: 预处理的几何变换，用于把边界框和掩码映射回原图
+            options: 请求参数，mask_format 指定掩码编码格式，
+                     full_masks 为True时输出整幅掩码（默认只编码边界框区域），
+                     confidence_threshold / nms_threshold 为本次调用的阈值（缺省用配置值），
+                     keep_raw 为True时在结果的raw字段附带未过滤的候选输出，供refilter复用
+        """
         instances = []
+        options = options or {}
+        mask_format = options.get('mask_format', self.mask_format)
+        full_masks = bool(options.get('full_masks', False))
+        confidence_threshold = float(options.get('confidence_threshold', self.confidence_threshold))
+        nms_threshold = float(options.get('nms_threshold', self.nms_threshold))
         
         # 获取各项输出
-        boxes = raw_results.get('boxes', [])
-        labels = raw_results.get('labels', [])
-        scores = raw_results.get('scores', [])
-        masks = raw_results.get('masks', [])
+        boxes = raw_results.get('boxes')
+        labels = raw_results.get('labels')
+        scores = raw_results.get('scores')
+        masks = raw_results.get('masks')
+        labels = [] if labels is None else labels
+        
+        boxes = np.zeros((0, 4), dtype=np.float32) if boxes is None else np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        scores = np.zeros(0, dtype=np.float32) if scores is None else np.asarray(scores, dtype=np.float32).reshape(-1)
+        num_candidates = min(len(boxes), len(scores))
+        boxes, scores = boxes[:num_candidates], scores[:num_candidates]
+        
+        # 置信度过滤、NMS和top-k截断一次完成
+        valid_indices = self.postprocessor.select(
+            boxes, scores, labels, confidence_threshold, nms_threshold,
+            masks=masks if masks is not None and len(masks) >= num_candidates else None,
+            input_size=transform['input_size'],
+            mask_nms_threshold=options.get('mask_nms_threshold')
+        ).tolist()
         
-        # 过滤低置信度结果
-        valid_indices = []
-        if isinstance(scores, np.ndarray):
-            valid_indices = np.where(scores > self.confidence_threshold)[0]
+        # 所有实例一次性处理掩码，只在各自边界框范围内重采样
+        bboxes = self.postprocessor.rescale_boxes(boxes[valid_indices], transform)
+        
+        if options.get('tile_candidates'):
+            # 分块推理的窗口：返回窗口坐标系下保留的候选，由 TiledInference 跨窗口合并后再编码掩码
+            keep = np.asarray(valid_indices, dtype=np.int64)
+            label_array = np.asarray(labels).reshape(-1)
+            has_masks = masks is not None and len(masks) >= num_candidates
+            return {'candidates': {
+                'boxes': bboxes,
+                'scores': scores[keep],
+                'labels': np.array([label_array[i] if i < len(label_array) else 0 for i in keep], dtype=np.int64),
+                'masks': np.ascontiguousarray(np.asarray(masks)[keep]) if has_masks else None,
+                'transform': dict(transform)
+            }}
+        encoded_masks = [None] * len(valid_indices)
+        if masks is not None and len(masks) > 0 and len(valid_indices) > 0:
+            try:
+                with_mask = [i for i, idx in enumerate(valid_indices) if idx < len(masks)]
+                mask_stack = np.stack([np.asarray(masks[valid_indices[i]]) for i in with_mask])
+                # 多通道掩码(N, 1, h, w)统一为(N, h, w)
+                mask_stack = mask_stack.reshape(len(with_mask), *mask_stack.shape[-2:])
+                encoded = self._encode_instance_masks(
+                    mask_stack, bboxes[with_mask], transform, mask_format, full_masks)
+                for i, mask_encoded in zip(with_mask, encoded):
+                    encoded_masks[i] = mask_encoded
+            except Exception as e:
+                logger.error(f"处理实例掩码失败: {e}")
         
-        for idx in valid_indices:
+        for i, idx in enumerate(valid_indices):
             try:
                 # 获取类别
                 label_idx = int(labels[idx]) if idx < len(labels) else 0
                 category = self.classes[label_idx] if label_idx < len(self.classes) else '未知'
                 
-                # 获取边界框
-                box = boxes[idx] if idx < len(boxes) else [0, 0, 100, 100]
-                
-                # 缩放到原始图像尺寸
-                scale_x = original_size[0] / self.input_size[0]
-                scale_y = original_size[1] / self.input_size[1]
-                
-                bbox = [
-                    float(box[0] * scale_x),
-                    float(box[1] * scale_y),
-                    float(box[2] * scale_x),
-                    float(box[3] * scale_y)
-                ]
-                
-                # 处理掩码
-                mask_encoded = None
-                if masks is not None and idx < len(masks):
-                    mask = masks[idx]
-                    # 如果是多维数组，取第一个通道
-                    if len(mask.shape) > 2:
-                        mask = mask[0]
-                    # 缩放掩码到原始尺寸
-                    mask_resized = self._resize_mask(mask, original_size)
-                    mask_encoded = self._encode_mask(mask_resized)
+                # 边界框已去除letterbox偏移并缩放到原始图像尺寸
+                bbox = [float(v) for v in bboxes[i]]
                 
                 instances.append({
                     'category': category,
-                    'score': float(scores[idx]) if idx < len(scores) else 0.5,
+                    'score': float(scores[idx]),
                     'bbox': bbox,
-                    'mask': mask_encoded,
+                    'mask': encoded_masks[i],
                     'area': (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
                 })
                 
@@ -443,46 +883,144 @@ class LocalModelInference:
                 logger.error(f"解析第{idx}个实例失败: {e}")
                 continue
         
-        return {'results': instances}
+        result = {'results': instances}
+        if options.get('keep_raw'):
+            result['raw'] = self._snapshot_raw(boxes, scores, labels, masks, transform)
+        return result
+    
+    def _snapshot_raw(self, boxes: np.ndarray, scores: np.ndarray, labels, masks, transform: Dict) -> Dict:
+        """
+        复制未过滤的候选输出，供之后以不同阈值重新过滤
+        
+        得分低于配置项 raw_score_floor（默认0.05）的候选不保留，
+        复制是为了不持有整个批次输出数组的引用
+        """
+        floor = float(self.config.get('raw_score_floor', 0.05))
+        keep = np.flatnonzero(scores >= floor)
+        labels = np.asarray(labels).reshape(-1)
+        snapshot = {
+            'boxes': boxes[keep].copy(),
+            'scores': scores[keep].copy(),
+            'labels': labels[keep[keep < len(labels)]].copy(),
+            'masks': None,
+            'transform': dict(transform),
+            'score_floor': floor
+        }
+        if masks is not None and len(masks) >= len(scores):
+            snapshot['masks'] = np.ascontiguousarray(np.asarray(masks)[keep])
+        return snapshot
     
-    def _resize_mask(self, mask: np.ndarray, target_size: Tuple[int, int]) -> np.ndarray:
-        """调整掩码尺寸"""
-        from PIL import Image
+    def refilter(self, raw: Dict, options: Optional[Dict] = None) -> Dict:
+        """
+        用新的阈值重新过滤保留的候选输出，不再执行模型推理
+        
+        Args:
+            raw: keep_raw=True 时推理结果中的 raw 字段
+            options: 同 _parse_results，通常只改 confidence_threshold / nms_threshold
+        """
+        return self._parse_results(raw, raw['transform'], dict(options or {}, keep_raw=False))
+    
+    def _encode_instance_masks(self, masks: np.ndarray, bboxes: np.ndarray, transform: Dict,
+                               mask_format: str, full_masks: bool = False) -> List:
+        """
+        批量将模型输出掩码映射回原图并编码
         
-        # 转换为PIL图像
-        mask_img = Image.fromarray((mask * 255).astype(np.uint8))
+        Args:
+            masks: 形状为(N, h, w)的模型输出掩码（概率或二值）
+            bboxes: 形状为(N, 4)的原图坐标边界框
+            transform: 预处理几何变换
+            mask_format: 编码格式
+            full_masks: 是否输出整幅掩码；默认只重采样和编码边界框区域
+        """
+        orig_w, orig_h = transform['original_size']
+        src_y, src_x = mask_index_maps(masks.shape[1:], transform)
+        threshold = self.config.get('mask_threshold', 0.5)
         
-        # 调整尺寸
-        mask_resized = mask_img.resize(target_size, Image.Resampling.NEAREST)
+        if full_masks:
+            # 整幅掩码：所有实例一次索引完成
+            full = masks[:, src_y[:, None], src_x[None, :]] > threshold
+            return [mask_codec.encode_crop(m, (0, 0), (orig_w, orig_h), mask_format) for m in full]
         
-        return np.array(mask_resized)
+        # 边界框取整并限制在图像范围内
+        x0 = np.clip(np.floor(bboxes[:, 0]), 0, orig_w).astype(np.int64)
+        y0 = np.clip(np.floor(bboxes[:, 1]), 0, orig_h).astype(np.int64)
+        x1 = np.clip(np.ceil(bboxes[:, 2]), 0, orig_w).astype(np.int64)
+        y1 = np.clip(np.ceil(bboxes[:, 3]), 0, orig_h).astype(np.int64)
+        
+        encoded = []
+        for i in range(len(masks)):
+            crop = masks[i][src_y[y0[i]:y1[i], None], src_x[None, x0[i]:x1[i]]] > threshold
+            encoded.append(mask_codec.encode_crop(crop, (x0[i], y0[i]), (orig_w, orig_h), mask_format))
+        return encoded
     
-    def _encode_mask(self, mask: np.ndarray) -> str:
-        """将掩码编码为base64字符串"""
-        # 转换为PIL图像
-        mask_img = Image.fromarray(mask.astype(np.uint8))
+    def build_tiled_result(self, merged: Dict, image: PreparedImage, options: Optional[Dict] = None) -> Dict:
+        """
+        由跨窗口合并后的候选生成检测结果（见 TiledInference.merge）
         
-        # 编码为base64
-        buffer = io.BytesIO()
-        mask_img.save(buffer, format='PNG')
-        mask_base64 = base64.b64encode(buffer.getvalue()).decode()
+        掩码已在原图坐标系下拼接为边界框区域的布尔裁剪，这里只做编码
+        """
+        options = options or {}
+        mask_format = options.get('mask_format', self.mask_format)
+        full_masks = bool(options.get('full_masks', False))
+        width, height = image.original_size
         
-        return mask_base64
+        instances = []
+        for box, score, label, mask in zip(merged['boxes'], merged['scores'], merged['labels'], merged['masks']):
+            label_idx = int(label)
+            encoded = None
+            if mask is not None:
+                crop, (x0, y0) = mask
+                if full_masks:
+                    canvas = np.zeros((height, width), dtype=bool)
+                    canvas[y0:y0 + crop.shape[0], x0:x0 + crop.shape[1]] = crop
+                    crop, x0, y0 = canvas, 0, 0
+                encoded = mask_codec.encode_crop(crop, (x0, y0), (width, height), mask_format)
+            bbox = [float(v) for v in box]
+            instances.append({
+                'category': self.classes[label_idx] if label_idx < len(self.classes) else '未知',
+                'score': float(score),
+                'bbox': bbox,
+                'mask': encoded,
+                'area': (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
+            })
+        return {'results': instances, 'tiles': merged['tiles']}
     
     def _get_empty_result(self) -> Dict:
         """返回空结果"""
         return {'results': []}
     
+    def model_fingerprint(self) -> str:
+        """
+        模型标识：框架类型 + 模型/配置文件的路径、大小和修改时间
+
+        文件被替换或重新训练覆盖后标识随之变化，用于使推理缓存失效
+        """
+        parts = [str(self.model_type), str(self.model_variant)]
+        prefixes = [self.model_path]
+        if self.model_variant and self.model_variant != 'fp32':
+            prefixes.append(f"{self.model_path}.{self.model_variant}")
+        candidates = [f"{prefix}{ext}" for prefix in prefixes for ext in
+                      ('.pdmodel', '.pdiparams', '.pdparams', '.onnx', '.pth')]
+        for path in candidates + [self.config_path]:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            parts.append(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}")
+        return '|'.join(parts)
+
     def get_model_info(self) -> Dict:
         """获取模型信息"""
         return {
             'model_type': self.model_type,
             'framework': self.config.get('framework', 'unknown'),
+            'model_variant': self.model_variant,
             'classes': self.classes,
             'num_classes': self.num_classes,
             'input_size': self.input_size,
             'confidence_threshold': self.confidence_threshold,
             'nms_threshold': self.nms_threshold,
+            'mask_format': self.mask_format,
             'status': 'loaded' if self.model_type != 'mock' else 'mock'
         }
 
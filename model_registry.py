@@ -0,0 +1,464 @@
+"""
+模型注册表模块
+同时持有多个命名的模型版本，支持不停机更新模型：
+    - 新版本在后台线程加载并预热，完成后原子切换为当前版本
+    - 切换后旧版本不再接收新请求，等待在途请求完成（排空）后释放
+    - 可按比例把部分请求发往灰度（canary）版本，或把请求复制给影子（shadow）版本
+      推理以对比结果（影子结果不返回给客户端）
+    - 每个版本单独统计请求数、错误数和延迟分布
+"""
+
+import time
+import random
+import logging
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from inference_router import LatencyHistogram
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 版本状态：loading -> warming -> ready -> active -> draining -> standby / retired，失败为 failed
+SERVABLE_STATES = ('ready', 'active', 'standby')
+
+
+class ModelVersionError(Exception):
+    """模型版本不存在、不可用或状态不允许该操作"""
+
+
+class ModelVersion:
+    """
+    一个已注册的模型版本
+
+    model 为 LocalModelInference 或 InferencePool，两者接口一致
+    """
+
+    def __init__(self, name: str, model_path: Optional[str] = None, config_path: Optional[str] = None,
+                 latency_window: int = 1000):
+        self.name = name
+        self.model_path = model_path
+        self.config_path = config_path
+        self.model = None
+        self.fingerprint = None
+        self.state = 'loading'
+        self.error = None
+        self.created_at = time.time()
+        self.activated_at = None
+        self.load_ms = None
+        self.warmup_ms = None
+        self.inflight = 0
+        # 每次进入排空加一，排空线程据此判断排空是否已被重新激活取消
+        self.drain_generation = 0
+        self.requests = 0
+        self.errors = 0
+        self.histogram = LatencyHistogram()
+        self._recent = deque(maxlen=latency_window)
+        # 影子对比统计：与主版本结果的实例数差和类别计数一致率
+        self.shadow = {'runs': 0, 'errors': 0, 'skipped': 0, 'count_delta': 0, 'category_match': 0}
+
+    def record(self, latency_ms: float, ok: bool):
+        """记录一次请求结果，调用方需持有注册表锁"""
+        self.requests += 1
+        if ok:
+            self.histogram.observe(latency_ms)
+            self._recent.append(latency_ms)
+        else:
+            self.errors += 1
+
+    def get_stats(self) -> Dict:
+        """版本状态和延迟统计，调用方需持有注册表锁"""
+        recent = np.asarray(self._recent, dtype=np.float64)
+        stats = {
+            'state': self.state,
+            'model_path': self.model_path,
+            'model_type': getattr(self.model, 'model_type', None),
+            'fingerprint': self.fingerprint,
+            'error': self.error,
+            'load_ms': self.load_ms,
+            'warmup_ms': self.warmup_ms,
+            'activated_at': self.activated_at,
+            'inflight': self.inflight,
+            'requests': self.requests,
+            'errors': self.errors,
+            'latency_ms': {
+                f'p{q}': round(float(np.percentile(recent, q)), 2) if recent.size else None
+                for q in (50, 95, 99)
+            },
+            'histogram': self.histogram.snapshot()
+        }
+        if self.shadow['runs']:
+            runs = self.shadow['runs']
+            stats['shadow'] = dict(self.shadow,
+                                   mean_count_delta=round(self.shadow['count_delta'] / runs, 3),
+                                   category_match_rate=round(self.shadow['category_match'] / runs, 4))
+        return stats
+
+
+def compare_results(primary: List[Dict], candidate: List[Dict]) -> Dict:
+    """对比两个版本对同一图像的实例列表：实例数差（绝对值）和各类别计数是否一致"""
+    primary_counts = Counter(inst['category'] for inst in primary)
+    candidate_counts = Counter(inst['category'] for inst in candidate)
+    return {
+        'count_delta': abs(len(primary) - len(candidate)),
+        'category_match': primary_counts == candidate_counts
+    }
+
+
+class ModelRegistry:
+    """
+    模型注册表
+
+    使用方式:
+        registry = ModelRegistry(lambda path, config: LocalModelInference(path, config))
+        registry.register('v1', model, activate=True)
+        registry.load('v2', 'models/v2', 'models/v2_config.json')  # 后台加载、预热后切换
+        with registry.lease() as version:
+            result = version.model.predict(image)
+    """
+
+    def __init__(self, factory: Callable[[str, str], object], warmup_batch_sizes: Sequence[int] = (1,),
+                 drain_timeout: float = 60.0, keep_previous: bool = False, shadow_workers: int = 1):
+        """
+        初始化注册表
+
+        Args:
+            factory: factory(model_path, config_path) -> 模型实例，用于后台加载新版本
+            warmup_batch_sizes: 新版本切换前预热的批大小，空表示不预热
+            drain_timeout: 等待旧版本在途请求完成的预期时间（秒），超时只记录警告；
+                模型一直保留到在途请求全部完成才释放
+            keep_previous: 旧版本排空后是否保留在内存中（standby），以便立即回滚
+            shadow_workers: 影子推理线程数；线程都忙时跳过本次影子推理，不积压
+        """
+        self.factory = factory
+        self.warmup_batch_sizes = tuple(warmup_batch_sizes)
+        self.drain_timeout = drain_timeout
+        self.keep_previous = keep_previous
+
+        self._lock = threading.Lock()
+        self._drained = threading.Condition(self._lock)
+        self._versions: Dict[str, ModelVersion] = {}
+        self._active: Optional[ModelVersion] = None
+        self._canary: Optional[ModelVersion] = None
+        self._canary_weight = 0.0
+        self._shadow: Optional[ModelVersion] = None
+        self._shadow_rate = 0.0
+        self._swaps = 0
+
+        self._shadow_slots = threading.BoundedSemaphore(max(1, shadow_workers))
+        self._shadow_executor = ThreadPoolExecutor(max_workers=max(1, shadow_workers),
+                                                   thread_name_prefix='model-shadow')
+
+    # ---- 版本管理 ----
+
+    @property
+    def active(self) -> Optional[ModelVersion]:
+        """当前版本"""
+        return self._active
+
+    def active_fingerprint(self) -> str:
+        """当前版本的模型标识（推理缓存据此在切换版本后失效）"""
+        active = self._active
+        return active.fingerprint if active is not None else ''
+
+    def get(self, name: str) -> Optional[ModelVersion]:
+        with self._lock:
+            return self._versions.get(name)
+
+    def servable_versions(self) -> List[ModelVersion]:
+        """当前可以接收请求的各版本（当前、灰度、影子、待命）"""
+        with self._lock:
+            return [version for version in self._versions.values()
+                    if version.state in SERVABLE_STATES and version.model is not None]
+
+    def register(self, name: str, model, model_path: Optional[str] = None,
+                 config_path: Optional[str] = None, activate: bool = False) -> ModelVersion:
+        """注册已加载的模型实例（如启动时同步加载的模型）"""
+        version = ModelVersion(name, model_path, config_path)
+        version.model = model
+        version.fingerprint = model.model_fingerprint()
+        version.state = 'ready'
+        with self._lock:
+            if name in self._versions and self._versions[name].state not in ('failed', 'retired'):
+                raise ModelVersionError(f"模型版本已存在: {name}")
+            self._versions[name] = version
+        if activate:
+            self.activate(name)
+        return version
+
+    def load(self, name: str, model_path: str, config_path: str, activate: bool = True,
+             wait: bool = False) -> ModelVersion:
+        """
+        加载新版本：在后台线程中加载、预热，activate为True时完成后切换为当前版本
+
+        Args:
+            wait: 为True时阻塞到加载（和切换）完成
+        """
+        version = ModelVersion(name, model_path, config_path)
+        with self._lock:
+            existing = self._versions.get(name)
+            if existing is not None and existing.state not in ('failed', 'retired'):
+                raise ModelVersionError(f"模型版本已存在: {name}")
+            self._versions[name] = version
+        thread = threading.Thread(target=self._load_version, args=(version, activate),
+                                  name=f'model-load-{name}', daemon=True)
+        thread.start()
+        if wait:
+            thread.join()
+        return version
+
+    def _load_version(self, version: ModelVersion, activate: bool):
+        try:
+            started = time.perf_counter()
+            model = self.factory(version.model_path, version.config_path)
+            version.load_ms = round((time.perf_counter() - started) * 1000, 1)
+            version.model = model
+            if model.model_type == 'mock':
+                raise RuntimeError("模型文件加载失败（推理器退回模拟模式）")
+            version.fingerprint = model.model_fingerprint()
+
+            if self.warmup_batch_sizes:
+                version.state = 'warming'
+                started = time.perf_counter()
+                model.warmup(self.warmup_batch_sizes)
+                version.warmup_ms = round((time.perf_counter() - started) * 1000, 1)
+            version.state = 'ready'
+            logger.info(f"模型版本 {version.name} 加载完成: {model.model_type}, "
+                        f"加载{version.load_ms}ms, 预热{version.warmup_ms}ms")
+        except Exception as e:
+            logger.error(f"模型版本 {version.name} 加载失败: {str(e)}")
+            version.state = 'failed'
+            version.error = str(e)
+            self._release(version)
+            return
+        if activate:
+            self.activate(version.name)
+
+    def activate(self, name: str) -> ModelVersion:
+        """
+        原子切换当前版本；之后的新请求都使用该版本，旧版本排空后释放或转为standby
+
+        排空中的版本（模型尚未释放）也可以激活，用于切换后立即回滚：取消其排空或卸载
+        """
+        with self._lock:
+            version = self._versions.get(name)
+            rollback = version is not None and version.state == 'draining' and version.model is not None
+            if version is None or (version.state not in SERVABLE_STATES and not rollback):
+                raise ModelVersionError(f"模型版本不可用: {name}")
+            previous = self._active
+            if previous is version:
+                return version
+            version.state = 'active'
+            version.activated_at = time.time()
+            self._active = version
+            self._swaps += 1
+            if self._canary is version:
+                self._canary, self._canary_weight = None, 0.0
+            if previous is not None:
+                previous.state = 'draining'
+                previous.drain_generation += 1
+                generation = previous.drain_generation
+            if rollback:
+                # 唤醒该版本的排空线程，使其放弃释放
+                self._drained.notify_all()
+        logger.info(f"当前模型版本切换为 {name}" + ("（取消排空）" if rollback else ""))
+        if previous is not None:
+            threading.Thread(target=self._drain, args=(previous, self.keep_previous, False, generation),
+                             name=f'model-drain-{previous.name}', daemon=True).start()
+        return version
+
+    def unload(self, name: str):
+        """卸载非当前版本：立即停止分配新请求，后台排空后释放"""
+        with self._lock:
+            version = self._versions.get(name)
+            if version is None:
+                raise ModelVersionError(f"模型版本不存在: {name}")
+            if version is self._active:
+                raise ModelVersionError(f"不能卸载当前版本: {name}")
+            if version.state in ('loading', 'warming'):
+                raise ModelVersionError(f"模型版本正在加载: {name}")
+            if self._canary is version:
+                self._canary, self._canary_weight = None, 0.0
+            if self._shadow is version:
+                self._shadow, self._shadow_rate = None, 0.0
+            if version.state in ('failed', 'retired'):
+                self._versions.pop(name)
+                return
+            # 已在排空（如刚被切换下来）时由本次排空接管，之前的排空线程退出
+            version.state = 'draining'
+            version.drain_generation += 1
+            generation = version.drain_generation
+        threading.Thread(target=self._drain, args=(version, False, True, generation),
+                         name=f'model-drain-{name}', daemon=True).start()
+
+    def _drain(self, version: ModelVersion, keep: bool, remove: bool = False, generation: int = 0):
+        """
+        等待版本的在途请求完成，然后释放模型或转为standby；remove为True时从注册表移除
+
+        排空中的版本不再分配新请求；超过drain_timeout只记录警告，在途请求仍持有该版本的模型，
+        不能提前释放。generation 为进入本次排空时的 drain_generation，
+        版本在此期间被重新激活或开始新的排空时本次排空直接结束
+        """
+        deadline = time.monotonic() + self.drain_timeout
+        warned = False
+        with self._lock:
+            while version.inflight > 0 and version.state == 'draining' and version.drain_generation == generation:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 and not warned:
+                    logger.warning(f"模型版本 {version.name} 排空超时，仍有{version.inflight}个在途请求，"
+                                   f"等待其完成后释放")
+                    warned = True
+                self._drained.wait(remaining if remaining > 0 else None)
+            if version.state != 'draining' or version.drain_generation != generation:
+                # 排空期间被重新激活（回滚），本次排空取消
+                logger.info(f"模型版本 {version.name} 的排空已取消")
+                return
+            version.state = 'standby' if keep else 'retired'
+            if remove and self._versions.get(version.name) is version:
+                self._versions.pop(version.name)
+        if not keep:
+            self._release(version)
+        logger.info(f"模型版本 {version.name} 已排空: {version.state}")
+
+    def _release(self, version: ModelVersion):
+        model, version.model = version.model, None
+        if model is not None and hasattr(model, 'shutdown'):
+            try:
+                model.shutdown()
+            except Exception as e:
+                logger.error(f"释放模型版本 {version.name} 失败: {str(e)}")
+
+    def set_canary(self, name: Optional[str], weight: float = 0.0):
+        """按weight（0~1）的比例把请求发往灰度版本；name为None时取消灰度"""
+        with self._lock:
+            if name is None:
+                self._canary, self._canary_weight = None, 0.0
+                return
+            version = self._servable(name)
+            if version is self._active:
+                raise ModelVersionError(f"灰度版本不能是当前版本: {name}")
+            self._canary, self._canary_weight = version, min(max(float(weight), 0.0), 1.0)
+
+    def set_shadow(self, name: Optional[str], rate: float = 1.0):
+        """按rate（0~1）的比例把请求复制给影子版本推理对比；name为None时取消影子"""
+        with self._lock:
+            if name is None:
+                self._shadow, self._shadow_rate = None, 0.0
+                return
+            version = self._servable(name)
+            if version is self._active:
+                raise ModelVersionError(f"影子版本不能是当前版本: {name}")
+            self._shadow, self._shadow_rate = version, min(max(float(rate), 0.0), 1.0)
+
+    def _servable(self, name: str) -> ModelVersion:
+        """调用方需持有锁"""
+        version = self._versions.get(name)
+        if version is None or version.state not in SERVABLE_STATES:
+            raise ModelVersionError(f"模型版本不可用: {name}")
+        return version
+
+    # ---- 请求分配 ----
+
+    def acquire(self, name: Optional[str] = None) -> ModelVersion:
+        """
+        为一次请求选择版本并计入在途：指定name时使用该版本，
+        否则按灰度比例选择灰度版本或当前版本。完成后必须调用 release
+        """
+        with self._lock:
+            if name:
+                version = self._servable(name)
+            elif self._canary is not None and random.random() < self._canary_weight:
+                version = self._canary
+            elif self._active is not None:
+                version = self._active
+            else:
+                raise ModelVersionError("没有可用的模型版本")
+            version.inflight += 1
+            return version
+
+    def release(self, version: ModelVersion, latency_ms: float, ok: bool = True):
+        """请求完成，记录延迟；排空中的版本在途数归零时唤醒等待线程"""
+        with self._lock:
+            version.inflight -= 1
+            version.record(latency_ms, ok)
+            if version.inflight == 0:
+                self._drained.notify_all()
+
+    @contextmanager
+    def lease(self, name: Optional[str] = None):
+        """acquire/release 的上下文管理器形式，异常计为该版本的错误"""
+        version = self.acquire(name)
+        started = time.perf_counter()
+        ok = False
+        try:
+            yield version
+            ok = True
+        finally:
+            self.release(version, (time.perf_counter() - started) * 1000, ok)
+
+    def submit_shadow(self, primary: ModelVersion, image, options: Dict, primary_results: List[Dict]):
+        """
+        按影子比例把请求复制给影子版本异步推理，结果只用于对比统计。
+        影子线程都忙时跳过，不影响主请求延迟
+        """
+        shadow = self._shadow
+        if shadow is None or shadow is primary or random.random() >= self._shadow_rate:
+            return
+        if not self._shadow_slots.acquire(blocking=False):
+            with self._lock:
+                shadow.shadow['skipped'] += 1
+            return
+        try:
+            version = self.acquire(shadow.name)
+        except ModelVersionError:
+            self._shadow_slots.release()
+            return
+        self._shadow_executor.submit(self._run_shadow, version, image,
+                                     dict(options, keep_raw=False), primary_results)
+
+    def _run_shadow(self, version: ModelVersion, image, options: Dict, primary_results: List[Dict]):
+        started = time.perf_counter()
+        ok = False
+        try:
+            result = version.model.predict(version.model.prepare(image), options)
+            ok = True
+            comparison = compare_results(primary_results, result.get('results', []))
+            with self._lock:
+                version.shadow['runs'] += 1
+                version.shadow['count_delta'] += comparison['count_delta']
+                version.shadow['category_match'] += int(comparison['category_match'])
+        except Exception as e:
+            logger.warning(f"影子版本 {version.name} 推理失败: {str(e)}")
+            with self._lock:
+                version.shadow['errors'] += 1
+        finally:
+            self.release(version, (time.perf_counter() - started) * 1000, ok)
+            self._shadow_slots.release()
+
+    # ---- 状态 ----
+
+    def get_stats(self) -> Dict:
+        """各版本状态、在途请求数和延迟统计"""
+        with self._lock:
+            return {
+                'active': self._active.name if self._active is not None else None,
+                'canary': {'version': self._canary.name, 'weight': self._canary_weight}
+                if self._canary is not None else None,
+                'shadow': {'version': self._shadow.name, 'rate': self._shadow_rate}
+                if self._shadow is not None else None,
+                'swaps': self._swaps,
+                'versions': {name: version.get_stats() for name, version in self._versions.items()}
+            }
+
+    def shutdown(self):
+        """释放所有版本（进程退出时调用）"""
+        self._shadow_executor.shutdown(wait=False)
+        with self._lock:
+            versions = list(self._versions.values())
+        for version in versions:
+            self._release(version)
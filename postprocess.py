@@ -0,0 +1,226 @@
+"""
+检测结果后处理模块
+置信度过滤、按类别NMS、top-k截断、掩码IoU NMS和边界框还原，
+全部以NumPy数组运算一次处理所有候选，ONNX/Paddle/PyTorch三条推理路径共用
+"""
+
+import logging
+import numpy as np
+from typing import Dict, Optional, Tuple
+
+from preprocessing import map_boxes_to_original
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+def box_iou(box: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """计算一个边界框与一组边界框的IoU，框格式为 (x1, y1, x2, y2)"""
+    xx1 = np.maximum(box[0], boxes[:, 0])
+    yy1 = np.maximum(box[1], boxes[:, 1])
+    xx2 = np.minimum(box[2], boxes[:, 2])
+    yy2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(xx2 - xx1, 0, None) * np.clip(yy2 - yy1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / np.maximum(area + areas - inter, 1e-9)
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> np.ndarray:
+    """
+    贪心非极大值抑制
+
+    每轮保留得分最高的框，并用一次向量化IoU计算剔除与它重叠过大的其余框，
+    循环次数等于保留框数而不是候选框数
+
+    Args:
+        boxes: (N, 4) 边界框
+        scores: (N,) 置信度
+        iou_threshold: IoU阈值，>=1 时不做抑制
+
+    Returns:
+        保留框的下标，按得分从高到低排列
+    """
+    order = np.argsort(-np.asarray(scores), kind='stable')
+    if iou_threshold >= 1 or order.size <= 1:
+        return order
+    boxes = np.asarray(boxes, dtype=np.float32)
+    keep = []
+    while order.size > 0:
+        current = order[0]
+        keep.append(current)
+        if order.size == 1:
+            break
+        ious = box_iou(boxes[current], boxes[order[1:]])
+        order = order[1:][ious <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def batched_nms(boxes: np.ndarray, scores: np.ndarray, labels: np.ndarray,
+                iou_threshold: float) -> np.ndarray:
+    """
+    按类别NMS：不同类别的框互不抑制
+
+    把每个类别的框平移到互不重叠的坐标区间后做一次NMS，等价于逐类别NMS
+    """
+    boxes = np.asarray(boxes, dtype=np.float32)
+    if boxes.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    span = float(boxes.max() - boxes.min()) + 1.0
+    offsets = np.asarray(labels, dtype=np.float32) * span
+    return nms(boxes + offsets[:, None], scores, iou_threshold)
+
+
+def mask_nms(masks: np.ndarray, boxes: np.ndarray, scores: np.ndarray, labels: np.ndarray,
+             iou_threshold: float) -> np.ndarray:
+    """
+    基于掩码IoU的NMS（同类别之间）
+
+    只比较边界框相交的候选，并且只在当前保留实例的边界框范围内计算交集
+
+    Args:
+        masks: (N, h, w) 布尔掩码
+        boxes: (N, 4) 掩码坐标系下的边界框
+        scores: (N,) 置信度
+        labels: (N,) 类别
+        iou_threshold: 掩码IoU阈值
+
+    Returns:
+        保留实例的下标，按得分从高到低排列
+    """
+    order = np.argsort(-np.asarray(scores), kind='stable')
+    if iou_threshold >= 1 or order.size <= 1:
+        return order
+    height, width = masks.shape[1:]
+    areas = masks.reshape(len(masks), -1).sum(axis=1).astype(np.float32)
+    boxes = np.asarray(boxes, dtype=np.float32)
+    x0s = np.clip(np.floor(boxes[:, 0]), 0, width).astype(np.int64)
+    y0s = np.clip(np.floor(boxes[:, 1]), 0, height).astype(np.int64)
+    x1s = np.clip(np.ceil(boxes[:, 2]), 0, width).astype(np.int64)
+    y1s = np.clip(np.ceil(boxes[:, 3]), 0, height).astype(np.int64)
+    labels = np.asarray(labels)
+
+    keep = []
+    while order.size > 0:
+        current = order[0]
+        keep.append(current)
+        rest = order[1:]
+        if rest.size == 0:
+            break
+        # 只与边界框相交的同类候选比较
+        candidates = rest[(labels[rest] == labels[current]) &
+                          (x0s[rest] < x1s[current]) & (x1s[rest] > x0s[current]) &
+                          (y0s[rest] < y1s[current]) & (y1s[rest] > y0s[current])]
+        if candidates.size:
+            y0, y1, x0, x1 = y0s[current], y1s[current], x0s[current], x1s[current]
+            crop = masks[current, y0:y1, x0:x1]
+            inter = (masks[candidates, y0:y1, x0:x1] & crop).reshape(candidates.size, -1).sum(axis=1)
+            ious = inter / np.maximum(areas[current] + areas[candidates] - inter, 1e-9)
+            suppressed = candidates[ious > iou_threshold]
+            rest = rest[~np.isin(rest, suppressed)]
+        order = rest
+    return np.asarray(keep, dtype=np.int64)
+
+
+class PostProcessor:
+    """
+    检测后处理阶段
+
+    输入为模型输入坐标系下的全部候选，依次执行：置信度过滤 -> 预截断(pre_nms_top_k)
+    -> 按类别（或不分类别）NMS -> 可选的掩码IoU NMS -> 最终截断(max_detections)
+    -> 边界框映射回原图
+    """
+
+    def __init__(self, class_agnostic: bool = False, pre_nms_top_k: int = 1000,
+                 max_detections: int = 100, mask_nms_threshold: Optional[float] = None,
+                 mask_threshold: float = 0.5):
+        """
+        初始化后处理器
+
+        Args:
+            class_agnostic: True时不同类别的框也互相抑制
+            pre_nms_top_k: NMS前按得分保留的最大候选数，<=0不限制
+            max_detections: 最终输出的最大实例数，<=0不限制
+            mask_nms_threshold: 掩码IoU NMS阈值，None表示不做
+            mask_threshold: 掩码二值化阈值
+        """
+        self.class_agnostic = class_agnostic
+        self.pre_nms_top_k = pre_nms_top_k
+        self.max_detections = max_detections
+        self.mask_nms_threshold = mask_nms_threshold
+        self.mask_threshold = mask_threshold
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'PostProcessor':
+        """根据模型配置创建后处理器"""
+        options = config.get('postprocess', {})
+        return cls(
+            class_agnostic=options.get('class_agnostic', False),
+            pre_nms_top_k=options.get('pre_nms_top_k', 1000),
+            max_detections=options.get('max_detections', 100),
+            mask_nms_threshold=options.get('mask_nms_threshold'),
+            mask_threshold=config.get('mask_threshold', 0.5)
+        )
+
+    def select(self, boxes: np.ndarray, scores: np.ndarray, labels: np.ndarray,
+               confidence_threshold: float, nms_threshold: float,
+               masks: Optional[np.ndarray] = None, input_size: Optional[Tuple[int, int]] = None,
+               mask_nms_threshold: Optional[float] = None) -> np.ndarray:
+        """
+        选出保留的候选
+
+        Args:
+            boxes: (N, 4) 模型输入坐标系下的边界框
+            scores: (N,) 置信度
+            labels: (N,) 类别下标
+            confidence_threshold: 置信度阈值
+            nms_threshold: 边界框NMS的IoU阈值
+            masks: (N, h, w) 覆盖整个模型输入的掩码（概率或二值），仅掩码NMS使用
+            input_size: 模型输入尺寸 (W, H)，用于把边界框换算到掩码坐标系
+            mask_nms_threshold: 覆盖配置中的掩码NMS阈值
+
+        Returns:
+            保留候选的下标，按得分从高到低排列
+        """
+        scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+        candidates = np.flatnonzero(scores > confidence_threshold)
+        if candidates.size == 0:
+            return candidates
+
+        # NMS前预截断：argpartition只做部分排序
+        if 0 < self.pre_nms_top_k < candidates.size:
+            top = np.argpartition(-scores[candidates], self.pre_nms_top_k - 1)[:self.pre_nms_top_k]
+            candidates = candidates[top]
+
+        boxes = np.asarray(boxes, dtype=np.float32)
+        labels = np.asarray(labels).reshape(-1)
+        if labels.size < scores.size:
+            labels = np.concatenate([labels, np.zeros(scores.size - labels.size, dtype=np.int64)])
+
+        if self.class_agnostic:
+            keep = nms(boxes[candidates], scores[candidates], nms_threshold)
+        else:
+            keep = batched_nms(boxes[candidates], scores[candidates], labels[candidates], nms_threshold)
+        candidates = candidates[keep]
+
+        threshold = self.mask_nms_threshold if mask_nms_threshold is None else mask_nms_threshold
+        if threshold is not None and masks is not None and input_size is not None and candidates.size > 1:
+            candidates = candidates[self._mask_nms(masks, boxes, scores, labels, candidates,
+                                                   input_size, threshold)]
+
+        if self.max_detections > 0:
+            candidates = candidates[:self.max_detections]
+        return candidates
+
+    def _mask_nms(self, masks, boxes, scores, labels, candidates, input_size, threshold) -> np.ndarray:
+        """在掩码分辨率下对已选候选做掩码IoU NMS"""
+        mask_stack = np.asarray(masks)[candidates]
+        mask_stack = mask_stack.reshape(len(candidates), *mask_stack.shape[-2:]) > self.mask_threshold
+        ratio = np.array([mask_stack.shape[2] / input_size[0], mask_stack.shape[1] / input_size[1]] * 2,
+                         dtype=np.float32)
+        return mask_nms(mask_stack, boxes[candidates] * ratio, scores[candidates],
+                        labels[candidates], threshold)
+
+    def rescale_boxes(self, boxes: np.ndarray, transform: Dict) -> np.ndarray:
+        """将保留的边界框一次性映射回原图坐标"""
+        return map_boxes_to_original(boxes, transform)
@@ -0,0 +1,298 @@
+"""
+图像预处理引擎
+将缩放后的uint8图像一次性归一化并转置写入可复用的NCHW缓冲区
+"""
+
+import threading
+import logging
+import numpy as np
+from PIL import Image
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from image_decode import original_size
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 支持的重采样方式
+RESAMPLE_MODES = {
+    'lanczos': Image.Resampling.LANCZOS,
+    'bicubic': Image.Resampling.BICUBIC,
+    'bilinear': Image.Resampling.BILINEAR,
+    'nearest': Image.Resampling.NEAREST
+}
+
+
+class ImagePreprocessor:
+    """
+    模型输入预处理器
+
+    uint8像素只有256种取值，初始化时为每个通道预先计算
+    (v / 255 - mean) / std 的查找表，预处理时用 np.take 按通道查表并直接写入
+    输出缓冲区，归一化、标准化和HWC->CHW转置合并为一步，不产生整幅浮点中间数组。
+    """
+
+    def __init__(self, input_size: Tuple[int, int],
+                 mean: Sequence[float] = (0.485, 0.456, 0.406),
+                 std: Sequence[float] = (0.229, 0.224, 0.225),
+                 resample: str = 'lanczos',
+                 fast_resample: str = 'bilinear',
+                 fast_mode_min_pixels: Optional[int] = None,
+                 jpeg_draft: bool = False,
+                 letterbox: bool = False,
+                 pad_value: int = 0):
+        """
+        初始化预处理器
+
+        Args:
+            input_size: 模型输入尺寸 (宽, 高)
+            mean: 各通道均值
+            std: 各通道标准差
+            resample: 默认重采样方式
+            fast_resample: 大图使用的廉价重采样方式
+            fast_mode_min_pixels: 像素数超过该值的图像使用廉价模式，None表示不启用
+            jpeg_draft: 是否对未解码的JPEG使用draft模式，在DCT域直接降采样解码
+            letterbox: 是否保持长宽比缩放并居中填充，否则直接拉伸到输入尺寸
+            pad_value: letterbox填充的像素值
+        """
+        self.input_size = tuple(input_size)
+        self.resample = RESAMPLE_MODES.get(resample, Image.Resampling.LANCZOS)
+        self.fast_resample = RESAMPLE_MODES.get(fast_resample, Image.Resampling.BILINEAR)
+        self.fast_mode_min_pixels = fast_mode_min_pixels
+        self.jpeg_draft = jpeg_draft
+        self.letterbox = letterbox
+        self.pad_value = pad_value
+
+        # 查找表：lut[c, v] = (v / 255 - mean[c]) / std[c]
+        mean = np.asarray(mean, dtype=np.float32).reshape(3, 1)
+        std = np.asarray(std, dtype=np.float32).reshape(3, 1)
+        values = np.arange(256, dtype=np.float32).reshape(1, 256) / 255.0
+        self.lut = np.ascontiguousarray((values - mean) / std, dtype=np.float32)
+
+        # 每个线程独立的输出缓冲区，避免并发推理互相覆盖
+        self._local = threading.local()
+
+    @classmethod
+    def from_config(cls, config: dict, input_size: Tuple[int, int]) -> 'ImagePreprocessor':
+        """根据模型配置创建预处理器"""
+        options = config.get('preprocess', {})
+        return cls(
+            input_size,
+            mean=config.get('mean', [0.485, 0.456, 0.406]),
+            std=config.get('std', [0.229, 0.224, 0.225]),
+            resample=options.get('resample', 'lanczos'),
+            fast_resample=options.get('fast_resample', 'bilinear'),
+            fast_mode_min_pixels=options.get('fast_mode_min_pixels'),
+            jpeg_draft=options.get('jpeg_draft', False),
+            letterbox=options.get('letterbox', False),
+            pad_value=options.get('pad_value', 0)
+        )
+
+    def _get_buffer(self, batch_size: int) -> np.ndarray:
+        """获取当前线程的NCHW缓冲区，容量不足时扩容"""
+        width, height = self.input_size
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None or buffer.shape[0] < batch_size:
+            buffer = np.empty((batch_size, 3, height, width), dtype=np.float32)
+            self._local.buffer = buffer
+        return buffer[:batch_size]
+
+    def compute_transform(self, original_size: Tuple[int, int]) -> Dict:
+        """
+        计算原图到模型输入的几何变换
+
+        Returns:
+            变换字典：scale_x/scale_y 为缩放比例，pad_x/pad_y 为letterbox填充偏移，
+            content_size 为缩放后有效图像区域尺寸
+        """
+        width, height = self.input_size
+        orig_w, orig_h = original_size
+        if self.letterbox:
+            scale = min(width / orig_w, height / orig_h)
+            content_w = max(1, min(width, int(round(orig_w * scale))))
+            content_h = max(1, min(height, int(round(orig_h * scale))))
+            pad_x = (width - content_w) // 2
+            pad_y = (height - content_h) // 2
+        else:
+            content_w, content_h = width, height
+            pad_x = pad_y = 0
+        return {
+            'original_size': (orig_w, orig_h),
+            'input_size': (width, height),
+            'content_size': (content_w, content_h),
+            'scale_x': content_w / orig_w,
+            'scale_y': content_h / orig_h,
+            'pad_x': pad_x,
+            'pad_y': pad_y
+        }
+
+    def resize(self, image: Image.Image) -> Image.Image:
+        """缩放到模型输入尺寸"""
+        return self.resize_with_transform(image)[0]
+
+    def resize_with_transform(self, image: Image.Image) -> Tuple[Image.Image, Dict]:
+        """缩放到模型输入尺寸，大图按配置使用draft解码和廉价重采样，同时返回几何变换"""
+        # draft或降分辨率解码会改变图像尺寸，按全分辨率尺寸计算变换，结果映射回原图坐标
+        transform = self.compute_transform(original_size(image))
+        content_size = transform['content_size']
+        fast = self.fast_mode_min_pixels is not None and \
+            image.width * image.height > self.fast_mode_min_pixels
+
+        if self.jpeg_draft and image.format == 'JPEG':
+            # 仅对尚未解码的JPEG生效：按1/2、1/4、1/8在DCT域降采样，尺寸不小于目标
+            image.draft('RGB', content_size)
+
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        if image.size != content_size:
+            if fast:
+                # 先用整数倍box降采样到接近目标尺寸，再做一次廉价插值
+                factor = min(image.width // content_size[0], image.height // content_size[1])
+                if factor >= 2:
+                    image = image.reduce(factor)
+                image = image.resize(content_size, self.fast_resample)
+            else:
+                image = image.resize(content_size, self.resample)
+
+        if content_size != self.input_size:
+            canvas = Image.new('RGB', self.input_size, (self.pad_value,) * 3)
+            canvas.paste(image, (transform['pad_x'], transform['pad_y']))
+            image = canvas
+
+        return image, transform
+
+    def normalize_into(self, pixels: np.ndarray, out: np.ndarray) -> np.ndarray:
+        """
+        将HWC uint8数组归一化并转置写入CHW输出数组
+
+        Args:
+            pixels: 形状为(H, W, 3)的uint8数组
+            out: 形状为(3, H, W)的float32数组
+        """
+        for c in range(3):
+            # mode='clip'时np.take直接写入out；uint8索引不会越界
+            np.take(self.lut[c], pixels[:, :, c], out=out[c], mode='clip')
+        return out
+
+    def transform_batch(self, images: List[Union[Image.Image, 'PreparedImage']]) -> np.ndarray:
+        """
+        预处理一批图像
+
+        返回的数组是线程内复用缓冲区的视图，在同一线程下一次调用前有效；
+        推理引擎会在run时拷贝输入，因此无需额外复制。
+        """
+        buffer = self._get_buffer(len(images))
+        for i, image in enumerate(images):
+            if isinstance(image, PreparedImage):
+                pixels = image.pixels
+            else:
+                pixels = np.asarray(self.resize(image), dtype=np.uint8)
+            self.normalize_into(pixels, buffer[i])
+        return buffer
+
+    def __call__(self, image: Image.Image) -> np.ndarray:
+        """预处理单张图像，返回形状为(1, 3, H, W)的数组"""
+        return self.transform_batch([image])
+
+
+class PreparedImage:
+    """
+    单次请求共享的预处理阶段
+
+    缩放/letterbox 只在后端首次访问 pixels 或 transform 时执行一次，
+    不需要预处理的后端（如模拟模式）不会产生任何开销。
+    """
+
+    def __init__(self, image: Image.Image, preprocessor: ImagePreprocessor):
+        self.image = image
+        self.preprocessor = preprocessor
+        self.original_size = original_size(image)
+        self._pixels = None
+        self._transform = None
+
+    def _prepare(self):
+        if self._pixels is None:
+            resized, self._transform = self.preprocessor.resize_with_transform(self.image)
+            self._pixels = np.asarray(resized, dtype=np.uint8)
+
+    @property
+    def pixels(self) -> np.ndarray:
+        """缩放到模型输入尺寸的HWC uint8数组"""
+        self._prepare()
+        return self._pixels
+
+    @property
+    def transform(self) -> Dict:
+        """原图到模型输入的几何变换"""
+        self._prepare()
+        return self._transform
+
+
+def identity_transform(original_size: Tuple[int, int]) -> Dict:
+    """模型直接在原图坐标系输出时使用的恒等变换"""
+    return {
+        'original_size': tuple(original_size),
+        'input_size': tuple(original_size),
+        'content_size': tuple(original_size),
+        'scale_x': 1.0,
+        'scale_y': 1.0,
+        'pad_x': 0,
+        'pad_y': 0
+    }
+
+
+def native_transform(image: Image.Image) -> Dict:
+    """
+    模型直接在解码图像的坐标系输出时使用的变换（如torchvision检测模型）
+
+    降分辨率解码的图像尺寸小于全分辨率尺寸，按两者之比缩放回原图坐标；
+    全分辨率解码时等同于 identity_transform
+    """
+    orig_w, orig_h = original_size(image)
+    width, height = image.size
+    return {
+        'original_size': (orig_w, orig_h),
+        'input_size': (width, height),
+        'content_size': (width, height),
+        'scale_x': width / orig_w,
+        'scale_y': height / orig_h,
+        'pad_x': 0,
+        'pad_y': 0
+    }
+
+
+def map_boxes_to_original(boxes: np.ndarray, transform: Dict) -> np.ndarray:
+    """
+    将模型输入坐标系下的边界框映射回原图坐标
+
+    Args:
+        boxes: 形状为(N, 4)的 [x1, y1, x2, y2] 数组
+        transform: compute_transform 返回的变换字典
+    """
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    orig_w, orig_h = transform['original_size']
+    offset = np.array([transform['pad_x'], transform['pad_y']] * 2, dtype=np.float32)
+    scale = np.array([transform['scale_x'], transform['scale_y']] * 2, dtype=np.float32)
+    mapped = (boxes - offset) / scale
+    np.clip(mapped[:, 0::2], 0, orig_w, out=mapped[:, 0::2])
+    np.clip(mapped[:, 1::2], 0, orig_h, out=mapped[:, 1::2])
+    return mapped
+
+
+def mask_index_maps(mask_shape: Tuple[int, int], transform: Dict) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    计算原图每行/每列像素对应的掩码行/列（最近邻）
+
+    掩码覆盖整个模型输入（含letterbox填充），分辨率可以低于模型输入；
+    同一张图像的所有实例共用这两张索引表，重采样变成简单的索引读取
+    """
+    orig_w, orig_h = transform['original_size']
+    input_w, input_h = transform['input_size']
+    ratio_x = mask_shape[1] / input_w
+    ratio_y = mask_shape[0] / input_h
+    xs = (np.arange(orig_w, dtype=np.float32) + 0.5) * transform['scale_x'] + transform['pad_x']
+    ys = (np.arange(orig_h, dtype=np.float32) + 0.5) * transform['scale_y'] + transform['pad_y']
+    src_x = np.clip((xs * ratio_x).astype(np.int64), 0, mask_shape[1] - 1)
+    src_y = np.clip((ys * ratio_y).astype(np.int64), 0, mask_shape[0] - 1)
+    return src_y, src_x
@@ -0,0 +1,198 @@
+"""
+模型量化工具
+由FP32的ONNX模型生成低精度变体，供CPU推理节点按 model_config.json 的 model_variant 选用：
+    int8_dynamic  动态量化：只量化权重，激活值在推理时按批计算量化参数，无需校准数据
+    int8_static   静态量化：用本地图像（如 test_images/）校准激活值范围，QDQ格式
+    fp16          半精度：权重和计算转为float16，输入输出保持float32
+
+变体文件与原模型同目录，命名为 <模型路径>.<变体>.onnx，例如 models/oral_health_model.int8_static.onnx
+
+用法:
+    python quantize_model.py --model models/oral_health_model --config models/model_config.json \\
+        --variant int8_static --calibration test_images [--activate]
+"""
+
+import os
+import json
+import logging
+import argparse
+import tempfile
+from typing import Iterator, List, Optional
+
+import numpy as np
+from PIL import Image
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+MODEL_VARIANTS = ('fp32', 'int8_dynamic', 'int8_static', 'fp16')
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+
+def variant_file(model_path: str, variant: str, ext: str = '.onnx') -> str:
+    """变体模型文件路径，fp32即原模型"""
+    if not variant or variant == 'fp32':
+        return f"{model_path}{ext}"
+    return f"{model_path}.{variant}{ext}"
+
+
+def list_images(folder: str, limit: int = 0) -> List[str]:
+    """校准目录下的图像文件，按文件名排序"""
+    files = sorted(os.path.join(folder, name) for name in os.listdir(folder)
+                   if name.lower().endswith(IMAGE_EXTENSIONS))
+    return files[:limit] if limit > 0 else files
+
+
+class ImageCalibrationReader:
+    """
+    静态量化校准数据
+
+    使用与线上推理相同的预处理（LocalModelInference.prepare / preprocess_batch），
+    保证校准得到的激活值范围与实际输入一致
+    """
+
+    def __init__(self, model_path: str, config_path: str, image_files: List[str], input_name: str):
+        from model_inference import LocalModelInference
+        self.model = LocalModelInference(model_path, config_path, load_model=False)
+        self.image_files = image_files
+        self.input_name = input_name
+        self._iterator = None
+
+    def _batches(self) -> Iterator[dict]:
+        for path in self.image_files:
+            with Image.open(path) as image:
+                prepared = self.model.prepare(image.convert('RGB'))
+            yield {self.input_name: self.model.preprocess_batch([prepared])}
+
+    def get_next(self) -> Optional[dict]:
+        if self._iterator is None:
+            self._iterator = self._batches()
+        return next(self._iterator, None)
+
+    def rewind(self):
+        self._iterator = None
+
+
+def _preprocess_for_quantization(source: str, workdir: str) -> str:
+    """量化前的形状推断和图优化，失败时直接使用原模型"""
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+    target = os.path.join(workdir, 'preprocessed.onnx')
+    try:
+        quant_pre_process(source, target, skip_symbolic_shape=True)
+        return target
+    except Exception as e:
+        logger.warning(f"量化预处理失败，使用原模型: {e}")
+        return source
+
+
+def quantize_dynamic_variant(source: str, target: str) -> str:
+    """动态INT8量化（权重量化为uint8）"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    with tempfile.TemporaryDirectory() as workdir:
+        quantize_dynamic(_preprocess_for_quantization(source, workdir), target, weight_type=QuantType.QUInt8)
+    return target
+
+
+def quantize_static_variant(source: str, target: str, model_path: str, config_path: str,
+                            calibration_dir: str, max_images: int = 64, per_channel: bool = True,
+                            calibrate_method: str = 'minmax') -> str:
+    """
+    静态INT8量化（QDQ格式，激活uint8、权重int8）
+
+    Args:
+        source: FP32 ONNX模型文件
+        target: 输出文件
+        model_path / config_path: 用于构建与线上一致的预处理
+        calibration_dir: 校准图像目录
+        max_images: 最多使用的校准图像数
+        per_channel: 卷积权重是否按输出通道量化
+        calibrate_method: minmax / entropy / percentile
+    """
+    import onnx
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+
+    images = list_images(calibration_dir, max_images)
+    if not images:
+        raise ValueError(f"校准目录中没有图像: {calibration_dir}")
+    input_name = onnx.load(source, load_external_data=False).graph.input[0].name
+    reader = ImageCalibrationReader(model_path, config_path, images, input_name)
+    methods = {'minmax': CalibrationMethod.MinMax, 'entropy': CalibrationMethod.Entropy,
+               'percentile': CalibrationMethod.Percentile}
+    logger.info(f"使用 {len(images)} 张图像校准（{calibrate_method}）")
+    with tempfile.TemporaryDirectory() as workdir:
+        quantize_static(
+            _preprocess_for_quantization(source, workdir), target, reader,
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=per_channel,
+            calibrate_method=methods[calibrate_method]
+        )
+    return target
+
+
+def convert_fp16_variant(source: str, target: str) -> str:
+    """转换为float16，输入输出保持float32以兼容预处理和后处理"""
+    import onnx
+    from onnxruntime.transformers.float16 import convert_float_to_float16
+    model = convert_float_to_float16(onnx.load(source), keep_io_types=True)
+    onnx.save(model, target)
+    return target
+
+
+def build_variant(variant: str, model_path: str, config_path: str, calibration_dir: str = 'test_images',
+                  max_images: int = 64, per_channel: bool = True, calibrate_method: str = 'minmax') -> str:
+    """生成指定变体，返回输出文件路径"""
+    source = variant_file(model_path, 'fp32')
+    if not os.path.exists(source):
+        raise FileNotFoundError(f"FP32模型不存在: {source}")
+    target = variant_file(model_path, variant)
+    if variant == 'int8_dynamic':
+        return quantize_dynamic_variant(source, target)
+    if variant == 'int8_static':
+        return quantize_static_variant(source, target, model_path, config_path, calibration_dir,
+                                       max_images, per_channel, calibrate_method)
+    if variant == 'fp16':
+        return convert_fp16_variant(source, target)
+    raise ValueError(f"不支持的模型变体: {variant}")
+
+
+def activate_variant(config_path: str, variant: str):
+    """把 model_variant 写入模型配置文件"""
+    config = {}
+    if os.path.exists(config_path):
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    config['model_variant'] = variant
+    with open(config_path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成量化/半精度模型变体')
+    parser.add_argument('--model', default=os.environ.get('MODEL_PATH', 'models/oral_health_model'),
+                        help='模型路径（不含扩展名）')
+    parser.add_argument('--config', default=os.environ.get('MODEL_CONFIG', 'models/model_config.json'),
+                        help='模型配置文件')
+    parser.add_argument('--variant', choices=MODEL_VARIANTS[1:] + ('all',), default='int8_static')
+    parser.add_argument('--calibration', default='test_images', help='静态量化校准图像目录')
+    parser.add_argument('--max-images', type=int, default=64, help='最多使用的校准图像数')
+    parser.add_argument('--calibrate-method', choices=('minmax', 'entropy', 'percentile'), default='minmax')
+    parser.add_argument('--no-per-channel', action='store_true', help='卷积权重按张量而不是按通道量化')
+    parser.add_argument('--activate', action='store_true', help='生成后写入配置的 model_variant')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'), format='%(asctime)s %(levelname)s %(message)s')
+    variants = MODEL_VARIANTS[1:] if args.variant == 'all' else (args.variant,)
+    for variant in variants:
+        path = build_variant(variant, args.model, args.config, args.calibration, args.max_images,
+                             not args.no_per_channel, args.calibrate_method)
+        print(f"{variant}: {path} ({os.path.getsize(path) / 1024 / 1024:.1f} MB)")
+    if args.activate and len(variants) == 1:
+        activate_variant(args.config, variants[0])
+        print(f"已在 {args.config} 中启用 model_variant={variants[0]}")
+
+
+if __name__ == '__main__':
+    main()
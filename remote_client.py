@@ -0,0 +1,379 @@
+"""
+远程推理客户端模块
+BML模型API的长连接池客户端：并发上限、指数退避重试、熔断快速失败、
+按大小选择JPEG/原始uint8载荷，以及针对长尾延迟的对冲请求
+"""
+
+import io
+import time
+import base64
+import random
+import logging
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+import requests
+from PIL import Image
+from requests.adapters import HTTPAdapter
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+PAYLOAD_FORMATS = ('auto', 'jpeg', 'png', 'raw')
+
+# 视为暂时性故障、值得重试的HTTP状态码
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+
+class RemoteInferenceError(Exception):
+    """远程推理失败"""
+
+
+class CircuitOpenError(RemoteInferenceError):
+    """熔断器打开，请求未发出即失败"""
+
+
+class ConcurrencyLimitError(CircuitOpenError):
+    """本地并发名额等待超时，请求未发出；与远端健康状况无关，不计入熔断失败"""
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    连续失败达到 failure_threshold 次后打开，reset_timeout 秒内所有请求直接失败；
+    之后进入半开状态只放行一个探测请求，成功则关闭，失败则重新打开
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._probe_owner = None
+        self.open_count = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self) -> bool:
+        """是否放行本次请求"""
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._probing:
+                self._probing = True
+                self._probe_owner = threading.get_ident()
+                return True
+            return False
+
+    def release_probe(self):
+        """本线程的探测请求未能发出（本地饱和、编码失败）时归还探测名额，熔断状态不变"""
+        with self._lock:
+            if self._probing and self._probe_owner == threading.get_ident():
+                self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._probing:
+                    self.open_count += 1
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+def encode_payload(pixels: np.ndarray, payload_format: str = 'auto', raw_max_bytes: int = 256 * 1024,
+                   jpeg_quality: int = 90) -> Dict:
+    """
+    编码发送给远程模型的图像
+
+    auto 模式下原始像素不超过 raw_max_bytes 时直接发送uint8字节（省去编解码），
+    否则发送JPEG
+
+    Args:
+        pixels: HWC uint8 RGB数组
+        payload_format: auto / jpeg / png / raw
+
+    Returns:
+        请求中的 data 字段
+    """
+    if payload_format not in PAYLOAD_FORMATS:
+        raise ValueError(f"不支持的载荷格式: {payload_format}")
+    pixels = np.ascontiguousarray(pixels, dtype=np.uint8)
+    if payload_format == 'auto':
+        payload_format = 'raw' if pixels.nbytes <= raw_max_bytes else 'jpeg'
+
+    if payload_format == 'raw':
+        return {
+            'image': base64.b64encode(pixels.tobytes()).decode(),
+            'format': 'base64',
+            'encoding': 'raw',
+            'dtype': 'uint8',
+            'shape': list(pixels.shape)
+        }
+
+    buffer = io.BytesIO()
+    if payload_format == 'jpeg':
+        Image.fromarray(pixels).save(buffer, format='JPEG', quality=jpeg_quality)
+    else:
+        Image.fromarray(pixels).save(buffer, format='PNG', compress_level=1)
+    return {
+        'image': base64.b64encode(buffer.getvalue()).decode(),
+        'format': 'base64',
+        'encoding': payload_format
+    }
+
+
+class RemoteInferenceClient:
+    """
+    远程推理客户端
+
+    所有请求共用一个 requests.Session（keep-alive连接池），
+    用信号量限制同时在途的请求数，超过等待时间直接失败而不是无限排队
+    """
+
+    def __init__(self, endpoint: str, api_key: str = '',
+                 timeout: Tuple[float, float] = (3.0, 30.0),
+                 max_concurrency: int = 8, queue_timeout: float = 5.0,
+                 max_retries: int = 2, backoff: float = 0.2,
+                 breaker_failures: int = 5, breaker_reset: float = 30.0,
+                 hedge_after_ms: Union[float, str, None] = None,
+                 payload_format: str = 'auto', raw_max_bytes: int = 256 * 1024,
+                 history_size: int = 500):
+        """
+        初始化客户端
+
+        Args:
+            endpoint: 模型API地址
+            api_key: 访问令牌
+            timeout: (连接超时, 读取超时) 秒
+            max_concurrency: 同时在途的最大请求数（也是连接池大小）
+            queue_timeout: 等待并发名额的最长时间（秒）
+            max_retries: 暂时性故障的最大重试次数
+            backoff: 指数退避的基础间隔（秒）
+            breaker_failures: 熔断器打开所需的连续失败次数
+            breaker_reset: 熔断器打开后到允许探测的时间（秒）
+            hedge_after_ms: 首个请求超过该时间未返回时发出对冲请求；'auto' 取近期p95，None/0不对冲
+            payload_format: 图像载荷格式 auto / jpeg / png / raw
+            raw_max_bytes: auto 模式下直接发送原始像素的最大字节数
+            history_size: 保留用于统计延迟分位数的最近请求数
+        """
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.max_retries = max(0, max_retries)
+        self.backoff = backoff
+        self.hedge_after_ms = hedge_after_ms or None
+        self.payload_format = payload_format
+        self.raw_max_bytes = raw_max_bytes
+        self.max_concurrency = max(1, max_concurrency)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {api_key}',
+            'X-Baidu-Access-Token': api_key
+        })
+
+        self.breaker = CircuitBreaker(breaker_failures, breaker_reset)
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        # 对冲请求需要额外线程，线程数为并发上限的两倍
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency * 2, thread_name_prefix='remote-infer')
+
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=history_size)
+        self._stats = {'requests': 0, 'success': 0, 'failures': 0, 'retries': 0,
+                       'rejected': 0, 'hedged': 0, 'hedge_wins': 0}
+
+    # ---- 对外接口 ----
+
+    def infer(self, pixels: np.ndarray, params: Optional[Dict] = None) -> Dict:
+        """
+        同步执行一次远程推理
+
+        Args:
+            pixels: HWC uint8 RGB数组（已按远程模型输入尺寸预处理）
+            params: 请求参数（阈值等）
+
+        Returns:
+            远程API返回的JSON
+
+        Raises:
+            CircuitOpenError: 熔断器打开或并发名额等待超时
+            RemoteInferenceError: 重试后仍然失败
+        """
+        with self._lock:
+            self._stats['requests'] += 1
+        if not self.breaker.allow():
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise CircuitOpenError(f"远程推理熔断中（{self.breaker.state}）")
+
+        try:
+            body = {
+                'data': encode_payload(pixels, self.payload_format, self.raw_max_bytes),
+                'params': params or {}
+            }
+            start = time.perf_counter()
+            try:
+                result = self._hedged_post(body)
+            except ConcurrencyLimitError:
+                # 本地并发已满、请求未发出，不能据此熔断健康的远端
+                with self._lock:
+                    self._stats['rejected'] += 1
+                raise
+            except Exception as e:
+                self.breaker.record_failure()
+                with self._lock:
+                    self._stats['failures'] += 1
+                if isinstance(e, RemoteInferenceError):
+                    raise
+                raise RemoteInferenceError(str(e)) from e
+            self.breaker.record_success()
+        finally:
+            # 成功/失败都已结束探测；其余情况（编码异常、本地饱和）归还探测名额
+            self.breaker.release_probe()
+
+        with self._lock:
+            self._stats['success'] += 1
+            self._latencies.append((time.perf_counter() - start) * 1000)
+        return result
+
+    def submit(self, pixels: np.ndarray, params: Optional[Dict] = None) -> Future:
+        """异步提交，返回Future（可用 asyncio.wrap_future 在事件循环中等待）"""
+        return self._executor.submit(self.infer, pixels, params)
+
+    # ---- 内部实现 ----
+
+    def _hedge_delay(self) -> Optional[float]:
+        """对冲等待时间（秒），None表示不对冲"""
+        if not self.hedge_after_ms:
+            return None
+        if self.hedge_after_ms == 'auto':
+            with self._lock:
+                latencies = sorted(self._latencies)
+            if len(latencies) < 20:
+                return None
+            return max(0.05, latencies[int(len(latencies) * 0.95)] / 1000)
+        return float(self.hedge_after_ms) / 1000
+
+    def _hedged_post(self, body: Dict) -> Dict:
+        """发出请求，超过对冲时间仍未返回时再发一个相同请求，取先成功的结果"""
+        delay = self._hedge_delay()
+        if delay is None:
+            return self._post_with_retry(body)
+
+        primary = self._executor.submit(self._post_with_retry, body)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        # 只有在并发名额有空余时才对冲，避免在远端过载时放大压力
+        if not self._slots.acquire(blocking=False):
+            return primary.result()
+        self._slots.release()
+        with self._lock:
+            self._stats['hedged'] += 1
+        hedge = self._executor.submit(self._post_with_retry, body)
+
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if future is hedge:
+                    with self._lock:
+                        self._stats['hedge_wins'] += 1
+                return result
+        raise error
+
+    def _post_with_retry(self, body: Dict) -> Dict:
+        """带指数退避的重试"""
+        attempt = 0
+        while True:
+            try:
+                return self._post(body)
+            except RemoteInferenceError as e:
+                retryable = getattr(e, 'retryable', False)
+                if not retryable or attempt >= self.max_retries:
+                    raise
+            attempt += 1
+            with self._lock:
+                self._stats['retries'] += 1
+            # 全抖动退避，避免大量客户端同时重试
+            time.sleep(random.uniform(0, self.backoff * (2 ** (attempt - 1))))
+
+    def _post(self, body: Dict) -> Dict:
+        """占用一个并发名额发出单个请求"""
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise ConcurrencyLimitError(f"远程推理并发已满（{self.max_concurrency}），等待超时")
+        try:
+            try:
+                response = self.session.post(self.endpoint, json=body, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = RemoteInferenceError(f"请求远程模型失败: {e}")
+                error.retryable = True
+                raise error from e
+            if response.status_code != 200:
+                error = RemoteInferenceError(f"远程模型返回 {response.status_code}: {response.text[:200]}")
+                error.retryable = response.status_code in RETRYABLE_STATUS
+                raise error
+            return response.json()
+        finally:
+            self._slots.release()
+
+    def get_stats(self) -> Dict:
+        """获取客户端统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            latencies = sorted(self._latencies)
+
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 2)
+
+        stats.update({
+            'endpoint': self.endpoint,
+            'breaker_state': self.breaker.state,
+            'breaker_opened': self.breaker.open_count,
+            'max_concurrency': self.max_concurrency,
+            'latency_ms': {'p50': percentile(0.5), 'p95': percentile(0.95), 'p99': percentile(0.99)}
+        })
+        return stats
+
+    def close(self):
+        """关闭连接池和线程池"""
+        self._executor.shutdown(wait=False)
+        self.session.close()
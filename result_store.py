@@ -0,0 +1,244 @@
+"""
+检测结果索引模块
+用SQLite（WAL模式）保存检测结果摘要，历史查询走索引而不是扫描结果目录
+
+也可以单独运行，把已有的 results/*.json 导入索引：
+    python result_store.py --results results --db results/index.sqlite3
+"""
+
+import os
+import json
+import base64
+import sqlite3
+import logging
+import argparse
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS result_summary (
+    id TEXT PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    filename TEXT,
+    disease_detected INTEGER NOT NULL DEFAULT 0,
+    severity TEXT,
+    total_instances INTEGER NOT NULL DEFAULT 0,
+    observation_count INTEGER NOT NULL DEFAULT 0,
+    surgery_count INTEGER NOT NULL DEFAULT 0,
+    confidence REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_summary_time ON result_summary (timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_summary_severity ON result_summary (severity, timestamp DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_summary_detected ON result_summary (disease_detected, timestamp DESC, id DESC);
+CREATE TABLE IF NOT EXISTS store_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+SUMMARY_COLUMNS = ('id', 'timestamp', 'filename', 'disease_detected', 'severity',
+                   'total_instances', 'observation_count', 'surgery_count', 'confidence')
+
+MIGRATION_KEY = 'json_migrated'
+
+
+def summarize(result_data: Dict) -> Tuple:
+    """从完整结果数据中提取摘要行"""
+    result = result_data.get('result', {})
+    return (
+        result_data['id'],
+        result_data['timestamp'],
+        result_data.get('filename'),
+        1 if result.get('disease_detected', False) else 0,
+        result.get('severity', '未知'),
+        int(result.get('total_instances', 0)),
+        int(result.get('observation_count', 0)),
+        int(result.get('surgery_count', 0)),
+        float(result.get('confidence', 0) or 0)
+    )
+
+
+def encode_cursor(timestamp: str, result_id: str) -> str:
+    """把分页位置编码为不透明游标"""
+    return base64.urlsafe_b64encode(f"{timestamp}|{result_id}".encode('utf-8')).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """解码分页游标"""
+    timestamp, result_id = base64.urlsafe_b64decode(cursor.encode()).decode('utf-8').split('|', 1)
+    return timestamp, result_id
+
+
+class ResultIndex:
+    """检测结果摘要索引"""
+
+    def __init__(self, db_path: str):
+        """
+        初始化索引
+
+        Args:
+            db_path: SQLite数据库文件路径
+        """
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        conn.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        """每个线程使用独立连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            # WAL模式下读写互不阻塞，NORMAL同步级别在WAL下仍保证一致性
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def add(self, result_data: Dict):
+        """写入或更新一条结果摘要"""
+        self.add_many([result_data])
+
+    def add_many(self, results: Sequence[Dict]):
+        """批量写入结果摘要"""
+        self._insert_rows([summarize(data) for data in results])
+
+    def _insert_rows(self, rows: Sequence[Tuple]):
+        """批量写入已提取的摘要行"""
+        conn = self._connect()
+        placeholders = ', '.join('?' * len(SUMMARY_COLUMNS))
+        with conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO result_summary ({', '.join(SUMMARY_COLUMNS)}) VALUES ({placeholders})",
+                rows
+            )
+
+    def query(self, limit: int = 50, cursor: Optional[str] = None,
+              severity: Optional[Sequence[str]] = None,
+              start: Optional[str] = None, end: Optional[str] = None,
+              disease_detected: Optional[bool] = None) -> Tuple[List[Dict], Optional[str]]:
+        """
+        按时间倒序分页查询摘要
+
+        Args:
+            limit: 每页条数
+            cursor: 上一页返回的游标
+            severity: 严重程度过滤（可多个）
+            start: 起始时间（ISO格式，含）
+            end: 结束时间（ISO格式，含；只给日期时包含当天全部）
+            disease_detected: 是否检出病变
+
+        Returns:
+            (摘要列表, 下一页游标或None)
+        """
+        conditions = []
+        params = []
+        if severity:
+            conditions.append(f"severity IN ({', '.join('?' * len(severity))})")
+            params.extend(severity)
+        if disease_detected is not None:
+            conditions.append('disease_detected = ?')
+            params.append(1 if disease_detected else 0)
+        if start:
+            conditions.append('timestamp >= ?')
+            params.append(start)
+        if end:
+            conditions.append('timestamp <= ?')
+            params.append(end + 'T23:59:59.999999' if len(end) == 10 else end)
+        if cursor:
+            # 键集分页：(timestamp, id) 严格小于上一页最后一条
+            cursor_ts, cursor_id = decode_cursor(cursor)
+            conditions.append('(timestamp < ? OR (timestamp = ? AND id < ?))')
+            params.extend([cursor_ts, cursor_ts, cursor_id])
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        rows = self._connect().execute(
+            f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM result_summary {where} "
+            f"ORDER BY timestamp DESC, id DESC LIMIT ?",
+            params + [limit + 1]
+        ).fetchall()
+
+        items = []
+        for row in rows[:limit]:
+            item = dict(row)
+            item['disease_detected'] = bool(item['disease_detected'])
+            items.append(item)
+
+        next_cursor = None
+        if len(rows) > limit:
+            last = items[-1]
+            next_cursor = encode_cursor(last['timestamp'], last['id'])
+        return items, next_cursor
+
+    def count(self) -> int:
+        """索引中的结果总数"""
+        return self._connect().execute('SELECT COUNT(*) FROM result_summary').fetchone()[0]
+
+    def is_migrated(self) -> bool:
+        """是否已完成结果目录的一次性导入"""
+        row = self._connect().execute(
+            'SELECT value FROM store_meta WHERE key = ?', (MIGRATION_KEY,)).fetchone()
+        return row is not None
+
+    def migrate_from_folder(self, results_folder: str, batch_size: int = 500) -> int:
+        """
+        一次性导入结果目录中已有的JSON文件
+
+        无法解析或缺少id/timestamp的文件记录错误后跳过，不影响其余文件的导入；
+        导入完成后在store_meta中记录标记，之后调用直接返回0
+
+        Returns:
+            导入的结果数
+        """
+        if self.is_migrated():
+            return 0
+        imported = 0
+        skipped = 0
+        batch = []
+        if os.path.exists(results_folder):
+            for filename in os.listdir(results_folder):
+                if not filename.endswith('.json'):
+                    continue
+                try:
+                    with open(os.path.join(results_folder, filename), 'r', encoding='utf-8') as f:
+                        batch.append(summarize(json.load(f)))
+                except Exception as e:
+                    logger.error(f"导入结果文件失败 {filename}: {e}")
+                    skipped += 1
+                    continue
+                if len(batch) >= batch_size:
+                    self._insert_rows(batch)
+                    imported += len(batch)
+                    batch = []
+        if batch:
+            self._insert_rows(batch)
+            imported += len(batch)
+
+        conn = self._connect()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO store_meta (key, value) VALUES (?, ?)',
+                         (MIGRATION_KEY, str(imported)))
+        logger.info(f"结果索引导入完成，共{imported}条，跳过{skipped}个无效文件")
+        return imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description='将结果目录导入SQLite索引')
+    parser.add_argument('--results', default='results', help='结果JSON目录')
+    parser.add_argument('--db', default=os.path.join('results', 'index.sqlite3'), help='索引数据库路径')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    index = ResultIndex(args.db)
+    imported = index.migrate_from_folder(args.results)
+    print(f"导入{imported}条，索引共{index.count()}条")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+异步结果持久化模块
+检测结果、可视化图像和掩码文件先进入内存待写表并立即返回，由后台线程写盘
+"""
+
+import os
+import time
+import queue
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class _WriteTask:
+    """单个待写文件"""
+
+    __slots__ = ('path', 'payload', 'encode', 'data')
+
+    def __init__(self, path: str, payload: Any, encode: Optional[Callable[[Any], bytes]]):
+        self.path = path
+        self.payload = payload
+        self.encode = encode
+        self.data = None
+
+    def to_bytes(self) -> bytes:
+        """编码为待写字节（只编码一次，读取待写内容时复用）"""
+        if self.data is None:
+            self.data = self.encode(self.payload) if self.encode else self.payload
+        return self.data
+
+
+class WriteBehindWriter:
+    """
+    后写式持久化器
+
+    submit 把写任务放入有界队列并登记到待写表后立即返回；后台线程编码并以
+    临时文件+原子重命名的方式落盘，写完才从待写表移除，读取方在此之前可以
+    直接从待写表拿到内容。队列满时调用方最多阻塞 block_timeout 秒，
+    仍然无空位则在调用线程中同步写入，以此形成背压。
+    """
+
+    def __init__(self, max_pending: int = 256, workers: int = 2,
+                 block_timeout: float = 1.0, enabled: bool = True):
+        """
+        初始化写入器
+
+        Args:
+            max_pending: 队列中最多排队的写任务数
+            workers: 后台写线程数
+            block_timeout: 队列满时提交方最长等待时间（秒）
+            enabled: False时所有写入同步完成
+        """
+        self.enabled = enabled
+        self.block_timeout = block_timeout
+        self._queue = queue.Queue(maxsize=max(1, max_pending))
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stats = {'submitted': 0, 'written': 0, 'failed': 0, 'sync_writes': 0}
+        self._workers = []
+        self._running = enabled
+        if enabled:
+            for i in range(max(1, workers)):
+                worker = threading.Thread(target=self._run, name=f'result-writer-{i}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def submit(self, path: str, payload: Any, encode: Optional[Callable[[Any], bytes]] = None):
+        """
+        提交写任务
+
+        Args:
+            path: 目标文件路径
+            payload: 待写内容；encode为None时必须是bytes
+            encode: 把payload编码为bytes的函数，在后台线程执行
+        """
+        task = _WriteTask(os.path.abspath(path), payload, encode)
+        with self._lock:
+            self._stats['submitted'] += 1
+            self._pending[task.path] = task
+
+        if self._running:
+            try:
+                self._queue.put(task, timeout=self.block_timeout)
+                return
+            except queue.Full:
+                logger.warning(f"写入队列已满，同步写入: {path}")
+
+        with self._lock:
+            self._stats['sync_writes'] += 1
+        self._write(task)
+
+    def get_pending(self, path: str) -> Optional[Any]:
+        """获取尚未落盘的原始内容，已写完或不存在时返回None"""
+        with self._lock:
+            task = self._pending.get(os.path.abspath(path))
+        return task.payload if task is not None else None
+
+    def get_pending_bytes(self, path: str) -> Optional[bytes]:
+        """获取尚未落盘的文件字节"""
+        with self._lock:
+            task = self._pending.get(os.path.abspath(path))
+        return task.to_bytes() if task is not None else None
+
+    def _write(self, task: _WriteTask):
+        """编码并原子写入文件"""
+        try:
+            data = task.to_bytes()
+            tmp_path = f"{task.path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, task.path)
+            with self._lock:
+                self._stats['written'] += 1
+        except Exception as e:
+            logger.error(f"后台写入失败 {task.path}: {e}")
+            with self._lock:
+                self._stats['failed'] += 1
+        finally:
+            with self._lock:
+                # 同一路径可能已被新任务覆盖，只移除自己
+                if self._pending.get(task.path) is task:
+                    del self._pending[task.path]
+
+    def _run(self):
+        """后台写循环"""
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                self._write(task)
+            finally:
+                self._queue.task_done()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待已提交的写任务全部落盘，返回是否在超时前完成"""
+        if not self._running:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def shutdown(self, timeout: Optional[float] = 30.0):
+        """刷新剩余写任务并停止后台线程"""
+        if not self._running:
+            return
+        if not self.flush(timeout):
+            logger.warning("关闭时仍有未完成的写入任务")
+        self._running = False
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout)
+
+    def get_stats(self) -> Dict:
+        """获取写入统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._pending)
+        stats['queue_depth'] = self._queue.qsize()
+        return stats
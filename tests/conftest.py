@@ -0,0 +1,9 @@
+"""
+pytest公共配置
+后端模块位于仓库根目录（平铺的顶层模块），测试前把根目录加入导入路径
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
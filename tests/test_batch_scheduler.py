@@ -0,0 +1,117 @@
+"""batch_scheduler 微批调度测试"""
+
+import threading
+import time
+
+import pytest
+
+from batch_scheduler import MicroBatchScheduler
+
+
+class RecordingBatchFn:
+    """记录每批载荷的批处理函数，结果为载荷的两倍"""
+
+    def __init__(self):
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def __call__(self, payloads):
+        with self.lock:
+            self.batches.append(list(payloads))
+        return [{'value': payload * 2} for payload in payloads]
+
+
+@pytest.fixture
+def make_scheduler():
+    schedulers = []
+
+    def factory(batch_fn, **kwargs):
+        scheduler = MicroBatchScheduler(batch_fn, **kwargs)
+        schedulers.append(scheduler)
+        return scheduler
+
+    yield factory
+    for scheduler in schedulers:
+        scheduler.shutdown()
+
+
+def test_batches_never_exceed_max_batch_size(make_scheduler):
+    batch_fn = RecordingBatchFn()
+    scheduler = make_scheduler(batch_fn, max_batch_size=4, max_wait_ms=300)
+    futures = [scheduler.submit(i) for i in range(10)]
+    results = [future.result(timeout=5) for future in futures]
+
+    assert [result['value'] for result, _ in results] == [i * 2 for i in range(10)]
+    assert all(len(batch) <= 4 for batch in batch_fn.batches)
+    assert sorted(p for batch in batch_fn.batches for p in batch) == list(range(10))
+    # 请求在等待窗口内全部到达，前两批凑满
+    assert [len(batch) for batch in batch_fn.batches] == [4, 4, 2]
+    assert [info['batch_size'] for _, info in results] == [4] * 8 + [2] * 2
+
+
+def test_partial_batch_flushes_after_max_wait(make_scheduler):
+    batch_fn = RecordingBatchFn()
+    scheduler = make_scheduler(batch_fn, max_batch_size=8, max_wait_ms=50)
+    start = time.perf_counter()
+    result = scheduler.predict(21, timeout=5)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    assert result['value'] == 42
+    assert result['batch_info']['batch_size'] == 1
+    # 未凑满的批次等满 max_wait_ms 后提交，而不是一直等待后续请求
+    assert 45 <= result['batch_info']['queue_wait_ms'] < 1000
+    assert elapsed_ms < 1000
+    assert batch_fn.batches == [[21]]
+
+
+def test_batch_exception_reaches_every_future(make_scheduler):
+    error = RuntimeError('推理失败')
+    calls = []
+
+    def failing_batch_fn(payloads):
+        calls.append(list(payloads))
+        raise error
+
+    scheduler = make_scheduler(failing_batch_fn, max_batch_size=3, max_wait_ms=300)
+    futures = [scheduler.submit(i) for i in range(3)]
+    for future in futures:
+        with pytest.raises(RuntimeError) as excinfo:
+            future.result(timeout=5)
+        assert excinfo.value is error
+    assert calls == [[0, 1, 2]]
+    assert scheduler.get_stats()['total_errors'] == 3
+
+
+def test_result_count_mismatch_fails_the_batch(make_scheduler):
+    scheduler = make_scheduler(lambda payloads: [{}], max_batch_size=2, max_wait_ms=300)
+    futures = [scheduler.submit(i) for i in range(2)]
+    for future in futures:
+        with pytest.raises(ValueError):
+            future.result(timeout=5)
+
+
+def test_submit_after_shutdown_is_rejected():
+    scheduler = MicroBatchScheduler(RecordingBatchFn(), max_wait_ms=1)
+    future = scheduler.submit(1)
+    scheduler.shutdown()
+    assert future.result(timeout=5)[0] == {'value': 2}
+    with pytest.raises(RuntimeError):
+        scheduler.submit(2)
+
+
+def test_exception_result_fails_only_its_request(make_scheduler):
+    error = ValueError('该版本推理失败')
+
+    def mixed_batch_fn(payloads):
+        return [error if payload % 2 else {'value': payload} for payload in payloads]
+
+    scheduler = make_scheduler(mixed_batch_fn, max_batch_size=4, max_wait_ms=300)
+    futures = [scheduler.submit(i) for i in range(4)]
+    for i, future in enumerate(futures):
+        if i % 2:
+            with pytest.raises(ValueError):
+                future.result(timeout=5)
+        else:
+            assert future.result(timeout=5)[0] == {'value': i}
+    stats = scheduler.get_stats()
+    assert stats['total_errors'] == 2 and stats['total_requests'] == 2
@@ -0,0 +1,114 @@
+"""image_decode 方向转正与降分辨率解码测试"""
+
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import mask_codec
+from image_decode import EXIF_ORIENTATION, ImageDecodeError, ImageDecoder, original_size
+from model_inference import LocalModelInference
+from preprocessing import identity_transform, native_transform
+
+
+def encode(image, fmt, orientation=None):
+    """把图像编码为内存文件，可选写入EXIF方向"""
+    buffer = io.BytesIO()
+    kwargs = {}
+    if orientation is not None:
+        exif = Image.Exif()
+        exif[EXIF_ORIENTATION] = orientation
+        kwargs['exif'] = exif.tobytes()
+    image.save(buffer, format=fmt, **kwargs)
+    buffer.seek(0)
+    return buffer
+
+
+def marked_image(width=400, height=200):
+    """左上角为红色块、其余为黑色的图像，用于判断转正方向"""
+    pixels = np.zeros((height, width, 3), dtype=np.uint8)
+    pixels[:height // 4, :width // 4] = (255, 0, 0)
+    return Image.fromarray(pixels)
+
+
+def red_corner(image):
+    """返回红色块所在的角：'tl' / 'tr' / 'bl' / 'br'"""
+    pixels = np.asarray(image.convert('RGB'), dtype=np.int32)
+    h, w = pixels.shape[:2]
+    corners = {'tl': pixels[h // 16, w // 16], 'tr': pixels[h // 16, -w // 16],
+               'bl': pixels[-h // 16, w // 16], 'br': pixels[-h // 16, -w // 16]}
+    return max(corners, key=lambda name: corners[name][0] - corners[name][1])
+
+
+@pytest.mark.parametrize('fmt', ['JPEG', 'PNG'])
+@pytest.mark.parametrize('orientation,size,corner', [
+    (1, (400, 200), 'tl'),
+    (3, (400, 200), 'br'),
+    (6, (200, 400), 'tr'),
+    (8, (200, 400), 'bl'),
+])
+def test_exif_orientation_is_applied(fmt, orientation, size, corner):
+    decoded = ImageDecoder().decode(encode(marked_image(), fmt, orientation))
+    assert decoded.mode == 'RGB'
+    assert decoded.size == size
+    assert original_size(decoded) == size
+    assert red_corner(decoded) == corner
+
+
+def test_reduce_keeps_at_least_min_size_and_records_original():
+    source = encode(marked_image(2048, 1024), 'PNG')
+    decoded = ImageDecoder().decode(source, min_size=(512, 256))
+    assert decoded.size == (512, 256)
+    assert original_size(decoded) == (2048, 1024)
+
+
+def test_jpeg_draft_decodes_smaller_image():
+    decoded = ImageDecoder().decode(encode(marked_image(2048, 1024), 'JPEG'), min_size=(300, 150))
+    assert 300 <= decoded.width < 2048 and 150 <= decoded.height < 1024
+    assert original_size(decoded) == (2048, 1024)
+
+
+def test_reduce_with_rotation_uses_upright_min_size():
+    # 方向6转正后为 1024x2048，目标尺寸按转正后的方向给出
+    decoded = ImageDecoder().decode(encode(marked_image(2048, 1024), 'PNG', 6), min_size=(256, 512))
+    assert decoded.size == (256, 512)
+    assert original_size(decoded) == (1024, 2048)
+    assert red_corner(decoded) == 'tr'
+
+
+def test_reduce_disabled_decodes_full_resolution():
+    decoded = ImageDecoder(reduce=False).decode(encode(marked_image(1024, 512), 'PNG'), min_size=(256, 128))
+    assert decoded.size == (1024, 512)
+
+
+def test_rejects_oversized_and_invalid_images():
+    with pytest.raises(ImageDecodeError):
+        ImageDecoder(max_pixels=1000).decode(encode(marked_image(100, 100), 'PNG'))
+    with pytest.raises(ImageDecodeError):
+        ImageDecoder().decode(io.BytesIO(b'not an image'))
+
+
+def test_reduced_decode_maps_native_boxes_and_masks_to_original():
+    # 模型直接在解码图像坐标系输出（torch路径）时，结果按原图坐标返回
+    decoded = ImageDecoder().decode(encode(marked_image(2048, 1024), 'PNG'), min_size=(512, 256))
+    assert decoded.size == (512, 256)
+    transform = native_transform(decoded)
+
+    model = LocalModelInference('/nonexistent/model', '/nonexistent/config.json')
+    masks = np.zeros((1, 1, 256, 512), dtype=np.float32)
+    masks[0, 0, 32:64, 128:256] = 1
+    result = model._parse_results({'boxes': np.array([[128, 32, 256, 64]], dtype=np.float32),
+                                   'scores': np.array([0.9], dtype=np.float32),
+                                   'labels': np.array([0]), 'masks': masks},
+                                  transform, {'confidence_threshold': 0.5, 'mask_format': 'rle'})
+    instance = result['results'][0]
+    assert instance['bbox'] == pytest.approx([512, 128, 1024, 256])
+    mask = mask_codec.decode_mask(instance['mask'])
+    assert mask.shape == (1024, 2048)
+    assert mask[128:256, 512:1024].all() and mask.sum() == 128 * 512
+
+
+def test_native_transform_is_identity_at_full_resolution():
+    decoded = ImageDecoder().decode(encode(marked_image(640, 480), 'PNG'))
+    assert native_transform(decoded) == identity_transform((640, 480))
@@ -0,0 +1,83 @@
+"""mask_codec 编解码往返测试"""
+
+import numpy as np
+import pytest
+
+import mask_codec
+
+
+def random_mask(shape=(37, 53), seed=0):
+    """在图像中部生成一块不规则前景，四周留有背景"""
+    rng = np.random.default_rng(seed)
+    mask = np.zeros(shape, dtype=bool)
+    mask[5:30, 8:45] = rng.uniform(0, 1, (25, 37)) > 0.4
+    return mask
+
+
+@pytest.mark.parametrize('mask_format', mask_codec.MASK_FORMATS)
+def test_encode_decode_roundtrip(mask_format):
+    mask = random_mask()
+    encoded = mask_codec.encode_mask(mask, mask_format)
+    decoded = mask_codec.decode_mask(encoded)
+    assert decoded.shape == mask.shape
+    assert decoded.dtype == bool
+    assert np.array_equal(decoded, mask)
+
+
+@pytest.mark.parametrize('mask_format', ['rle', 'bitpack'])
+def test_crop_formats_store_tight_bbox(mask_format):
+    mask = np.zeros((40, 60), dtype=bool)
+    mask[10:20, 30:35] = True
+    encoded = mask_codec.encode_mask(mask, mask_format)
+    assert encoded['size'] == [40, 60]
+    assert encoded['crop'] == [30, 10, 35, 20]
+    crop, bbox, size = mask_codec.decode_crop(encoded)
+    assert crop.shape == (10, 5) and crop.all()
+    assert bbox == (30, 10, 35, 20)
+    assert size == (40, 60)
+
+
+@pytest.mark.parametrize('mask_format', mask_codec.MASK_FORMATS)
+def test_empty_and_full_masks(mask_format):
+    empty = np.zeros((16, 24), dtype=bool)
+    full = np.ones((16, 24), dtype=bool)
+    assert np.array_equal(mask_codec.decode_mask(mask_codec.encode_mask(empty, mask_format)), empty)
+    assert np.array_equal(mask_codec.decode_mask(mask_codec.encode_mask(full, mask_format)), full)
+
+
+def test_rle_column_major_starts_with_background():
+    binary = np.array([[1, 0], [1, 1]], dtype=bool)
+    # 列优先展开为 1, 1, 0, 1：首个游程为长度0的背景
+    counts = mask_codec.rle_encode(binary)
+    assert counts == [0, 2, 1, 1]
+    assert np.array_equal(mask_codec.rle_decode(counts, binary.shape), binary)
+
+
+@pytest.mark.parametrize('mask_format', mask_codec.MASK_FORMATS)
+def test_encode_crop_matches_full_mask(mask_format):
+    mask = random_mask(seed=1)
+    x0, y0, x1, y1 = mask_codec.mask_bbox(mask)
+    encoded = mask_codec.encode_crop(mask[y0:y1, x0:x1], (x0, y0), (mask.shape[1], mask.shape[0]), mask_format)
+    assert np.array_equal(mask_codec.decode_mask(encoded), mask)
+
+
+@pytest.mark.parametrize('source', mask_codec.MASK_FORMATS)
+@pytest.mark.parametrize('target', mask_codec.MASK_FORMATS)
+def test_transcode_preserves_mask(source, target):
+    mask = random_mask(seed=2)
+    encoded = mask_codec.transcode(mask_codec.encode_mask(mask, source), target)
+    assert isinstance(encoded, str) == (target == 'png')
+    assert np.array_equal(mask_codec.decode_mask(encoded), mask)
+
+
+def test_unknown_format_falls_back_to_default():
+    assert mask_codec.normalize_format('jpeg') == mask_codec.DEFAULT_MASK_FORMAT
+    assert mask_codec.normalize_format(None) == mask_codec.DEFAULT_MASK_FORMAT
+    with pytest.raises(ValueError):
+        mask_codec.decode_crop({'format': 'jpeg', 'size': [1, 1], 'crop': [0, 0, 1, 1]})
+
+
+def test_default_format_is_png_string():
+    # 现有API客户端与前端页面只解码base64 PNG，紧凑格式须显式选择
+    assert mask_codec.DEFAULT_MASK_FORMAT == 'png'
+    assert isinstance(mask_codec.encode_mask(random_mask()), str)
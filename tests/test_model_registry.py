@@ -0,0 +1,96 @@
+"""model_registry 切换、排空与回滚测试"""
+
+import time
+
+import pytest
+
+from model_registry import ModelRegistry, ModelVersionError
+
+
+class FakeModel:
+    model_type = 'fake'
+
+    def __init__(self, name):
+        self.name = name
+        self.released = False
+
+    def model_fingerprint(self):
+        return self.name
+
+    def warmup(self, batch_sizes):
+        pass
+
+    def shutdown(self):
+        self.released = True
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('等待超时')
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def registry():
+    registry = ModelRegistry(lambda path, config: FakeModel(path), warmup_batch_sizes=(), drain_timeout=0.05)
+    yield registry
+    registry.shutdown()
+
+
+def test_switch_keeps_old_model_until_inflight_requests_finish(registry):
+    v1 = registry.register('v1', FakeModel('v1'), activate=True)
+    model = v1.model
+    lease = registry.acquire()
+    registry.register('v2', FakeModel('v2'), activate=True)
+
+    assert registry.active.name == 'v2'
+    assert v1.state == 'draining'
+    time.sleep(0.2)
+    # 超过drain_timeout仍有在途请求，模型不能释放
+    assert v1.model is model and not model.released
+
+    registry.release(lease, 1.0)
+    wait_for(lambda: v1.state == 'retired')
+    assert model.released and v1.model is None
+
+
+def test_draining_version_can_be_rolled_back(registry):
+    v1 = registry.register('v1', FakeModel('v1'), activate=True)
+    model = v1.model
+    lease = registry.acquire()
+    v2 = registry.register('v2', FakeModel('v2'), activate=True)
+    assert v1.state == 'draining'
+
+    registry.activate('v1')
+    assert registry.active is v1 and v1.state == 'active'
+    # v2没有在途请求，立即排空释放
+    wait_for(lambda: v2.state == 'retired')
+
+    registry.release(lease, 1.0)
+    time.sleep(0.1)
+    # 回滚取消了v1的排空，模型仍在服务
+    assert v1.state == 'active' and v1.model is model and not model.released
+    assert registry.acquire() is v1
+
+
+def test_unload_takes_over_a_running_drain(registry):
+    v1 = registry.register('v1', FakeModel('v1'), activate=True)
+    lease = registry.acquire()
+    registry.register('v2', FakeModel('v2'), activate=True)
+
+    registry.unload('v1')
+    registry.release(lease, 1.0)
+    wait_for(lambda: registry.get('v1') is None)
+    assert v1.state == 'retired'
+    with pytest.raises(ModelVersionError):
+        registry.activate('v1')
+
+
+def test_released_version_cannot_be_activated(registry):
+    v1 = registry.register('v1', FakeModel('v1'), activate=True)
+    registry.register('v2', FakeModel('v2'), activate=True)
+    wait_for(lambda: v1.state == 'retired')
+    with pytest.raises(ModelVersionError):
+        registry.activate('v1')
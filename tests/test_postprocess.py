@@ -0,0 +1,131 @@
+"""
+postprocess 测试
+向量化NMS与逐对比较的旧循环实现在随机候选上保留完全相同的框
+"""
+
+import numpy as np
+import pytest
+
+from postprocess import PostProcessor, nms, batched_nms, mask_nms
+
+
+def make_candidates(count, num_classes=2, seed=0):
+    """成簇分布的随机候选框（大量相互重叠）"""
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(40, 472, (max(1, count // 20), 2))
+    picks = centers[rng.integers(0, len(centers), count)] + rng.normal(0, 6, (count, 2))
+    sizes = rng.uniform(20, 80, (count, 2))
+    boxes = np.concatenate([picks - sizes / 2, picks + sizes / 2], axis=1).astype(np.float32)
+    scores = rng.uniform(0, 1, count).astype(np.float32)
+    labels = rng.integers(0, num_classes, count)
+    return np.clip(boxes, 0, 512), scores, labels
+
+
+def legacy_nms(boxes, scores, iou_threshold, labels=None):
+    """旧版逐对比较的NMS循环；给定labels时只在同类别之间抑制"""
+    order = sorted(range(len(scores)), key=lambda i: -scores[i])
+    suppressed = [False] * len(order)
+    keep = []
+    for a, i in enumerate(order):
+        if suppressed[a]:
+            continue
+        keep.append(i)
+        for b in range(a + 1, len(order)):
+            j = order[b]
+            if suppressed[b] or (labels is not None and labels[i] != labels[j]):
+                continue
+            xx1, yy1 = max(boxes[i][0], boxes[j][0]), max(boxes[i][1], boxes[j][1])
+            xx2, yy2 = min(boxes[i][2], boxes[j][2]), min(boxes[i][3], boxes[j][3])
+            inter = max(0.0, xx2 - xx1) * max(0.0, yy2 - yy1)
+            area_i = (boxes[i][2] - boxes[i][0]) * (boxes[i][3] - boxes[i][1])
+            area_j = (boxes[j][2] - boxes[j][0]) * (boxes[j][3] - boxes[j][1])
+            if inter / max(area_i + area_j - inter, 1e-9) > iou_threshold:
+                suppressed[b] = True
+    return keep
+
+
+def legacy_mask_nms(masks, scores, labels, iou_threshold):
+    """旧版逐对计算整幅掩码IoU的NMS"""
+    order = sorted(range(len(scores)), key=lambda i: -scores[i])
+    suppressed = [False] * len(order)
+    keep = []
+    for a, i in enumerate(order):
+        if suppressed[a]:
+            continue
+        keep.append(i)
+        for b in range(a + 1, len(order)):
+            j = order[b]
+            if suppressed[b] or labels[i] != labels[j]:
+                continue
+            inter = np.logical_and(masks[i], masks[j]).sum()
+            union = masks[i].sum() + masks[j].sum() - inter
+            if inter / max(union, 1e-9) > iou_threshold:
+                suppressed[b] = True
+    return keep
+
+
+def ellipse_masks(boxes, size=128, input_size=512):
+    """按边界框生成覆盖整个模型输入的椭圆掩码"""
+    ratio = size / input_size
+    ys, xs = np.mgrid[0:size, 0:size]
+    masks = np.zeros((len(boxes), size, size), dtype=bool)
+    for i, (x1, y1, x2, y2) in enumerate(boxes * ratio):
+        cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+        rx, ry = max((x2 - x1) / 2, 1), max((y2 - y1) / 2, 1)
+        masks[i] = ((xs - cx) / rx) ** 2 + ((ys - cy) / ry) ** 2 <= 1
+    return masks
+
+
+@pytest.mark.parametrize('iou', [0.3, 0.5, 0.7])
+def test_nms_matches_legacy_loop(iou):
+    boxes, scores, _ = make_candidates(400, seed=int(iou * 10))
+    keep = nms(boxes, scores, iou)
+    assert keep.tolist() == legacy_nms(boxes.tolist(), scores.tolist(), iou)
+
+
+@pytest.mark.parametrize('iou', [0.3, 0.5])
+def test_batched_nms_matches_per_class_loop(iou):
+    boxes, scores, labels = make_candidates(400, num_classes=3, seed=3)
+    keep = batched_nms(boxes, scores, labels, iou)
+    assert keep.tolist() == legacy_nms(boxes.tolist(), scores.tolist(), iou, labels.tolist())
+
+
+def test_nms_threshold_one_keeps_everything_in_score_order():
+    boxes, scores, _ = make_candidates(50)
+    keep = nms(boxes, scores, 1.0)
+    assert sorted(keep.tolist()) == list(range(50))
+    assert np.all(np.diff(scores[keep]) <= 0)
+
+
+def test_mask_nms_matches_legacy_loop():
+    boxes, scores, labels = make_candidates(120, seed=5)
+    masks = ellipse_masks(boxes)
+    keep = mask_nms(masks, boxes * (128 / 512), scores, labels, 0.5)
+    assert keep.tolist() == legacy_mask_nms(masks, scores.tolist(), labels.tolist(), 0.5)
+
+
+def test_select_equals_threshold_then_legacy_nms():
+    boxes, scores, labels = make_candidates(600, seed=7)
+    processor = PostProcessor(pre_nms_top_k=0, max_detections=0)
+    selected = processor.select(boxes, scores, labels, confidence_threshold=0.4, nms_threshold=0.5)
+
+    candidates = [i for i in range(len(scores)) if scores[i] > 0.4]
+    kept = legacy_nms([boxes[i].tolist() for i in candidates], [float(scores[i]) for i in candidates],
+                      0.5, [int(labels[i]) for i in candidates])
+    assert selected.tolist() == [candidates[k] for k in kept]
+
+
+def test_select_applies_top_k_and_max_detections():
+    boxes, scores, labels = make_candidates(600, seed=8)
+    processor = PostProcessor(pre_nms_top_k=50, max_detections=10)
+    selected = processor.select(boxes, scores, labels, confidence_threshold=0.0, nms_threshold=0.5)
+    assert len(selected) <= 10
+    # 预截断只保留得分最高的50个候选
+    assert scores[selected].min() >= np.sort(scores)[-50]
+    assert np.all(np.diff(scores[selected]) <= 0)
+
+
+def test_select_without_candidates_returns_empty():
+    boxes, scores, labels = make_candidates(20)
+    selected = PostProcessor().select(boxes, scores, labels, confidence_threshold=1.0, nms_threshold=0.5)
+    assert selected.size == 0
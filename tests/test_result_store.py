@@ -0,0 +1,90 @@
+"""result_store 查询、分页与旧结果目录导入测试"""
+
+import json
+
+import pytest
+
+from result_store import ResultIndex, decode_cursor, encode_cursor
+
+
+def make_result(index, severity='轻度', detected=True, day=1):
+    return {
+        'id': f"r{index:03d}",
+        'timestamp': f"2024-01-{day:02d}T10:00:{index % 60:02d}",
+        'filename': f"{index}.png",
+        'result': {
+            'disease_detected': detected,
+            'severity': severity,
+            'total_instances': index % 5,
+            'confidence': 0.9
+        }
+    }
+
+
+@pytest.fixture
+def index(tmp_path):
+    return ResultIndex(str(tmp_path / 'index.sqlite3'))
+
+
+def test_cursor_roundtrip():
+    assert decode_cursor(encode_cursor('2024-01-01T10:00:00', 'a|b')) == ('2024-01-01T10:00:00', 'a|b')
+
+
+def test_query_pages_in_time_order(index):
+    index.add_many([make_result(i) for i in range(25)])
+    assert index.count() == 25
+
+    seen, cursor = [], None
+    while True:
+        items, cursor = index.query(limit=10, cursor=cursor)
+        seen.extend(item['id'] for item in items)
+        if cursor is None:
+            break
+    assert seen == [f"r{i:03d}" for i in reversed(range(25))]
+
+
+def test_query_filters(index):
+    index.add_many([make_result(1, '轻度', True, day=1), make_result(2, '重度', True, day=2),
+                    make_result(3, '正常', False, day=3), make_result(4, '重度', True, day=4)])
+
+    items, _ = index.query(severity=['重度'])
+    assert [item['id'] for item in items] == ['r004', 'r002']
+
+    items, _ = index.query(disease_detected=False)
+    assert [item['id'] for item in items] == ['r003']
+    assert items[0]['disease_detected'] is False
+
+    # 只给日期的结束时间包含当天全部
+    items, _ = index.query(start='2024-01-02', end='2024-01-03')
+    assert [item['id'] for item in items] == ['r003', 'r002']
+
+
+def test_add_replaces_existing_summary(index):
+    index.add(make_result(1, '轻度'))
+    index.add(make_result(1, '重度'))
+    items, _ = index.query()
+    assert index.count() == 1
+    assert items[0]['severity'] == '重度'
+
+
+def test_migrate_from_folder_skips_invalid_files(tmp_path, index):
+    folder = tmp_path / 'results'
+    folder.mkdir()
+    for i in range(5):
+        (folder / f"r{i:03d}.json").write_text(json.dumps(make_result(i)), encoding='utf-8')
+    (folder / 'broken.json').write_text('{not json', encoding='utf-8')
+    (folder / 'no_id.json').write_text(json.dumps({'timestamp': '2024-01-01T00:00:00'}), encoding='utf-8')
+    (folder / 'notes.txt').write_text('ignored', encoding='utf-8')
+
+    assert index.migrate_from_folder(str(folder), batch_size=2) == 5
+    assert index.count() == 5
+    assert index.is_migrated()
+    # 已导入后不再重复扫描
+    (folder / 'r100.json').write_text(json.dumps(make_result(100)), encoding='utf-8')
+    assert index.migrate_from_folder(str(folder)) == 0
+    assert index.count() == 5
+
+
+def test_migrate_missing_folder_marks_done(tmp_path, index):
+    assert index.migrate_from_folder(str(tmp_path / 'missing')) == 0
+    assert index.is_migrated()
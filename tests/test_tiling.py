@@ -0,0 +1,125 @@
+"""tiling 窗口规划与跨窗口合并测试"""
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from preprocessing import ImagePreprocessor, PreparedImage
+from tiling import TiledInference, greedy_merge, plan_tiles
+
+
+def identity(size):
+    """窗口按原分辨率推理时的预处理变换"""
+    return {'original_size': size, 'input_size': size, 'content_size': size,
+            'scale_x': 1.0, 'scale_y': 1.0, 'pad_x': 0, 'pad_y': 0}
+
+
+def candidates(boxes, scores, labels, masks=None, size=(100, 100)):
+    return {'candidates': {
+        'boxes': np.asarray(boxes, dtype=np.float32).reshape(-1, 4),
+        'scores': np.asarray(scores, dtype=np.float32),
+        'labels': np.asarray(labels, dtype=np.int64),
+        'masks': masks,
+        'transform': identity(size)
+    }}
+
+
+@pytest.mark.parametrize('size,tile,overlap', [
+    ((1000, 600), (256, 256), 0.2),
+    ((3000, 1500), (512, 512), 0.25),
+    ((513, 512), (512, 512), 0.5),
+])
+def test_plan_tiles_covers_image_with_overlap(size, tile, overlap):
+    tiles = plan_tiles(size, tile, overlap)
+    covered = np.zeros((size[1], size[0]), dtype=bool)
+    for x0, y0, x1, y1 in tiles:
+        assert (x1 - x0, y1 - y0) == tile
+        assert 0 <= x0 and x1 <= size[0] and 0 <= y0 and y1 <= size[1]
+        covered[y0:y1, x0:x1] = True
+    assert covered.all()
+    # 行优先排列，最后一个窗口与右下角对齐
+    assert tiles == sorted(tiles, key=lambda t: (t[1], t[0]))
+    assert tiles[-1][2:] == size
+    xs = sorted({t[0] for t in tiles})
+    assert all(b - a <= int(tile[0] * (1 - overlap)) for a, b in zip(xs, xs[1:]))
+
+
+def test_plan_tiles_small_image_is_single_window():
+    assert plan_tiles((300, 200), (512, 512), 0.2) == [(0, 0, 300, 200)]
+
+
+def test_windows_respects_max_tiles_and_adds_full_image():
+    tiler = TiledInference((256, 256), overlap=0.2, max_tiles=4, include_full_image=True)
+    windows = tiler.windows((2000, 1000))
+    assert windows[-1] == (0, 0, 2000, 1000)
+    assert len(windows) - 1 <= 4
+
+
+def test_from_config_disabled_and_defaults():
+    assert TiledInference.from_config({}, (512, 512)) is None
+    tiler = TiledInference.from_config({'tiling': {'enabled': True, 'tile_size': 384}}, (512, 512))
+    assert tiler.tile_size == (384, 384)
+    assert tiler.min_size == 1024
+    assert tiler.should_tile((1024, 600)) and not tiler.should_tile((900, 600))
+    assert tiler.should_tile((300, 300), {'tiling': True})
+
+
+def test_greedy_merge_groups_duplicates_and_cut_fragments():
+    boxes = np.array([
+        [10, 10, 50, 50],     # 窗口0
+        [12, 11, 51, 50],     # 窗口1中的重复检测
+        [90, 10, 100, 40],    # 窗口0中被边界截断的片段
+        [90, 10, 130, 40],    # 窗口1中的完整目标
+        [90, 10, 130, 40],    # 同位置的另一类别
+    ], dtype=np.float32)
+    scores = np.array([0.9, 0.8, 0.6, 0.7, 0.5], dtype=np.float32)
+    labels = np.array([0, 0, 0, 0, 1])
+    sources = np.array([0, 1, 0, 1, 1])
+    groups = greedy_merge(boxes, scores, labels, sources, nms_threshold=0.5, merge_threshold=0.6)
+    assert groups == [[0, 1], [3, 2], [4]]
+
+
+def test_merge_maps_windows_back_and_unions_masks():
+    tiler = TiledInference((100, 100), overlap=0.2, include_full_image=False, max_detections=10)
+    windows = [(0, 0, 100, 100), (80, 0, 180, 100)]
+    # 同一目标横跨两个窗口：窗口0中只剩被边界截断的左侧片段，窗口1中是完整目标
+    left_mask = np.zeros((1, 100, 100), dtype=np.float32)
+    left_mask[0, 20:40, 85:100] = 1
+    right_mask = np.zeros((1, 100, 100), dtype=np.float32)
+    right_mask[0, 20:40, 5:40] = 1
+    outputs = [candidates([[85, 20, 100, 40]], [0.9], [1], left_mask),
+               candidates([[5, 20, 40, 40]], [0.8], [1], right_mask)]
+
+    merged = tiler._merge_image((180, 100), windows, outputs, nms_threshold=0.5)
+    assert merged['tiled'] and merged['tiles'] == 2
+    assert merged['boxes'].tolist() == [[85, 20, 120, 40]]
+    assert merged['scores'].tolist() == pytest.approx([0.9])
+    assert merged['labels'].tolist() == [1]
+    crop, offset = merged['masks'][0]
+    assert offset == (85, 20)
+    assert crop.shape == (20, 35) and crop.all()
+
+
+def test_merge_passes_through_untiled_and_fallback_results():
+    tiler = TiledInference((100, 100))
+    plain = {'results': []}
+    fallback = {'results': [], 'fallback': True}
+    merged = tiler.merge([None, None], [{}, {}], [plain, fallback, fallback],
+                         [(0, None), (1, [(0, 0, 100, 100), (50, 0, 150, 100)])])
+    assert merged == [plain, fallback]
+
+
+def test_expand_windows_use_their_own_size():
+    # 解码器在info中记录整图尺寸，窗口的几何变换必须按窗口尺寸计算
+    image = Image.new('RGB', (2000, 1000))
+    image.info['original_size'] = (2000, 1000)
+    prepared = PreparedImage(image, ImagePreprocessor((512, 512)))
+    tiler = TiledInference((512, 512), min_size=1024, include_full_image=True)
+    entries, entry_options, layout = tiler.expand([prepared], [{}])
+
+    start, windows = layout[0]
+    assert start == 0 and len(entries) == len(windows)
+    for entry, window in zip(entries, windows):
+        assert entry.original_size == (window[2] - window[0], window[3] - window[1])
+    assert entries[-1] is prepared
+    assert all(opts['tile_candidates'] for opts in entry_options)
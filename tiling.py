@@ -0,0 +1,332 @@
+"""
+分块（滑动窗口）推理模块
+大尺寸图像（全景片、裂隙灯照片等）整体缩放到模型输入尺寸后，小病灶只剩几个像素。
+分块模式把原图切成相互重叠的窗口，每个窗口按原分辨率（或接近原分辨率）送入模型，
+同一张图像的所有窗口作为一个批次推理，再把各窗口的检测结果映射回原图坐标，
+经跨窗口合并（同一目标在重叠区的重复检测、被窗口边界截断的目标片段）得到最终实例
+"""
+
+import math
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import metrics
+from preprocessing import PreparedImage
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+def _axis_starts(length: int, tile: int, overlap: float) -> List[int]:
+    """单个方向上的窗口起点：步长为 tile × (1 - overlap)，最后一个窗口与图像边缘对齐"""
+    if length <= tile:
+        return [0]
+    stride = max(1, int(tile * (1 - overlap)))
+    count = math.ceil((length - tile) / stride) + 1
+    starts = [min(i * stride, length - tile) for i in range(count)]
+    return sorted(set(starts))
+
+
+def plan_tiles(image_size: Tuple[int, int], tile_size: Tuple[int, int],
+               overlap: float) -> List[Tuple[int, int, int, int]]:
+    """
+    计算覆盖整幅图像的窗口
+
+    Returns:
+        窗口列表 [(x0, y0, x1, y1)]，按行优先排列
+    """
+    width, height = image_size
+    tile_w, tile_h = min(tile_size[0], width), min(tile_size[1], height)
+    return [(x, y, x + tile_w, y + tile_h)
+            for y in _axis_starts(height, tile_h, overlap)
+            for x in _axis_starts(width, tile_w, overlap)]
+
+
+def intersection_over_smaller(box: np.ndarray, boxes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """一个框与一组框的 (IoU, 交集/较小框面积)"""
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    iou = inter / np.maximum(area + areas - inter, 1e-6)
+    ios = inter / np.maximum(np.minimum(area, areas), 1e-6)
+    return iou, ios
+
+
+def greedy_merge(boxes: np.ndarray, scores: np.ndarray, labels: np.ndarray, sources: np.ndarray,
+                 nms_threshold: float, merge_threshold: float, class_agnostic: bool = False) -> List[List[int]]:
+    """
+    跨窗口贪心合并
+
+    按得分从高到低，把与当前候选同类别且满足以下任一条件的候选并入同一组：
+        - IoU 超过 nms_threshold（重叠区域内的重复检测）
+        - 来自不同窗口，且交集占较小框的比例超过 merge_threshold（被窗口边界截断的片段）
+
+    Returns:
+        分组列表，每组第一个下标为得分最高的候选
+    """
+    order = np.argsort(-scores, kind='stable')
+    assigned = np.zeros(len(scores), dtype=bool)
+    groups = []
+    for i in order:
+        if assigned[i]:
+            continue
+        assigned[i] = True
+        rest = order[~assigned[order]]
+        if not class_agnostic:
+            rest = rest[labels[rest] == labels[i]]
+        group = [int(i)]
+        if rest.size:
+            iou, ios = intersection_over_smaller(boxes[i], boxes[rest])
+            matched = rest[(iou > nms_threshold) | ((ios > merge_threshold) & (sources[rest] != sources[i]))]
+            assigned[matched] = True
+            group.extend(int(j) for j in matched)
+        groups.append(group)
+    return groups
+
+
+def mask_crop(mask: np.ndarray, transform: Dict, offset: Tuple[int, int],
+              region: Tuple[int, int, int, int], threshold: float) -> np.ndarray:
+    """
+    把某个窗口的模型输出掩码重采样到原图坐标系的 region 区域（最近邻）
+
+    Args:
+        mask: (h, w) 窗口模型输出掩码
+        transform: 该窗口的预处理几何变换（窗口坐标系）
+        offset: 窗口在原图中的左上角坐标
+        region: 原图坐标系的输出区域 (x0, y0, x1, y1)
+
+    Returns:
+        形状为 (y1 - y0, x1 - x0) 的布尔数组，窗口以外的部分为False
+    """
+    x0, y0, x1, y1 = region
+    tile_w, tile_h = transform['original_size']
+    input_w, input_h = transform['input_size']
+    xs = np.arange(x0, x1) - offset[0]
+    ys = np.arange(y0, y1) - offset[1]
+    valid_x = (xs >= 0) & (xs < tile_w)
+    valid_y = (ys >= 0) & (ys < tile_h)
+    out = np.zeros((y1 - y0, x1 - x0), dtype=bool)
+    if not valid_x.any() or not valid_y.any():
+        return out
+    src_x = ((xs[valid_x] + 0.5) * transform['scale_x'] + transform['pad_x']) * mask.shape[1] / input_w
+    src_y = ((ys[valid_y] + 0.5) * transform['scale_y'] + transform['pad_y']) * mask.shape[0] / input_h
+    src_x = np.clip(src_x.astype(np.int64), 0, mask.shape[1] - 1)
+    src_y = np.clip(src_y.astype(np.int64), 0, mask.shape[0] - 1)
+    out[np.ix_(valid_y, valid_x)] = mask[src_y[:, None], src_x[None, :]] > threshold
+    return out
+
+
+class TiledInference:
+    """
+    分块推理规划与结果合并
+
+    使用方式（由 LocalModelInference / InferencePool 调用）:
+        tiler = TiledInference.from_config(config, input_size)
+        results = tiler.run(images, options, predict, finalize)
+
+    分块条目的 options 带 tile_candidates=True，模型只返回该窗口保留的候选（不编码掩码）；
+    分块图像不保留原始输出（keep_raw），调整阈值时按原图重新推理
+    """
+
+    def __init__(self, tile_size: Tuple[int, int], overlap: float = 0.2, min_size: int = 1024,
+                 max_tiles: int = 16, include_full_image: bool = True, merge_threshold: float = 0.6,
+                 batch_size: int = 32, class_agnostic: bool = False, max_detections: int = 100,
+                 mask_threshold: float = 0.5):
+        """
+        初始化
+
+        Args:
+            tile_size: 窗口尺寸 (宽, 高)，原图像素；缺省为模型输入尺寸，即窗口以原分辨率推理
+            overlap: 相邻窗口的重叠比例
+            min_size: 长边不小于该值的图像才分块，较小的图像仍整体缩放
+            max_tiles: 单张图像最多窗口数，超出时等比放大窗口
+            include_full_image: 是否额外推理整图缩放视图，用于检出跨越多个窗口的大目标
+            merge_threshold: 跨窗口片段合并的交集/较小框面积阈值
+            batch_size: 单次前向的最大窗口数（多张大图同批时分段推理）
+            class_agnostic: 合并时是否忽略类别
+            max_detections: 合并后每张图像最多保留的实例数
+            mask_threshold: 掩码二值化阈值
+        """
+        self.tile_size = (int(tile_size[0]), int(tile_size[1]))
+        self.overlap = min(max(float(overlap), 0.0), 0.9)
+        self.min_size = int(min_size)
+        self.max_tiles = max(1, int(max_tiles))
+        self.include_full_image = include_full_image
+        self.merge_threshold = merge_threshold
+        self.batch_size = max(1, int(batch_size))
+        self.class_agnostic = class_agnostic
+        self.max_detections = max_detections
+        self.mask_threshold = mask_threshold
+
+    @classmethod
+    def from_config(cls, config: dict, input_size: Tuple[int, int]) -> Optional['TiledInference']:
+        """根据模型配置的 tiling 段创建，未启用时返回None"""
+        options = config.get('tiling', {})
+        if not options.get('enabled', False):
+            return None
+        tile_size = options.get('tile_size', input_size)
+        if isinstance(tile_size, (int, float)):
+            tile_size = (tile_size, tile_size)
+        postprocess = config.get('postprocess', {})
+        return cls(
+            tile_size,
+            overlap=options.get('overlap', 0.2),
+            min_size=options.get('min_size', 2 * max(input_size)),
+            max_tiles=options.get('max_tiles', 16),
+            include_full_image=options.get('include_full_image', True),
+            merge_threshold=options.get('merge_threshold', 0.6),
+            batch_size=options.get('batch_size', 32),
+            class_agnostic=postprocess.get('class_agnostic', False),
+            max_detections=postprocess.get('max_detections', 100),
+            mask_threshold=config.get('mask_threshold', 0.5)
+        )
+
+    def should_tile(self, image_size: Tuple[int, int], options: Optional[Dict] = None) -> bool:
+        """是否对该图像分块；请求参数 tiling 为True/False时强制开启/关闭"""
+        forced = (options or {}).get('tiling')
+        if forced is not None:
+            return bool(forced)
+        return max(image_size) >= self.min_size
+
+    def windows(self, image_size: Tuple[int, int]) -> List[Tuple[int, int, int, int]]:
+        """图像的窗口列表；窗口数超过 max_tiles 时等比放大窗口直到满足上限"""
+        tile_w, tile_h = self.tile_size
+        tiles = plan_tiles(image_size, (tile_w, tile_h), self.overlap)
+        while len(tiles) > self.max_tiles:
+            tile_w, tile_h = int(tile_w * 1.25) + 1, int(tile_h * 1.25) + 1
+            tiles = plan_tiles(image_size, (tile_w, tile_h), self.overlap)
+        if self.include_full_image and len(tiles) > 1:
+            tiles.append((0, 0, image_size[0], image_size[1]))
+        return tiles
+
+    def expand(self, images: Sequence[PreparedImage], options: List[Dict]):
+        """
+        把需要分块的图像展开为窗口条目
+
+        Returns:
+            (entries, entry_options, layout)：entries 为送入模型的PreparedImage列表，
+            layout[i] 为第i张图像的 (起始条目下标, 窗口列表)，不分块的图像窗口列表为None
+        """
+        entries, entry_options, layout = [], [], []
+        for image, opts in zip(images, options):
+            # draft解码已缩小过的图像无法再按原分辨率切块
+            if not self.should_tile(image.original_size, opts) or image.image.size != image.original_size:
+                layout.append((len(entries), None))
+                entries.append(image)
+                entry_options.append(opts)
+                continue
+            image.image.load()
+            windows = self.windows(image.original_size)
+            tile_opts = dict(opts, tile_candidates=True, keep_raw=False)
+            layout.append((len(entries), windows))
+            for window in windows:
+                if window == (0, 0) + tuple(image.original_size):
+                    entries.append(image)
+                else:
+                    # crop会复制info，需去掉整图的original_size，否则窗口按整图尺寸计算变换
+                    tile = image.image.crop(window)
+                    tile.info.pop('original_size', None)
+                    entries.append(PreparedImage(tile, image.preprocessor))
+                entry_options.append(tile_opts)
+        return entries, entry_options, layout
+
+    def run(self, images: Sequence[PreparedImage], options: List[Dict], predict, finalize) -> List[Dict]:
+        """
+        分块推理入口
+
+        Args:
+            predict: predict(entries, entry_options) -> 输出列表，对一批条目做一次前向
+            finalize: finalize(合并结果, image, options) -> 检测结果，编码掩码并生成实例
+        """
+        entries, entry_options, layout = self.expand(images, options)
+        if all(windows is None for _, windows in layout):
+            return predict(images, options)
+        outputs = []
+        for start in range(0, len(entries), self.batch_size):
+            end = start + self.batch_size
+            outputs.extend(predict(entries[start:end], entry_options[start:end]))
+        with metrics.span('tile_merge'):
+            merged = self.merge(images, options, outputs, layout)
+            return [finalize(result, image, opts) if result.get('tiled') else result
+                    for result, image, opts in zip(merged, images, options)]
+
+    def merge(self, images: Sequence[PreparedImage], options: List[Dict], outputs: List[Dict],
+              layout: List) -> List[Dict]:
+        """
+        合并各窗口的候选
+
+        Returns:
+            与images对应的列表；不分块的图像为模型原结果，分块的图像为
+            {'tiled': True, 'boxes', 'scores', 'labels', 'masks': [(布尔裁剪, (x0, y0)) 或 None], 'tiles'}
+        """
+        merged = []
+        for image, opts, (start, windows) in zip(images, options, layout):
+            if windows is None:
+                merged.append(outputs[start])
+                continue
+            tile_outputs = outputs[start:start + len(windows)]
+            # 推理失败回退为模拟结果时没有候选，直接返回该结果
+            fallback = next((out for out in tile_outputs if 'candidates' not in out), None)
+            if fallback is not None:
+                merged.append(fallback)
+                continue
+            merged.append(self._merge_image(image.original_size, windows, tile_outputs,
+                                            float(opts.get('nms_threshold', 0.5))))
+        return merged
+
+    def _merge_image(self, image_size, windows, tile_outputs, nms_threshold) -> Dict:
+        boxes, scores, labels, sources, members = [], [], [], [], []
+        for source, (window, output) in enumerate(zip(windows, tile_outputs)):
+            candidates = output['candidates']
+            count = len(candidates['scores'])
+            if count == 0:
+                continue
+            offset = np.array([window[0], window[1]] * 2, dtype=np.float32)
+            boxes.append(candidates['boxes'] + offset)
+            scores.append(candidates['scores'])
+            labels.append(np.asarray(candidates['labels']).reshape(-1)[:count])
+            sources.append(np.full(count, source))
+            masks = candidates.get('masks')
+            for k in range(count):
+                members.append((masks[k] if masks is not None else None, candidates['transform'], window[:2]))
+
+        result = {'tiled': True, 'tiles': len(windows), 'boxes': np.zeros((0, 4), dtype=np.float32),
+                  'scores': np.zeros(0, dtype=np.float32), 'labels': np.zeros(0, dtype=np.int64), 'masks': []}
+        if not boxes:
+            return result
+        boxes, scores = np.concatenate(boxes), np.concatenate(scores)
+        labels, sources = np.concatenate(labels), np.concatenate(sources)
+        groups = greedy_merge(boxes, scores, labels, sources, nms_threshold,
+                              self.merge_threshold, self.class_agnostic)
+        if self.max_detections > 0:
+            groups = groups[:self.max_detections]
+
+        width, height = image_size
+        merged_boxes, masks = [], []
+        for group in groups:
+            # 合并后的框为组内所有框的并集
+            box = np.concatenate([boxes[group, :2].min(axis=0), boxes[group, 2:].max(axis=0)])
+            np.clip(box[0::2], 0, width, out=box[0::2])
+            np.clip(box[1::2], 0, height, out=box[1::2])
+            merged_boxes.append(box)
+            if members[group[0]][0] is None:
+                masks.append(None)
+                continue
+            region = (int(np.floor(box[0])), int(np.floor(box[1])), int(np.ceil(box[2])), int(np.ceil(box[3])))
+            crop = np.zeros((region[3] - region[1], region[2] - region[0]), dtype=bool)
+            for index in group:
+                mask, transform, offset = members[index]
+                if mask is not None:
+                    mask = np.asarray(mask)
+                    crop |= mask_crop(mask.reshape(mask.shape[-2:]), transform, offset, region, self.mask_threshold)
+            masks.append((crop, region[:2]))
+        first = [group[0] for group in groups]
+        result.update(boxes=np.asarray(merged_boxes, dtype=np.float32), scores=scores[first],
+                      labels=labels[first], masks=masks)
+        return result
@@ -0,0 +1,132 @@
+"""
+分割结果可视化渲染模块
+将所有实例掩码合成为一张标签图，用颜色查找表一次完成uint8半透明叠加
+"""
+
+import logging
+import numpy as np
+import cv2
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import mask_codec
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 类别颜色（BGR）
+CATEGORY_COLORS = {
+    '观察': (0, 255, 0),    # 绿色
+    '手术': (0, 0, 255),    # 红色
+    '未知': (255, 255, 0)   # 青色
+}
+DEFAULT_COLOR = (255, 255, 255)
+
+
+def decode_instance_masks(masks: Sequence[Dict], image_size: Tuple[int, int]) -> List[Tuple[np.ndarray, int, int]]:
+    """
+    将结果中的编码掩码解码为裁剪区域
+
+    Args:
+        masks: segmentation_masks 列表，元素含 mask 字段（png/rle/bitpack）
+        image_size: 渲染目标图像尺寸 (W, H)
+
+    Returns:
+        (布尔裁剪掩码, x0, y0) 列表；掩码尺寸与图像不一致时按最近邻缩放
+    """
+    width, height = image_size
+    decoded = []
+    for mask_data in masks:
+        encoded = mask_data.get('mask')
+        if not encoded:
+            decoded.append(None)
+            continue
+        crop, (x0, y0, x1, y1), (mask_h, mask_w) = mask_codec.decode_crop(encoded)
+        if (mask_w, mask_h) != (width, height):
+            # 掩码坐标系与图像不同（如模拟数据或draft解码），把裁剪区域按比例映射过去
+            sx, sy = width / mask_w, height / mask_h
+            nx0, ny0 = int(x0 * sx), int(y0 * sy)
+            nx1, ny1 = max(nx0 + 1, int(round(x1 * sx))), max(ny0 + 1, int(round(y1 * sy)))
+            if crop.size:
+                crop = cv2.resize(crop.astype(np.uint8), (nx1 - nx0, ny1 - ny0),
+                                  interpolation=cv2.INTER_NEAREST).astype(bool)
+            x0, y0 = nx0, ny0
+        decoded.append((crop, x0, y0))
+    return decoded
+
+
+def build_label_map(shape: Tuple[int, int], crops: Sequence[Optional[Tuple[np.ndarray, int, int]]]):
+    """
+    把所有实例写入同一张标签图，0为背景，i+1为第i个实例（后面的实例覆盖前面的）
+
+    Returns:
+        (标签图, 前景并集边界框 (x0, y0, x1, y1) 或 None)
+    """
+    height, width = shape
+    dtype = np.uint8 if len(crops) < 255 else np.uint16
+    label_map = np.zeros((height, width), dtype=dtype)
+    union = None
+    for idx, item in enumerate(crops):
+        if item is None:
+            continue
+        crop, x0, y0 = item
+        # 裁剪到图像范围内
+        x1, y1 = min(width, x0 + crop.shape[1]), min(height, y0 + crop.shape[0])
+        if x1 <= x0 or y1 <= y0:
+            continue
+        crop = crop[:y1 - y0, :x1 - x0]
+        label_map[y0:y1, x0:x1][crop] = idx + 1
+        union = (x0, y0, x1, y1) if union is None else (
+            min(union[0], x0), min(union[1], y0), max(union[2], x1), max(union[3], y1))
+    return label_map, union
+
+
+def render_overlay(image: np.ndarray, crops: Sequence[Optional[Tuple[np.ndarray, int, int]]],
+                   categories: Sequence[str]) -> np.ndarray:
+    """
+    渲染半透明叠加图
+
+    所有实例在一次uint8运算中完成50%混合：
+    (a >> 1) + (b >> 1) + (a & b & 1) 等于 floor((a + b) / 2)，不需要浮点中间结果
+
+    Args:
+        image: BGR uint8图像 (H, W, 3)，不会被修改
+        crops: decode_instance_masks 的返回值
+        categories: 与crops对应的类别名称
+    """
+    overlay = image.copy()
+    label_map, union = build_label_map(image.shape[:2], crops)
+    if union is None:
+        return overlay
+
+    # 颜色查找表：第0行是背景占位
+    lut = np.zeros((len(crops) + 1, 3), dtype=np.uint8)
+    for idx, category in enumerate(categories):
+        lut[idx + 1] = CATEGORY_COLORS.get(category, DEFAULT_COLOR)
+
+    # 只在前景并集区域内计算
+    x0, y0, x1, y1 = union
+    labels = label_map[y0:y1, x0:x1]
+    region = overlay[y0:y1, x0:x1]
+    colors = lut[labels]
+    blended = (region >> 1) + (colors >> 1) + (region & colors & 1)
+    foreground = labels > 0
+    region[foreground] = blended[foreground]
+    return overlay
+
+
+def encode_image(image: np.ndarray, ext: str = '.jpg', quality: int = 90) -> bytes:
+    """将BGR图像编码为字节"""
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality] if ext in ('.jpg', '.jpeg') else []
+    ok, buffer = cv2.imencode(ext, image, params)
+    if not ok:
+        raise ValueError(f"图像编码失败: {ext}")
+    return buffer.tobytes()
+
+
+def render_mask_png(crop: np.ndarray, x0: int, y0: int, image_size: Tuple[int, int]) -> bytes:
+    """把单个实例裁剪掩码还原为整幅PNG（仅在需要输出单独掩码文件时调用）"""
+    width, height = image_size
+    full = np.zeros((height, width), dtype=np.uint8)
+    x1, y1 = min(width, x0 + crop.shape[1]), min(height, y0 + crop.shape[0])
+    full[y0:y1, x0:x1][crop[:y1 - y0, :x1 - x0]] = 255
+    return encode_image(full, '.png')